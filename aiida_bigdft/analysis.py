@@ -0,0 +1,189 @@
+"""
+Columnar results of many BigDFT calculations
+
+The scalar results stored in the `output_parameters` of the calculations are
+fetched with a single projected query, without loading any node. Calculations
+parsed before these outputs existed can have their logs streamed instead, in
+a pool of processes.
+
+Usage::
+
+    from aiida_bigdft.analysis import gather
+    table = gather(group)
+    table["energy"].min()
+    table.save("results.npz")
+"""
+import concurrent.futures
+import multiprocessing
+
+import numpy as np
+
+from aiida.manage import get_manager
+from aiida.orm import CalcJobNode, Dict, Group, QueryBuilder, load_node
+
+from aiida_bigdft.data.BigDFTFile import BigDFTLogfile
+from aiida_bigdft.utils.streaming import parse_log_stream, summary_parameters
+
+PROCESS_TYPE = "aiida.calculations:bigdft"
+
+# floating point columns, see `summary_parameters`
+COLUMNS = (
+    "energy",
+    "fermi_energy",
+    "homo",
+    "lumo",
+    "homo_lumo_gap",
+    "forces_max",
+    "forces_fnrm2",
+    "scf_iterations",
+    "walltime",
+    "memory_peak",
+)
+
+
+class ResultsTable:
+    """
+    Table of results, one NumPy array per column
+
+    Besides `COLUMNS`, which are NaN where a result is missing, `pk` and `uuid`
+    identify the calculations.
+
+    :param columns: dictionary of column name to array
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["pk"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def to_dataframe(self):
+        """
+        Return the table as a pandas DataFrame, indexed by pk
+        """
+        import pandas  # pylint: disable=import-outside-toplevel
+
+        return pandas.DataFrame(self.columns).set_index("pk")
+
+    def save(self, path):
+        """
+        Save the table as NumPy `.npz` archive or, with pandas and pyarrow, as Parquet
+        """
+        if str(path).endswith(".parquet"):
+            self.to_dataframe().to_parquet(path)
+        else:
+            np.savez_compressed(path, **self.columns)
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        Return the table stored in an ArrayData, such as the results of a sweep
+        """
+        return cls({name: array.get_array(name) for name in array.get_arraynames()})
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table saved as `.npz` archive
+        """
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+
+def _init_worker(profile):
+    """
+    Load the profile of the parent process in a worker
+
+    The profile itself is passed, rather than its name, so that profiles
+    missing from the configuration (such as temporary test profiles) work too.
+    """
+    from aiida import load_profile  # pylint: disable=import-outside-toplevel
+
+    load_profile(profile, allow_switch=True)
+
+
+def extract(pk):
+    """
+    Stream the logfile of pk `pk`, returning its scalar results
+    """
+    with load_node(pk).open(mode="rb") as stream:
+        return summary_parameters(parse_log_stream(stream))
+
+
+def gather(group=None, filters=None, parse_missing=True, workers=None, batch_size=1000):
+    """
+    Gather the scalar results of BigDFT calculations into a table
+
+    :param group: only calculations of this group
+    :param filters: additional QueryBuilder filters on the calculations
+    :param parse_missing: stream the logs of calculations without `output_parameters`
+    :param workers: number of processes parsing logs, 0 to parse in this
+        process, defaults to the number of CPUs
+    :param batch_size: number of rows fetched from the database at a time
+    :returns: ResultsTable sorted by pk
+    """
+
+    def query(cls, label, project):
+        qb = QueryBuilder()
+        if group is not None:
+            qb.append(Group, filters={"id": group.pk}, tag="group")
+            qb.append(CalcJobNode, with_group="group", tag="calc", project=["id", "uuid"])
+        else:
+            qb.append(CalcJobNode, tag="calc", project=["id", "uuid"])
+        qb.add_filter("calc", {"process_type": PROCESS_TYPE, **(filters or {})})
+        qb.append(cls, with_incoming="calc", edge_filters={"label": label}, project=project)
+        return qb.iterall(batch_size=batch_size)
+
+    rows = {}
+    projections = [f"attributes.{column}" for column in COLUMNS]
+    for pk, uuid, *values in query(Dict, "output_parameters", projections):
+        rows[pk] = (uuid, values)
+
+    if parse_missing:
+        missing = {
+            logfile: (pk, uuid)
+            for pk, uuid, logfile in query(BigDFTLogfile, "logfile", "id")
+            if pk not in rows
+        }
+        for logfile, parameters in zip(missing, _map(extract, list(missing), workers)):
+            pk, uuid = missing[logfile]
+            rows[pk] = (uuid, [parameters.get(column) for column in COLUMNS])
+
+    pks = sorted(rows)
+    columns = {
+        "pk": np.array(pks, dtype=np.int64),
+        "uuid": np.array([rows[pk][0] for pk in pks], dtype="U36"),
+    }
+    values = np.array(
+        [[np.nan if value is None else value for value in rows[pk][1]] for pk in pks],
+        dtype=float,
+    ).reshape(len(pks), len(COLUMNS))
+    for index, column in enumerate(COLUMNS):
+        columns[column] = values[:, index]
+    return ResultsTable(columns)
+
+
+def _map(func, items, workers):
+    """
+    Map `func` over `items` in a pool of `workers` processes with the current profile
+    """
+    if not items:
+        return []
+    if workers == 0:
+        return [func(item) for item in items]
+
+    profile = get_manager().get_profile()
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(profile,),
+    )
+    with executor:
+        return list(executor.map(func, items, chunksize=max(1, len(items) // (4 * (workers or 8)))))
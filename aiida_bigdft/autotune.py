@@ -0,0 +1,244 @@
+"""
+Choice of the resources of BigDFT calculations from the timings of past runs
+
+A cost model of the time to solution is fitted to the `timing` outputs of
+stored calculations, with the number of atoms and grid spacing of their
+inputs and the MPI/OpenMP split they ran with. The workload of a run is
+`W = natoms**exponent * (h0 / h)**3`, `h` being its mean grid spacing and
+`h0` the default one, and its time is modelled as
+
+    T = c0 W / (P t) + c1 W / P + c2 W + c3 P + c4
+
+for `P` MPI processes of `t` OpenMP threads: work parallelised over both
+processes and threads, over processes only, serial work, a communication
+overhead per process and a constant setup time. The coefficients are fitted
+by non-negative least squares on the relative error, for each exponent of
+`EXPONENTS`, keeping the best.
+
+The model then ranks the splits of whole machines for a new structure, by
+core-hours or time to solution::
+
+    from aiida_bigdft.autotune import CostModel, gather_samples, tune
+    model = CostModel.fit(gather_samples(group))
+    tune(builder, model, max_machines=4, objective="time")
+"""
+import numpy as np
+
+from aiida.orm import ArrayData, CalcJobNode, Data, Group, QueryBuilder, StructureData
+
+from aiida_bigdft.utils.input_variables import get_schema
+from aiida_bigdft.utils.timing import summarise
+
+PROCESS_TYPE = "aiida.calculations:bigdft"
+
+OBJECTIVES = ("core_hours", "time")
+
+# exponents of the number of atoms tried for the workload
+EXPONENTS = (1.0, 1.5, 2.0, 2.5, 3.0)
+
+
+def default_hgrids():
+    """Return the default grid spacing (Bohr)"""
+    return float(np.mean(get_schema().defaults["dft"]["hgrids"]))
+
+
+def gather_samples(group=None, filters=None):
+    """
+    Gather the size, grid, resources and time of past BigDFT calculations
+
+    Only calculations with a `timing` output are used, their time being the
+    total of their time report, and their MPI/OpenMP split the one reported by
+    BigDFT.
+
+    :param group: only calculations of this group
+    :param filters: additional QueryBuilder filters on the calculations
+    :returns: list of dictionaries of `natoms`, `hgrids` (Bohr), `num_machines`,
+        `mpi_tasks`, `omp_threads` and `time` (s)
+    """
+    qb = QueryBuilder()
+    if group is not None:
+        qb.append(Group, filters={"id": group.pk}, tag="group")
+        qb.append(CalcJobNode, with_group="group", tag="calc", project=["attributes.resources"])
+    else:
+        qb.append(CalcJobNode, tag="calc", project=["attributes.resources"])
+    qb.add_filter("calc", {"process_type": PROCESS_TYPE, **(filters or {})})
+    qb.append(StructureData, with_outgoing="calc", edge_filters={"label": "structure"}, project=["attributes.sites"])
+    # BigDFTParameters are not queried as Dict, their node type being outside of its namespace
+    qb.append(Data, with_outgoing="calc", edge_filters={"label": "parameters"}, project=["attributes.dft"], outerjoin=True)
+    qb.append(ArrayData, with_incoming="calc", edge_filters={"label": "timing"}, project=["*"])
+
+    samples = []
+    for resources, sites, dft, timing in qb.iterall():
+        summary = summarise(timing)
+        hgrids = (dft or {}).get("hgrids")
+        samples.append(
+            {
+                "natoms": len(sites or []),
+                "hgrids": default_hgrids() if hgrids is None else float(np.mean(hgrids)),
+                "num_machines": (resources or {}).get("num_machines") or 1,
+                "mpi_tasks": summary["mpi_tasks"] or 1,
+                "omp_threads": summary["omp_threads"] or 1,
+                "time": summary["time"],
+            }
+        )
+    return samples
+
+
+def workload(natoms, hgrids, exponent):
+    """Return the workload of `natoms` atoms on a grid of spacing `hgrids` (Bohr)"""
+    return np.asarray(natoms, dtype=float) ** exponent * (default_hgrids() / np.asarray(hgrids, dtype=float)) ** 3
+
+
+def features(work, mpi_tasks, omp_threads):
+    """Return the `(n, 5)` terms of the cost model, see the module documentation"""
+    work, mpi_tasks, omp_threads = np.broadcast_arrays(
+        np.asarray(work, dtype=float), np.asarray(mpi_tasks, dtype=float), np.asarray(omp_threads, dtype=float)
+    )
+    return np.stack(
+        [work / (mpi_tasks * omp_threads), work / mpi_tasks, work, mpi_tasks, np.ones_like(work)], axis=-1
+    )
+
+
+def nonnegative_lstsq(matrix, target):
+    """
+    Solve `matrix @ x = target` in the least squares sense with `x >= 0`
+
+    Negative coefficients are dropped from the active terms until none is left.
+    """
+    active = np.ones(matrix.shape[1], dtype=bool)
+    coefficients = np.zeros(matrix.shape[1])
+    while active.any():
+        solution = np.linalg.lstsq(matrix[:, active], target, rcond=None)[0]
+        if (solution >= 0).all():
+            coefficients[active] = solution
+            break
+        indices = np.flatnonzero(active)
+        active[indices[solution < 0]] = False
+    return coefficients
+
+
+class CostModel:
+    """
+    Model of the time to solution of BigDFT calculations, see the module documentation
+
+    :param exponent: exponent of the number of atoms in the workload
+    :param coefficients: the five coefficients of the model (s)
+    :param error: root mean square relative error of the fit
+    """
+
+    def __init__(self, exponent, coefficients, error=None):
+        self.exponent = exponent
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.error = error
+
+    @classmethod
+    def fit(cls, samples, exponents=EXPONENTS):
+        """
+        Fit the model to samples, as returned by `gather_samples`
+
+        :raises ValueError: with fewer samples than coefficients
+        """
+        if len(samples) < 5:
+            raise ValueError(f"at least 5 timed calculations are needed to fit the cost model, got {len(samples)}")
+        natoms, hgrids, mpi_tasks, omp_threads, times = (
+            np.array([sample[key] for sample in samples], dtype=float)
+            for key in ("natoms", "hgrids", "mpi_tasks", "omp_threads", "time")
+        )
+
+        best = None
+        for exponent in exponents:
+            # each row is divided by its time, so that the relative error is minimised
+            matrix = features(workload(natoms, hgrids, exponent), mpi_tasks, omp_threads) / times[:, None]
+            coefficients = nonnegative_lstsq(matrix, np.ones_like(times))
+            error = float(np.sqrt(np.mean((matrix @ coefficients - 1.0) ** 2)))
+            if best is None or error < best.error:
+                best = cls(exponent, coefficients, error)
+        return best
+
+    def predict(self, natoms, hgrids, mpi_tasks, omp_threads):
+        """
+        Return the predicted time to solution (s)
+
+        :param natoms: number of atoms
+        :param hgrids: mean grid spacing (Bohr)
+        :param mpi_tasks: total number of MPI processes
+        :param omp_threads: number of OpenMP threads per process
+        """
+        return features(workload(natoms, hgrids, self.exponent), mpi_tasks, omp_threads) @ self.coefficients
+
+    def rank(self, natoms, hgrids, cores_per_machine, max_machines=1, objective="core_hours", max_time=None):
+        """
+        Rank the splits of up to `max_machines` whole machines for a calculation
+
+        Every split uses all the cores of its machines, as
+        `num_mpiprocs_per_machine * num_cores_per_mpiproc = cores_per_machine`.
+
+        :param natoms: number of atoms
+        :param hgrids: mean grid spacing (Bohr)
+        :param cores_per_machine: number of cores of a machine
+        :param max_machines: largest number of machines
+        :param objective: one of `OBJECTIVES`, the other one breaking ties
+        :param max_time: leave out splits predicted to take longer (s)
+        :returns: list of dictionaries of `resources`, predicted `time` (s) and
+            `core_hours`, best first
+        :raises ValueError: for an unknown objective
+        """
+        if objective not in OBJECTIVES:
+            raise ValueError(f"unknown objective {objective!r}, expected one of {', '.join(OBJECTIVES)}")
+
+        candidates = []
+        for machines in range(1, max_machines + 1):
+            for processes in range(1, cores_per_machine + 1):
+                if cores_per_machine % processes:
+                    continue
+                threads = cores_per_machine // processes
+                time = float(self.predict(natoms, hgrids, machines * processes, threads))
+                if max_time is not None and time > max_time:
+                    continue
+                candidates.append(
+                    {
+                        "resources": {
+                            "num_machines": machines,
+                            "num_mpiprocs_per_machine": processes,
+                            "num_cores_per_mpiproc": threads,
+                        },
+                        "time": time,
+                        "core_hours": time * machines * cores_per_machine / 3600,
+                    }
+                )
+
+        other = OBJECTIVES[1 - OBJECTIVES.index(objective)]
+        return sorted(candidates, key=lambda candidate: (candidate[objective], candidate[other]))
+
+
+def tune(builder, model, cores_per_machine=None, max_machines=1, objective="core_hours", max_time=None, apply=True):
+    """
+    Suggest, and by default set, the resources of a BigDFTCalculation builder
+
+    :param builder: ProcessBuilder of a BigDFTCalculation, with its code and structure
+    :param model: fitted CostModel
+    :param cores_per_machine: defaults to the default MPI processes per machine of the computer
+    :param apply: set the suggested resources in the options of the builder,
+        with their total number of MPI processes
+    :returns: the best candidate of `CostModel.rank`
+    :raises ValueError: if no split is predicted to finish within `max_time`
+    """
+    if cores_per_machine is None:
+        cores_per_machine = builder.code.computer.get_default_mpiprocs_per_machine()
+        if cores_per_machine is None:
+            raise ValueError("the computer has no default number of processes per machine, set cores_per_machine")
+
+    parameters = builder.get("parameters")
+    hgrids = (parameters.get_dict().get("dft", {}) if parameters is not None else {}).get("hgrids")
+    hgrids = default_hgrids() if hgrids is None else float(np.mean(hgrids))
+
+    candidates = model.rank(len(builder.structure.sites), hgrids, cores_per_machine, max_machines, objective, max_time)
+    if not candidates:
+        raise ValueError(f"no split of up to {max_machines} machines is predicted to finish in {max_time} s")
+    best = candidates[0]
+    if apply:
+        resources = dict(best["resources"])
+        # read by the BigDFT wrapper, see `BigDFTCalculation.dump_submission_parameters`
+        resources["tot_num_mpiprocs"] = resources["num_machines"] * resources["num_mpiprocs_per_machine"]
+        builder.metadata.options.resources = resources
+    return best
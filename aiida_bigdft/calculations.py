@@ -7,14 +7,21 @@ import getpass
 import os
 from datetime import datetime
 
+import numpy as np
+
 import aiida.orm
-import yaml
-from aiida.common import datastructures
+from aiida.common import datastructures, exceptions
+from aiida.common.hashing import make_hash
 from aiida.engine import CalcJob
+from aiida.engine.processes.calcjobs.calcjob import validate_calc_job
 from aiida.orm import User
+from aiida.orm.nodes.process.calculation.calcjob import CalcJobNode, CalcJobNodeCaching
 
 from aiida_bigdft.data.BigDFTParameters import BigDFTParameters
 from aiida_bigdft.data.BigDFTFile import BigDFTFile, BigDFTLogfile
+from aiida_bigdft.monitors import SCF_MONITOR_FILENAME
+from aiida_bigdft.utils import posinp, serialisation
+from aiida_bigdft.utils.compression import CODECS
 
 try:
     from aiida_bigdft.paths import DEBUG_PATHS
@@ -39,6 +46,122 @@ def debug(msg, wipe=False, time=True):
         o.write(f'[{timestr}] {msg}\n')
 
 
+def validate_compression(value, _):
+    """Check that the compression of the stored files is a known codec"""
+    if value is not None and value not in CODECS:
+        return f"unknown compression {value!r}, expected one of {CODECS}"
+
+
+# structure formats, "ase" being the ASE json read by the wrapper of earlier versions,
+# which keeps the cell and periodicity as given
+STRUCTURE_FORMATS = posinp.FORMATS + ("ase",)
+
+
+def validate_structure_format(value, _):
+    """Check that the structure format is known"""
+    if value is not None and value not in STRUCTURE_FORMATS:
+        return f"unknown structure format {value!r}, expected one of {STRUCTURE_FORMATS}"
+
+
+# options which only change file names, staging or storage, not the results
+HASH_IGNORED_OPTIONS = (
+    "jobname",
+    "local_dir",
+    "stderr_tail",
+    "compression",
+    "structure_format",
+    "packing",
+    "submit_script_filename",
+    "scheduler_stdout",
+    "scheduler_stderr",
+)
+
+# cell vectors and positions (Angstrom) rounded to this precision are hashed
+STRUCTURE_HASH_TOLERANCE = 1e-5
+
+
+def structure_hash(structure, tolerance=STRUCTURE_HASH_TOLERANCE):
+    """
+    Hash a structure with its cell and positions rounded to `tolerance`
+
+    Structures whose coordinates only differ by numerical noise hash
+    identically. Sites are not reordered, as the outputs follow their order.
+
+    :param structure: StructureData
+    :param tolerance: precision of the coordinates, in Angstrom
+    :returns: hash string
+    """
+
+    def rounded(values):
+        return np.rint(np.asarray(values, dtype=float) / tolerance).astype(np.int64).tolist()
+
+    return make_hash(
+        {
+            "cell": rounded(structure.cell),
+            "pbc": list(structure.pbc),
+            "kinds": sorted(
+                (kind.name, list(kind.symbols), list(kind.weights), round(kind.mass, 6)) for kind in structure.kinds
+            ),
+            "sites": [(site.kind_name, rounded(site.position)) for site in structure.sites],
+        }
+    )
+
+
+class BigDFTCalcJobNodeCaching(CalcJobNodeCaching):
+    """
+    Hash of BigDFT calculations, restricted to the inputs changing their results
+
+    The options of `HASH_IGNORED_OPTIONS` are left out, and the structures are
+    hashed with a tolerance, see `structure_hash`. `BigDFTParameters` hash
+    their canonical form themselves.
+    """
+
+    def get_objects_to_hash(self):
+        objects = super().get_objects_to_hash()
+        for name in HASH_IGNORED_OPTIONS:
+            objects["attributes"].pop(name, None)
+
+        for label in objects["inputs"]:
+            entry = self._node.base.links.get_incoming(link_label_filter=label).first()
+            if isinstance(entry.node, aiida.orm.StructureData):
+                objects["inputs"][label] = structure_hash(entry.node)
+        return objects
+
+
+class BigDFTCalcJobNode(CalcJobNode):
+    """
+    Node of BigDFT calculations, hashed with `BigDFTCalcJobNodeCaching`
+
+    It is registered as the `process.calculation.calcjob.bigdft` entry point
+    of `aiida.node`, so that loaded nodes, and `verdi node rehash`, use the
+    same hash as the cache lookup. Its type string extends the one of
+    CalcJobNode, which queries of CalcJobNode still match.
+    """
+
+    _CLS_NODE_CACHING = BigDFTCalcJobNodeCaching
+
+
+# inputpsiid reading the orbitals from files, for cubic and linear scaling calculations
+RESTART_INPUTPSIID = {"cubic": 2, "linear": 12}
+
+
+def restart_parameters(parameters):
+    """
+    Return the parameters reading the input orbitals from files
+
+    The linear scaling restart is used when the parameters import the `linear`
+    profile or set `lin_*` sections. An `inputpsiid` set in the parameters is kept.
+
+    :param parameters: dictionary of BigDFT input parameters
+    :returns: updated copy of the dictionary
+    """
+    dft = parameters.get("dft", {})
+    if "inputpsiid" in dft:
+        return parameters
+    linear = parameters.get("import") == "linear" or any(str(section).startswith("lin_") for section in parameters)
+    return {**parameters, "dft": {**dft, "inputpsiid": RESTART_INPUTPSIID["linear" if linear else "cubic"]}}
+
+
 class BigDFTCalculation(CalcJob):
     """
     AiiDA calculation plugin wrapping the diff executable.
@@ -46,6 +169,7 @@ class BigDFTCalculation(CalcJob):
     Simple AiiDA plugin wrapper for 'diffing' two files.
     """
 
+    _node_class = BigDFTCalcJobNode
     _posinp = "posinp.xyz"
     _inpfile = "input.yaml"
     _logfile = "log.yaml"
@@ -70,11 +194,53 @@ class BigDFTCalculation(CalcJob):
                    help="staging directory for local files")
         spec.input("structure", valid_type=aiida.orm.StructureData)
         spec.input("parameters", valid_type=BigDFTParameters, default=lambda: BigDFTParameters())
+        spec.input("parent_folder",
+                   valid_type=aiida.orm.RemoteData,
+                   required=False,
+                   help="remote folder of a previous calculation on the same computer, whose orbitals "
+                        "are copied to restart from, or a directory of orbitals")
         spec.input("metadata.options.jobname", valid_type=str)
+        spec.input("metadata.options.stderr_tail",
+                   valid_type=int,
+                   required=False,
+                   help="only scan the last bytes of the scheduler stderr for errors")
+        spec.input("metadata.options.summary_tail",
+                   valid_type=int,
+                   required=False,
+                   help="only read the final results from the last bytes of the log, "
+                        "falling back to the whole log if they are not all there")
+        spec.input("metadata.options.compression",
+                   valid_type=str,
+                   required=False,
+                   validator=validate_compression,
+                   help="store the logfile and timefile compressed, with one of " + ", ".join(CODECS))
+        spec.input("metadata.options.structure_format",
+                   valid_type=str,
+                   default="ase",
+                   validator=validate_structure_format,
+                   help="format of the structure file, one of " + ", ".join(STRUCTURE_FORMATS)
+                        + ": the ASE json (structure.json) by default, or a BigDFT posinp, "
+                          "much faster to write for large structures")
 
         # outputs
         spec.output("logfile", valid_type=BigDFTLogfile)
         spec.output("timefile", valid_type=BigDFTFile)
+        spec.output("output_parameters",
+                    valid_type=aiida.orm.Dict,
+                    required=False,
+                    help="energy, Fermi level, SCF iterations, wall time and memory peak")
+        spec.output("output_arrays",
+                    valid_type=aiida.orm.ArrayData,
+                    required=False,
+                    help="final forces and positions")
+        spec.output("trajectory",
+                    valid_type=aiida.orm.TrajectoryData,
+                    required=False,
+                    help="positions, energies and forces of each step of multi-step runs")
+        spec.output("timing",
+                    valid_type=aiida.orm.ArrayData,
+                    required=False,
+                    help="time, percentage and load of each class and category of operations")
 
         spec.exit_code(100, 'ERROR_MISSING_OUTPUT_FILES',
                        message='Calculation did not produce all expected output files.')
@@ -84,6 +250,8 @@ class BigDFTCalculation(CalcJob):
                        message='Calculation did not finish because of a walltime issue.')
         spec.exit_code(401, 'ERROR_OUT_OF_MEMORY',
                        message='Calculation did not finish because of memory limit')
+        spec.exit_code(402, 'ERROR_SCF_NOT_CONVERGING',
+                       message='Calculation was killed by the SCF monitor: {message}')
 
     def prepare_for_submission(self, folder):
         """
@@ -96,53 +264,132 @@ class BigDFTCalculation(CalcJob):
 
         debug(f'operating in dir {os.getcwd()}')
 
+        # aiida calcinfo setup
+        jobname = self.metadata.options.jobname
+        parameters = self.inputs.parameters.get_dict()
+        remote_copy_list = []
+        if "parent_folder" in self.inputs:
+            parameters = restart_parameters(parameters)
+            remote_copy_list = self.restart_copy_list(jobname)
+        codeinfo = self.write_inputs(folder, self.inputs.structure, parameters, jobname)
+
+        # Prepare a `CalcInfo` to be returned to the engine
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = [codeinfo]
+        calcinfo.local_copy_list = [
+        ]
+        calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.retrieve_list = self.output_files(jobname) + [
+            ["./debug/bigdft-err*", ".", 2],
+            SCF_MONITOR_FILENAME,
+        ]
+
+        return calcinfo
+
+    @staticmethod
+    def output_files(jobname):
+        """
+        Return the paths of the logfile and timefile of the calculation `jobname`
+        """
+        return [
+            f'log-{jobname}.yaml',
+            f"./data-{jobname}/time-{jobname}.yaml",
+        ]
+
+    def restart_copy_list(self, jobname):
+        """
+        Return the remote copy of the orbitals of `parent_folder` to the data directory of `jobname`
+
+        The orbitals of a BigDFT calculation are in its `data-<jobname>` directory,
+        the job name being that of the calculation which actually ran for cached
+        calculations. Folders not created by a calculation are copied as a whole.
+
+        :raises aiida.common.exceptions.InputValidationError: if the parent
+            folder is on another computer
+        """
+        parent = self.inputs.parent_folder
+        if parent.computer.uuid != self.node.computer.uuid:
+            raise exceptions.InputValidationError(
+                f"parent_folder is on {parent.computer.label}, cannot restart on {self.node.computer.label}"
+            )
+
+        source = parent.get_remote_path()
+        creator = parent.creator
+        if creator is not None:
+            cache_source = creator.base.caching.get_cache_source()
+            if cache_source is not None:
+                creator = aiida.orm.load_node(cache_source)
+            parent_jobname = creator.base.attributes.get("jobname", None)
+            if parent_jobname is not None:
+                source = os.path.join(source, f"data-{parent_jobname}")
+
+        return [(parent.computer.uuid, source, f"data-{jobname}")]
+
+    def write_inputs(self, folder, structure, parameters, jobname, directory=None, resources=None):
+        """
+        Write the structure, parameters and submission parameters of a calculation
+
+        :param folder: an `aiida.common.folders.Folder`
+        :param structure: StructureData
+        :param parameters: dictionary of BigDFT input parameters
+        :param jobname: name of the calculation, and of its output files
+        :param directory: subfolder the files are written to, the top folder by default
+        :param resources: resources of the calculation, defaults to those of the job
+        :returns: `aiida.common.datastructures.CodeInfo` running the calculation
+        """
+        prefix = ''
+        if directory is not None:
+            folder = folder.get_subfolder(directory, create=True)
+            prefix = directory + '/'
+
         # dump structure
-        structure_fname = 'structure.json'
-        with folder.open(structure_fname, 'w') as o:
-            self.inputs.structure.get_ase().write(o)
+        structure_format = self.metadata.options.structure_format
+        if structure_format == 'ase':
+            structure_fname = 'structure.json'
+            with folder.open(structure_fname, 'w') as o:
+                structure.get_ase().write(o)
+        else:
+            structure_fname = posinp.FILENAMES[structure_format]
+            with folder.open(structure_fname, 'w') as o:
+                posinp.write_posinp(structure, o, structure_format)
         debug(f'structure written to file {structure_fname}', wipe=True)
 
         # dump params
-        debug(f'dumping params {self.inputs.parameters}')
+        debug(f'dumping params {parameters}')
         params_fname = 'input.yaml'
         with folder.open(params_fname, 'w') as o:
-            yaml.dump(self.inputs.parameters.get_dict(), o)
+            serialisation.dump(parameters, o)
         debug(f'parameters written to file {params_fname}')
 
         # submission parameters
-        jobname = self.metadata.options.jobname
-        sub_params_file = self.dump_submission_parameters(folder)
+        sub_params_file = self.dump_submission_parameters(folder, jobname, resources)
 
-        # aiida calcinfo setup
         codeinfo = datastructures.CodeInfo()
 
         codeinfo.code_uuid = self.inputs.code.uuid
-        codeinfo.cmdline_params = ['--structure', structure_fname,
-                                   '--parameters', params_fname,
-                                   '--submission', sub_params_file]
-
-        # Prepare a `CalcInfo` to be returned to the engine
-        calcinfo = datastructures.CalcInfo()
-        calcinfo.codes_info = [codeinfo]
-        calcinfo.local_copy_list = [
-        ]
-        calcinfo.retrieve_list = [
-            f'log-{jobname}.yaml',
-            f"./data-{jobname}/time-{jobname}.yaml",
-            ["./debug/bigdft-err*", ".", 2],
-        ]
+        codeinfo.cmdline_params = ['--structure', prefix + structure_fname,
+                                   '--parameters', prefix + params_fname,
+                                   '--submission', prefix + sub_params_file]
+        return codeinfo
 
-        return calcinfo
+    def dump_submission_parameters(self, folder, jobname=None, resources=None):
+        """
+        Write the submission parameters read by the BigDFT wrapper
 
-    def dump_submission_parameters(self, folder):
+        :param folder: an `aiida.common.folders.Folder`
+        :param jobname: name of the calculation, defaults to the `jobname` option
+        :param resources: resources of the calculation, defaults to those of the job
+        :returns: name of the file
+        """
         sub_params_file = 'submission_parameters.yaml'
-        sub_params = {"jobname": self.metadata.options.jobname}
+        sub_params = {"jobname": jobname or self.metadata.options.jobname}
 
-        sub_params["OMP"] = self.metadata.options.resources.get("num_cores_per_mpiproc", None)
-        sub_params["mpi"] = self.metadata.options.resources.get("tot_num_mpiprocs", None)
-        sub_params["nodes"] = self.metadata.options.resources.get("num_machines", None)
+        resources = resources or self.metadata.options.resources
+        sub_params["OMP"] = resources.get("num_cores_per_mpiproc", None)
+        sub_params["mpi"] = resources.get("tot_num_mpiprocs", None)
+        sub_params["nodes"] = resources.get("num_machines", None)
 
-        sub_params["aiida_resources"] = self.metadata.options.resources
+        sub_params["aiida_resources"] = resources
 
         computer = self.node.computer
         user = User.objects.get_default()
@@ -155,6 +402,149 @@ class BigDFTCalculation(CalcJob):
 
         debug(f'dumping submission params {sub_params}')
         with folder.open(sub_params_file, 'w') as o:
-            yaml.dump(sub_params, o)
+            serialisation.dump(sub_params, o)
 
         return sub_params_file
+
+
+# ways of running the calculations of a packed job
+PACKING_MODES = ("serial", "parallel")
+
+
+def validate_packing(value, _):
+    """Check that the packing mode is known"""
+    if value is not None and value not in PACKING_MODES:
+        return f"unknown packing {value!r}, expected one of {PACKING_MODES}"
+
+
+def validate_packed_inputs(inputs, ctx):
+    """Check that every packed calculation has a structure, and that parameters are not orphaned"""
+    message = validate_calc_job(inputs, ctx)
+    if message:
+        return message
+
+    structures = inputs.get("structures", {})
+    if not structures:
+        return "no structures to calculate"
+    orphans = sorted(set(inputs.get("parameters", {})) - set(structures))
+    if orphans:
+        return f"parameters without a structure: {', '.join(orphans)}"
+
+
+class BigDFTPackedCalculation(BigDFTCalculation):
+    """
+    Several BigDFT calculations run in a single scheduler job
+
+    The calculations are given as `structures` and `parameters` namespaces,
+    keyed by the same labels. Their inputs are written to a subfolder per
+    label, and their outputs named after `<jobname>-<label>`, so that they are
+    parsed into the `<output>.<label>` outputs.
+
+    With the `serial` packing, the calculations run one after the other, each
+    with all the resources of the job. With the `parallel` packing, they run
+    at the same time, sharing the MPI processes (and machines) of the job
+    evenly, the first calculations getting one more process each when they
+    cannot be split evenly.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs and outputs of the calculation."""
+        super().define(spec)
+
+        spec.inputs["metadata"]["options"]["parser_name"].default = "bigdft.packed"
+
+        # inputs
+        spec.inputs.pop("structure")
+        spec.inputs.pop("parameters")
+        spec.inputs.pop("parent_folder")
+        spec.input_namespace("structures",
+                             valid_type=aiida.orm.StructureData,
+                             dynamic=True,
+                             help="structures of the calculations, by label")
+        spec.input_namespace("parameters",
+                             valid_type=BigDFTParameters,
+                             dynamic=True,
+                             help="parameters of the calculations, by label, "
+                                  "calculations without any using the defaults")
+        spec.input("metadata.options.packing",
+                   valid_type=str,
+                   default="serial",
+                   validator=validate_packing,
+                   help="run the calculations one after the other (serial) "
+                        "or sharing the resources (parallel), the MPI processes left "
+                        "over by an even split going to the first calculations")
+        spec.inputs.validator = validate_packed_inputs
+
+        # outputs, one per calculation
+        for name in ("logfile", "timefile", "output_parameters", "output_arrays", "trajectory", "timing"):
+            port = spec.outputs.pop(name)
+            spec.output_namespace(name, valid_type=port.valid_type, dynamic=True, help=port.help)
+
+        spec.exit_code(102, 'ERROR_PACKED_CALCULATION_FAILED',
+                       message='Some of the packed calculations did not produce their outputs.')
+
+    def item_resources(self, count):
+        """
+        Return the list of the resources of `count` calculations run with the `parallel` packing
+
+        The MPI processes are split evenly, the remainder of the split giving
+        one more process to each of the first calculations.
+
+        :raises aiida.common.exceptions.InputValidationError: if there are
+            fewer MPI processes than calculations
+        """
+        resources = dict(self.metadata.options.resources)
+        machines = resources.get("num_machines", 1)
+        total = resources.get("tot_num_mpiprocs") or machines * resources.get("num_mpiprocs_per_machine", 1)
+        if total < count:
+            raise exceptions.InputValidationError(
+                f"cannot run {count} calculations in parallel with {total} MPI processes"
+            )
+
+        machines = max(1, machines // count)
+        resources["num_machines"] = machines
+        if total % count:
+            self.report(
+                f"{total} MPI processes split over {count} calculations: the first {total % count} "
+                f"run with {total // count + 1} processes, the others with {total // count}"
+            )
+
+        items = []
+        for index in range(count):
+            processes = total // count + (index < total % count)
+            items.append(
+                {**resources, "tot_num_mpiprocs": processes, "num_mpiprocs_per_machine": max(1, processes // machines)}
+            )
+        return items
+
+    def prepare_for_submission(self, folder):
+        """
+        Create the input files of every calculation.
+
+        :param folder: an `aiida.common.folders.Folder` where the plugin should temporarily place all files
+            needed by the calculation.
+        :return: `aiida.common.datastructures.CalcInfo` instance
+        """
+        jobname = self.metadata.options.jobname
+        labels = sorted(self.inputs.structures)
+        parallel = self.metadata.options.packing == "parallel"
+        resources = self.item_resources(len(labels)) if parallel else [None] * len(labels)
+
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.codes_info = []
+        calcinfo.codes_run_mode = datastructures.CodeRunMode.PARALLEL if parallel else datastructures.CodeRunMode.SERIAL
+        calcinfo.local_copy_list = []
+        calcinfo.retrieve_list = []
+        for label, item_resources in zip(labels, resources):
+            parameters = self.inputs.get("parameters", {}).get(label, None) or BigDFTParameters()
+            parameters = parameters.get_dict()
+            calcinfo.codes_info.append(
+                self.write_inputs(
+                    folder, self.inputs.structures[label], parameters, f"{jobname}-{label}", label, item_resources
+                )
+            )
+            calcinfo.retrieve_list.extend(self.output_files(f"{jobname}-{label}"))
+        calcinfo.retrieve_list.append(["./debug/bigdft-err*", ".", 2])
+
+        return calcinfo
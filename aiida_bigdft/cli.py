@@ -5,15 +5,25 @@ Register new commands either via the "console_scripts" entry point or plug them
 directly into the 'verdi' command by using AiiDA-specific entry points like
 "aiida.cmdline.data" (both in the setup.json file).
 """
-import sys
+import datetime
+import json
 
 import click
+import numpy as np
+from tabulate import tabulate
 
 from aiida.cmdline.commands.cmd_data import verdi_data
-from aiida.cmdline.params.types import DataParamType
+from aiida.cmdline.params.types import DataParamType, GroupParamType
 from aiida.cmdline.utils import decorators
-from aiida.orm import QueryBuilder
-from aiida.plugins import DataFactory
+from aiida.common import timezone
+from aiida.orm import ArrayData, CalcJobNode, Group, QueryBuilder, SinglefileData
+
+from aiida_bigdft import analysis
+from aiida_bigdft.data.BigDFTFile import BigDFTFile, BigDFTLogfile
+from aiida_bigdft.data.BigDFTParameters import BigDFTParameters
+from aiida_bigdft.utils import timing
+from aiida_bigdft.utils.cache import DiskCache
+from aiida_bigdft.utils.export import copy_stream, export_to_directory, export_to_tar
 
 
 # See aiida.cmdline.data entry point in setup.json
@@ -22,40 +32,346 @@ def data_cli():
     """Command line interface for aiida-pybigdft-plugin"""
 
 
+# the entry point type strings of logfiles are not prefixed by those of files
+FILE_CLASSES = (BigDFTFile, BigDFTLogfile)
+
+# columns of `list`, and the width of the first ones in table output
+LIST_PROJECTIONS = ("id", "uuid", "ctime", "label")
+LIST_WIDTHS = (8, 36, 19)
+
+
+def _json_filters(ctx, param, value):  # pylint: disable=unused-argument
+    """Parse QueryBuilder filters given as JSON"""
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError as error:
+        raise click.BadParameter(f"invalid JSON: {error}") from error
+
+
 @data_cli.command("list")
+@click.option("--files", "-F", is_flag=True, help="List BigDFT files instead of parameters.")
+@click.option("--label", "-L", help="Only nodes whose label matches this pattern (% and _ wildcards).")
+@click.option("--past-days", "-p", type=click.IntRange(min=0), help="Only nodes created in the past N days.")
+@click.option(
+    "--filters",
+    "-f",
+    callback=_json_filters,
+    help='Additional QueryBuilder filters, as JSON (e.g. \'{"attributes.filename": {"like": "log-%"}}\').',
+)
+@click.option("--limit", "-l", type=click.IntRange(min=0), help="Maximum number of nodes listed.")
+@click.option("--offset", type=click.IntRange(min=0), default=0, help="Number of nodes skipped.")
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "json"]),
+    default="table",
+    show_default=True,
+    help="Output format.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="Number of rows fetched from the database at a time.",
+)
 @decorators.with_dbenv()
-def list_():  # pylint: disable=redefined-builtin
+def list_(files, label, past_days, filters, limit, offset, output_format, batch_size):  # pylint: disable=redefined-builtin
     """
-    Display all DiffParameters nodes
+    Display BigDFTParameters (or file) nodes, oldest first
+
+    Only the pk, uuid, creation time and label are queried, and rows are
+    written as they are fetched from the database.
     """
-    DiffParameters = DataFactory("pybigdft_plugin")
+    filters = dict(filters or {})
+    if label is not None:
+        filters["label"] = {"like": label}
+    if past_days is not None:
+        filters["ctime"] = {">": timezone.now() - datetime.timedelta(days=past_days)}
 
     qb = QueryBuilder()
-    qb.append(DiffParameters)
-    results = qb.all()
+    qb.append(FILE_CLASSES if files else BigDFTParameters, filters=filters, project=LIST_PROJECTIONS, tag="node")
+    qb.order_by({"node": {"id": "asc"}})
+    qb.offset(offset)
+    if limit is not None:
+        qb.limit(limit)
+
+    def table_row(*values):
+        return (" ".join(f"{value:<{width}}" for value, width in zip(values, LIST_WIDTHS)) + f" {values[-1]}").rstrip()
+
+    if output_format == "table":
+        click.echo(table_row("pk", "uuid", "ctime", "label"))
+    else:
+        click.echo("[")
+
+    previous = None
+    for pk, uuid, ctime, node_label in qb.iterall(batch_size=batch_size):
+        ctime = timezone.localtime(ctime).strftime("%Y-%m-%d %H:%M:%S")
+        if output_format == "table":
+            click.echo(table_row(pk, uuid, ctime, node_label))
+            continue
+        # a row is written once the next one is known, to place the commas
+        if previous is not None:
+            click.echo(f"  {previous},")
+        previous = json.dumps({"pk": pk, "uuid": uuid, "ctime": ctime, "label": node_label})
 
-    s = ""
-    for result in results:
-        obj = result[0]
-        s += f"{str(obj)}, pk: {obj.pk}\n"
-    sys.stdout.write(s)
+    if output_format == "json":
+        if previous is not None:
+            click.echo(f"  {previous}")
+        click.echo("]")
+
+
+def _select_files(groups, filters):
+    """
+    Return the BigDFT files matching `filters`, restricted to `groups` if given
+
+    The files of a group are those it contains and the outputs of its calculations
+    """
+    if not groups:
+        qb = QueryBuilder().append(FILE_CLASSES, filters=filters, project="*")
+        return qb.all(flat=True)
+
+    nodes = []
+    for with_calculation in (False, True):
+        qb = QueryBuilder()
+        qb.append(Group, filters={"id": {"in": [group.pk for group in groups]}}, tag="group")
+        if with_calculation:
+            qb.append(CalcJobNode, with_group="group", tag="calc")
+            qb.append(FILE_CLASSES, with_incoming="calc", filters=filters, project="*")
+        else:
+            qb.append(FILE_CLASSES, with_group="group", filters=filters, project="*")
+        nodes.extend(qb.all(flat=True))
+    return nodes
 
 
 @data_cli.command("export")
-@click.argument("node", metavar="IDENTIFIER", type=DataParamType())
+@click.argument("nodes", metavar="[IDENTIFIERS]...", type=DataParamType(), nargs=-1)
+@click.option(
+    "--group",
+    "-G",
+    "groups",
+    type=GroupParamType(),
+    multiple=True,
+    help="Export the BigDFT files of a group, and of the calculations it contains.",
+)
+@click.option(
+    "--filters",
+    "-f",
+    callback=_json_filters,
+    help='QueryBuilder filters on BigDFT files, as JSON (e.g. \'{"attributes.filename": {"like": "log-%"}}\').',
+)
 @click.option(
     "--outfile",
     "-o",
     type=click.Path(dir_okay=False),
-    help="Write output to file (default: print to stdout).",
+    help="Write a single node to file (default: print to stdout).",
+)
+@click.option(
+    "--directory",
+    "-d",
+    type=click.Path(file_okay=False),
+    help="Write every node to a file of this directory, named after its pk.",
+)
+@click.option(
+    "--tar",
+    "archive",
+    type=click.Path(dir_okay=False),
+    help="Pack every node into a single tar archive (.tar, .tar.gz, .tar.bz2 or .tar.xz).",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of threads writing to the directory.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=1024,
+    show_default=True,
+    help="Size of the chunks files are copied in, in kB.",
 )
 @decorators.with_dbenv()
-def export(node, outfile):
-    """Export a DiffParameters node (identified by PK, UUID or label) to plain text."""
-    string = str(node)
+def export(nodes, groups, filters, outfile, directory, archive, workers, chunk_size):
+    """
+    Export nodes (identified by PK, UUID or label) to plain text.
 
-    if outfile:
-        with open(outfile, "w", encoding="utf8") as f:
-            f.write(string)
-    else:
-        click.echo(string)
+    Files are streamed in chunks, decompressed if stored compressed. Several
+    nodes, selected by identifier, group or filters, are exported to a
+    directory or a tar archive, reporting the throughput.
+    """
+    candidates = list(nodes)
+    if groups or filters is not None:
+        candidates.extend(_select_files(groups, filters or {}))
+    selected, seen = [], set()
+    for node in candidates:
+        if node.pk not in seen:
+            seen.add(node.pk)
+            selected.append(node)
+
+    if directory and archive:
+        raise click.UsageError("--directory and --tar are mutually exclusive")
+
+    chunk_size *= 1024
+    if directory or archive:
+        if directory:
+            report = export_to_directory(selected, directory, workers=workers, chunk_size=chunk_size)
+        else:
+            report = export_to_tar(selected, archive, chunk_size=chunk_size)
+        click.echo(str(report), err=True)
+        return
+
+    if len(selected) != 1:
+        raise click.UsageError(
+            f"{len(selected)} nodes selected, export several nodes with --directory or --tar"
+        )
+    node = selected[0]
+
+    if not isinstance(node, SinglefileData):
+        string = str(node)
+        if outfile:
+            with open(outfile, "w", encoding="utf8") as f:
+                f.write(string)
+        else:
+            click.echo(string)
+        return
+
+    with node.open(mode="rb") as handle:
+        if outfile:
+            with open(outfile, "wb") as f:
+                copy_stream(handle, f, chunk_size)
+        else:
+            copy_stream(handle, click.get_binary_stream("stdout"), chunk_size)
+
+
+@data_cli.group("cache")
+def cache():
+    """Inspect and clear the persistent cache of parsed BigDFT files"""
+
+
+def _get_disk_cache(path):
+    """Return the cache at `path`, defaulting to the one set by the environment"""
+    if path:
+        return DiskCache(path)
+    return DiskCache.from_environment() or DiskCache()
+
+
+@cache.command("show")
+@click.option(
+    "--path",
+    type=click.Path(file_okay=False),
+    help="Cache directory (default: $AIIDA_BIGDFT_DISK_CACHE or ~/.cache/aiida-bigdft).",
+)
+@click.option("--entries", "-e", is_flag=True, help="List the individual entries.")
+def cache_show(path, entries):
+    """Display location, size and content of the persistent cache."""
+    disk_cache = _get_disk_cache(path)
+    items = disk_cache.entries()
+    total = sum(size for _, size, _ in items)
+
+    enabled = DiskCache.from_environment() is not None
+    click.echo(f"path: {disk_cache.path}")
+    click.echo(f"enabled: {enabled}")
+    click.echo(f"entries: {len(items)}")
+    click.echo(f"size: {total / 1024**2:.1f} MB / {disk_cache.maxsize / 1024**2:.1f} MB")
+
+    if entries:
+        for key, size, _ in items:
+            click.echo(f"{key}  {size / 1024**2:.2f} MB")
+
+
+@cache.command("clear")
+@click.option(
+    "--path",
+    type=click.Path(file_okay=False),
+    help="Cache directory (default: $AIIDA_BIGDFT_DISK_CACHE or ~/.cache/aiida-bigdft).",
+)
+def cache_clear(path):
+    """Remove all entries from the persistent cache."""
+    removed = _get_disk_cache(path).clear()
+    click.echo(f"removed {removed} entries")
+
+
+@data_cli.command("profile")
+@click.argument("group", metavar="GROUP", type=GroupParamType())
+@click.option("--classes", "-c", is_flag=True, help="Show the share of each class of operations.")
+@decorators.with_dbenv()
+def profile(group, classes):
+    """
+    Compare the timings of the calculations of a group by MPI and OpenMP counts.
+
+    Speedup and efficiency are relative to the configuration with the fewest
+    cores, the imbalance is the time weighted spread of the MPI loads.
+    """
+    qb = QueryBuilder()
+    qb.append(Group, filters={"id": group.pk}, tag="group")
+    qb.append(CalcJobNode, with_group="group", tag="calc")
+    qb.append(ArrayData, with_incoming="calc", edge_filters={"label": "timing"}, project="*")
+
+    rows = timing.profile(qb.all(flat=True))
+    if not rows:
+        click.echo(f"no timings found in group {group.label}")
+        return
+
+    names = sorted({name for row in rows for name in row["classes"]}) if classes else []
+    headers = ["MPI", "OMP", "cores", "runs", "time (s)", "speedup", "efficiency", "imbalance"]
+    table = [
+        [
+            row["mpi_tasks"],
+            row["omp_threads"],
+            row["cores"],
+            row["runs"],
+            f"{row['time']:.2f}",
+            f"{row['speedup']:.2f}",
+            f"{row['efficiency']:.2f}",
+            f"{row['imbalance']:.3f}",
+        ]
+        + [f"{row['classes'].get(name, 0):.1f}" for name in names]
+        for row in rows
+    ]
+    click.echo(tabulate(table, headers=headers + [f"{name} (%)" for name in names]))
+
+
+@data_cli.command("analyse")
+@click.argument("group", metavar="[GROUP]", type=GroupParamType(), required=False)
+@click.option(
+    "--filters",
+    "-f",
+    callback=_json_filters,
+    help='Additional QueryBuilder filters on the calculations, as JSON (e.g. \'{"label": {"like": "TiO2%"}}\').',
+)
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="Save the table (.npz, or .parquet with pandas).")
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=0),
+    help="Processes parsing the logs of calculations without output_parameters (0: no pool).",
+)
+@click.option("--no-parse", is_flag=True, help="Skip calculations without output_parameters.")
+@decorators.with_dbenv()
+def analyse(group, filters, output, workers, no_parse):
+    """
+    Gather the results of BigDFT calculations, optionally in a GROUP, into a table.
+
+    Prints the count, mean, minimum and maximum of each column.
+    """
+    table = analysis.gather(group, filters=filters, parse_missing=not no_parse, workers=workers)
+    if output:
+        try:
+            table.save(output)
+        except ImportError as error:
+            raise click.ClickException(f"saving {output} requires pandas and pyarrow: {error}") from error
+
+    rows = []
+    for column in analysis.COLUMNS:
+        values = table[column][~np.isnan(table[column])]
+        if values.size:
+            rows.append([column, values.size, values.mean(), values.min(), values.max()])
+        else:
+            rows.append([column, 0, None, None, None])
+    click.echo(f"{len(table)} calculations")
+    click.echo(tabulate(rows, headers=["column", "count", "mean", "min", "max"], floatfmt=".6g"))
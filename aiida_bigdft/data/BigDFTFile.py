@@ -2,66 +2,291 @@
 Module for adding extra BigDFT functionality to AiiDA's base SinglefileData
 """
 
+import contextlib
+import io
 import os
+import pathlib
+import shutil
 
 from BigDFT.Logfiles import Logfile
-import yaml
 
 from aiida.orm import SinglefileData
 
+from aiida_bigdft.utils import serialisation
+from aiida_bigdft.utils.cache import DiskCache, LRUCache
+from aiida_bigdft.utils.compression import CHUNK_SIZE, CompressingReader, check_codec, decompressing_reader
+from aiida_bigdft.utils.streaming import index_documents, parse_log_stream, parse_log_tail
+
 
 class BigDFTFile(SinglefileData):
     """
     Wrapper class for a BigDFT yaml format file as SinglefileData
+
+    The file is only parsed when `content` is first accessed. Parsed content of
+    stored nodes is shared through `content_cache`, a process-wide LRU cache
+    keyed by the checksum of the file and bounded by the total size (in bytes)
+    of the files it holds.
+
+    `disk_cache` optionally persists the parsed content between sessions. It is
+    disabled unless the `AIIDA_BIGDFT_DISK_CACHE` environment variable is set,
+    or a `DiskCache` is assigned to it.
+
+    Files can be stored compressed ("gzip" or "zstd"), for all nodes of a class
+    by setting its `compression` attribute, or per node with the `compression`
+    argument. The codec is recorded in the `compression` attribute of the node
+    and `open` transparently decompresses the file as it is read.
     """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    content_cache = LRUCache(maxsize=256 * 1024**2)
+    disk_cache = DiskCache.from_environment()
+    compression = None
+
+    def __init__(self, file=None, filename=None, compression=None, **kwargs):
+        """
+        :param compression: codec used to store the file, defaults to the class `compression`
+        """
+        if compression is not None:
+            check_codec(compression)
+            self.compression = compression
+        super().__init__(file, filename=filename, **kwargs)
+
+    def set_file(self, file, filename=None):
+        """
+        Store the content of the file, compressed if `compression` is set
+        """
+        codec = self.compression
+        if codec is None:
+            super().set_file(file, filename=filename)
+            return
+
+        check_codec(codec)
+        if isinstance(file, (str, pathlib.Path)):
+            if not os.path.isabs(file):
+                raise ValueError(f"path `{file}` is not absolute")
+            with open(file, "rb") as handle:
+                self.set_file(handle, filename=filename or os.path.basename(file))
+            return
+
+        if filename is None:
+            filename = os.path.basename(getattr(file, "name", "") or "") or self.DEFAULT_FILENAME
+        reader = CompressingReader(file, codec)
+        super().set_file(reader, filename=filename)
+        self.base.attributes.set_many({"compression": codec, "size": reader.size})
 
-        self._content = self._open()
+    @contextlib.contextmanager
+    def open(self, path=None, mode="r"):
+        """
+        Return an open file handle to the (decompressed) content of this node
+        """
+        codec = self.base.attributes.get("compression", None)
+        if codec is None or path not in (None, self.filename):
+            with super().open(path, mode=mode) as handle:
+                yield handle
+            return
+
+        with self.base.repository.open(self.filename, mode="rb") as handle:
+            stream = decompressing_reader(handle, codec)
+            if mode == "r":
+                stream = io.TextIOWrapper(stream, encoding="utf8")
+            with stream:
+                yield stream
 
     def _open(self):
         """
         Attempts to open the stored file, returning an empty dict on failure
         """
+        content, _ = self._load()
+        return content
+
+    def _load(self):
+        """
+        Parse the stored file, returning its content and size in bytes
+
+        Multi-document files are returned as a list of documents
+        """
         try:
-            with self.open() as o:
-                return yaml.safe_load(o)
+            with self.open(mode="rb") as o:
+                content = list(serialisation.load_all(o))
+                size = o.tell()
+                if len(content) < 2:
+                    content = content[0] if content else {}
+                return content, size
         except FileNotFoundError:
             self.logger.warning(f"file {self.filename} could not be opened!")
-            return {}
+            return {}, 0
+
+    @property
+    def checksum(self):
+        """
+        Checksum of the stored file, None if the node is not stored
+        """
+        if not self.is_stored:
+            return None
+        return self.base.repository.get_object(self.filename).key
 
     @property
     def content(self):
         """
         Attempts to return file content from cache, loading otherwise
+
+        Content of stored nodes is shared between all node instances of the same
+        file, and should be treated as read-only.
         """
-        try:
-            return self._content
-        except AttributeError:
-            self._content = self._open()
-            return self._content
+        checksum = self.checksum
+        if checksum is None:
+            return self._open()
+
+        content = self.content_cache.get(checksum)
+        if content is not None:
+            return content
+
+        if self.disk_cache is not None:
+            content = self.disk_cache.get(f"{checksum}-content")
+
+        if content is None:
+            content, size = self._load()
+            if not size:
+                return content
+            if self.disk_cache is not None:
+                self.disk_cache.set(f"{checksum}-content", content)
+        elif self.base.attributes.get("compression", None) is not None:
+            size = self.base.attributes.get("size")
+        else:
+            with self.open(mode="rb") as o:
+                o.seek(0, os.SEEK_END)
+                size = o.tell()
+
+        self.content_cache.set(checksum, content, size)
+        return content
 
     def dump_file(self, path=None):
         """
-        Dump the stored file to `path`
+        Dump the stored (decompressed) file to `path`
         defaults to cwd + filename if not provided
+
+        The file is copied in chunks, without reading it into memory
         """
         path = path or os.path.join(os.getcwd(), self.filename)
 
-        with self.open() as inp:
-            with open(path, "w+", encoding="utf8") as out:
-                out.write(inp.read())
+        with self.open(mode="rb") as inp:
+            with open(path, "wb") as out:
+                shutil.copyfileobj(inp, out, CHUNK_SIZE)
 
 
 class BigDFTLogfile(BigDFTFile):
     """
     Specialised class for wrapping a BigDFT Logfile class as SinglefileData
+
+    Geometry optimisations and molecular dynamics write one YAML document per
+    step. The byte offsets of the documents are indexed when the file is set
+    and kept in the `document_offsets` attribute, so that single steps can be
+    loaded with `get_document` and all of them iterated over lazily with
+    `iter_documents`, without parsing the whole log.
     """
 
+    def set_file(self, file, filename=None):
+        """
+        Store the content of the file and index its documents
+        """
+        super().set_file(file, filename=filename)
+        with self.open(mode="rb") as o:
+            self.base.attributes.set("document_offsets", index_documents(o))
+
+    @property
+    def document_offsets(self):
+        """
+        Byte offsets of the documents of the log
+
+        Nodes stored before the index was introduced are indexed on first access
+        """
+        offsets = self.base.attributes.get("document_offsets", None)
+        if offsets is None:
+            try:
+                return self._document_offsets
+            except AttributeError:
+                with self.open(mode="rb") as o:
+                    self._document_offsets = index_documents(o)
+                offsets = self._document_offsets
+        return offsets
+
+    @property
+    def number_of_documents(self):
+        """
+        Number of documents (steps) of the log
+        """
+        return len(self.document_offsets)
+
+    def get_document(self, index):
+        """
+        Load a single document of the log, negative indices count from the end
+
+        :param index: index of the document
+        :returns: content of the document
+        """
+        offsets = self.document_offsets
+        start = offsets[index]
+        index %= len(offsets)
+        with self.open(mode="rb") as o:
+            o.seek(start)
+            if index + 1 < len(offsets):
+                return serialisation.load(o.read(offsets[index + 1] - start))
+            return serialisation.load(o)
+
+    def iter_documents(self, start=0):
+        """
+        Lazily yield the documents of the log, one at a time
+
+        :param start: index of the first document
+        """
+        offsets = self.document_offsets
+        if not offsets[start:]:
+            return
+        with self.open(mode="rb") as o:
+            o.seek(offsets[start])
+            yield from serialisation.load_all(o)
+
+    def summary(self, tail=256 * 1024):
+        """
+        Return the final energy, forces, warnings, wall time and memory peak
+
+        Only the last `tail` bytes of the log are read when they hold all the
+        closing sections, see `aiida_bigdft.utils.streaming.parse_log_tail`.
+        Otherwise (truncated log, very large forces section, compressed file)
+        the whole log is streamed, which also fills the SCF history, Fermi
+        level and steps.
+
+        :param tail: number of bytes read from the end of the log
+        :returns: summary dictionary
+        """
+        with self.open(mode="rb") as o:
+            summary = None
+            # compressed streams cannot seek from their end
+            if self.base.attributes.get("compression", None) is None:
+                summary = parse_log_tail(o, tail=tail)
+            if summary is None:
+                o.seek(0)
+                summary = parse_log_stream(o)
+        return summary
+
     @property
     def logfile(self):
         """
         Create and return the BigDFT Logfile object
+
+        The object is built once per node instance and reused afterwards, and
+        persisted in `disk_cache` when enabled
         """
-        return Logfile(dictionary=self.content)
\ No newline at end of file
+        try:
+            return self._logfile
+        except AttributeError:
+            pass
+
+        checksum = self.checksum
+        if checksum is not None and self.disk_cache is not None:
+            self._logfile = self.disk_cache.get(f"{checksum}-logfile")
+            if self._logfile is None:
+                self._logfile = Logfile(dictionary=self.content)
+                self.disk_cache.set(f"{checksum}-logfile", self._logfile)
+        else:
+            self._logfile = Logfile(dictionary=self.content)
+        return self._logfile
@@ -5,46 +5,76 @@ Register data types via the "aiida.data" entry point in setup.json.
 """
 # You can directly use or subclass aiida.orm.data.Data
 # or any other data type listed under 'verdi data'
-from voluptuous import Optional, Schema
+import warnings
+
+from voluptuous import MultipleInvalid
 
 from aiida.orm import Dict
+from aiida.orm.nodes.caching import NodeCaching
+
+from aiida_bigdft.utils.input_variables import UnknownParameterWarning, get_schema
+
+
+class BigDFTParametersCaching(NodeCaching):
+    """
+    Hash of the canonical form of the parameters
+
+    Parameters stored before they were validated, or modified afterwards, hash
+    like their validated equivalent.
+    """
+
+    def get_objects_to_hash(self):
+        objects = super().get_objects_to_hash()
+        try:
+            with warnings.catch_warnings():
+                # unknown variables were reported when the parameters were created
+                warnings.simplefilter("ignore", UnknownParameterWarning)
+                objects["attributes"] = get_schema()(objects["attributes"])
+        except MultipleInvalid:
+            pass
+        return objects
 
 
 class BigDFTParameters(Dict):  # pylint: disable=too-many-ancestors
     """
-    Command line options for diff.
-    This class represents a python dictionary used to
-    pass command line options to the executable.
+    BigDFT input parameters.
+    This class represents the python dictionary of the
+    BigDFT input file, validated and stored in canonical form.
     """
 
+    _CLS_NODE_CACHING = BigDFTParametersCaching
+
     # pylint: disable=redefined-builtin
     def __init__(self, dict=None, **kwargs):
         """
         Constructor for the data class
-        Usage: ``DiffParameters(dict{'ignore-case': True})``
-        :param parameters_dict: dictionary with commandline parameters
-        :param type parameters_dict: dict
+        Usage: ``BigDFTParameters({'dft': {'ixc': 'PBE', 'itermax': 5}})``
+        :param dict: dictionary of BigDFT input parameters
+        :param type dict: dict
         """
         dict = self.validate(dict)
         super().__init__(dict=dict, **kwargs)
 
-    def validate(
-        self, parameters_dict
-    ):  # Can we remove this and put all args within an inpfile?
-        """Validate command line options.
-        Uses the voluptuous package for validation. Find out about allowed keys using::
-            print(DiffParameters).schema.schema
-        :param parameters_dict: dictionary with commandline parameters
+    def validate(self, parameters_dict):
+        """Validate BigDFT input parameters.
+        Uses the voluptuous package for validation, against the input variable
+        definitions compiled once per process, see
+        `aiida_bigdft.utils.input_variables`. Find out about allowed keys using::
+            print(get_schema().defaults)
+        Variables and sections missing from the definitions are kept, with an
+        `UnknownParameterWarning`.
+        :param parameters_dict: dictionary of BigDFT input parameters
         :param type parameters_dict: dict
-        :returns: validated dictionary
+        :returns: validated dictionary, in canonical form
+        :raises voluptuous.MultipleInvalid: listing every invalid value
         """
-        return parameters_dict
+        return get_schema()(parameters_dict)
 
     def __str__(self):
         """String representation of node.
         Append values of dictionary to usual representation. E.g.::
             uuid: b416cbee-24e8-47a8-8c11-6d668770158b (pk: 590)
-            {'ignore-case': True}
+            {'dft': {'itermax': 5}}
         """
         string = super().__str__()
         string += "\n" + str(self.get_dict())
@@ -0,0 +1,214 @@
+"""
+Monitors of running BigDFT calculations
+
+Register monitors via the "aiida.calculations.monitors" entry point in pyproject.toml.
+
+`monitor_scf` follows the SCF residues (`gnrm`) of a running calculation by
+tailing its remote logfile over the transport, reading only the bytes
+appended since its previous call, and kills the job when the residues diverge
+or stall. It then leaves `SCF_MONITOR_FILENAME` in the working directory, which
+is retrieved so that the parser reports `ERROR_SCF_NOT_CONVERGING`:
+
+    inputs["monitors"] = {
+        "scf": Dict({"entry_point": "bigdft.scf", "kwargs": {"patience": 30}, "minimum_poll_interval": 60})
+    }
+"""
+import math
+import os
+import re
+import tempfile
+
+from aiida.common.escaping import escape_for_bash
+from aiida.engine.processes.calcjobs.monitors import CalcJobMonitorResult
+from aiida.orm import CalcJobNode, QueryBuilder
+
+# written to the working directory when a job is killed, with the reason
+SCF_MONITOR_FILENAME = "scf_monitor.txt"
+
+# an SCF iteration of the log, `iter: 3, EKS: -1.09E+02, gnrm:  2.31E-02, ...`
+SCF_ITERATION = re.compile(rb"iter:\s*(\d+),\s*EKS:\s*([^,\s]+),\s*gnrm:\s*([^,\s]+)")
+# an SCF iteration, or the start of a document (a new step of a geometry optimisation or MD run)
+SCF_EVENT = re.compile(rb"^---(?=[ \t\r\n]|$)|" + SCF_ITERATION.pattern, re.MULTILINE)
+
+# maximum number of bytes read from the log at each call
+READ_SIZE = 16 * 1024**2
+
+
+class ScfHistory:
+    """
+    SCF residues of a growing logfile, fed with the bytes appended to it
+
+    Incomplete lines are kept until the rest of them is appended. Only the
+    residues of the current SCF cycle are kept: the history starts again when
+    a new document starts or the iteration counter goes back, as in the steps
+    of geometry optimisations and MD runs, whose first residues are far above
+    the converged ones of the previous step.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.residues = []
+        self._iteration = None
+        self._last = None
+        self._partial = b""
+
+    def reset(self):
+        """
+        Start the history of a new SCF cycle
+        """
+        self.residues = []
+        self._iteration = None
+
+    def update(self, data):
+        """
+        Read the SCF iterations of `data`, the bytes following `offset`
+        """
+        self.offset += len(data)
+        data = self._partial + data
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+
+        for match in SCF_EVENT.finditer(data, 0, end):
+            if match.group(1) is None:
+                self.reset()
+                continue
+            # the converged iteration is repeated as the final one
+            if match.group(0) == self._last:
+                continue
+            self._last = match.group(0)
+            iteration = int(match.group(1))
+            if self._iteration is not None and iteration <= self._iteration:
+                self.reset()
+            self._iteration = iteration
+            try:
+                self.residues.append(float(match.group(3)))
+            except ValueError:
+                # NaN and overflows are written as asterisks by Fortran
+                self.residues.append(math.nan)
+
+    def check(self, divergence=100.0, patience=50, improvement=0.9, min_iterations=5):
+        """
+        Return why the SCF cycle should be stopped, None if it should go on
+
+        :param divergence: the residue diverges when it grows above `divergence`
+            times its lowest value
+        :param patience: the residue stalls when its lowest value has not
+            decreased by a factor `improvement` over the last `patience` iterations
+        :param improvement: see `patience`
+        :param min_iterations: number of iterations before divergence is checked
+        :returns: message, None if the SCF cycle is fine
+        """
+        residues = self.residues
+        if not residues:
+            return None
+        if not math.isfinite(residues[-1]):
+            return f"SCF residue is {residues[-1]} at iteration {len(residues)}"
+
+        lowest = min(residues)
+        if len(residues) >= min_iterations and residues[-1] > divergence * lowest:
+            return (
+                f"SCF diverges, residue {residues[-1]:.2e} at iteration {len(residues)} "
+                f"is more than {divergence} times its lowest value {lowest:.2e}"
+            )
+
+        if len(residues) > patience and min(residues[-patience:]) > improvement * min(residues[:-patience]):
+            return f"SCF stalls, residue {lowest:.2e} not improved over the last {patience} iterations"
+        return None
+
+
+# histories of the monitored calculations, by node uuid
+_HISTORIES = {}
+
+# process states of calculations which are no longer monitored
+TERMINATED_STATES = ("finished", "excepted", "killed")
+
+
+def forget(node):
+    """
+    Drop the SCF history of a calculation, once it is over
+    """
+    _HISTORIES.pop(node.uuid, None)
+
+
+def forget_terminated():
+    """
+    Drop the SCF histories of terminated calculations
+
+    Calculations are forgotten by their parser, this catches those which
+    were killed or excepted before being parsed.
+    """
+    if not _HISTORIES:
+        return
+    qb = QueryBuilder()
+    qb.append(
+        CalcJobNode,
+        filters={
+            "uuid": {"in": list(_HISTORIES)},
+            "attributes.process_state": {"in": list(TERMINATED_STATES)},
+        },
+        project="uuid",
+    )
+    for uuid in qb.all(flat=True):
+        _HISTORIES.pop(uuid, None)
+
+
+def read_appended(transport, path, offset, size=READ_SIZE):
+    """
+    Read at most `size` bytes of a remote file, from `offset`
+
+    :returns: bytes, None if the file cannot be read (yet)
+    """
+    retval, stdout, _ = transport.exec_command_wait_bytes(
+        f"tail -c +{offset + 1} {escape_for_bash(path)} | head -c {size}"
+    )
+    if retval != 0:
+        return None
+    return stdout
+
+
+def write_stop_reason(transport, path, message):
+    """
+    Write the reason for killing a job to a remote file
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as handle:
+        handle.write(message + "\n")
+    try:
+        transport.putfile(handle.name, path)
+    finally:
+        os.remove(handle.name)
+
+
+def monitor_scf(node, transport, divergence=100.0, patience=50, improvement=0.9, min_iterations=5):
+    """
+    Kill a BigDFTCalculation whose SCF residues diverge or stall
+
+    The residues are read from the remote `log-<jobname>.yaml`, see
+    `ScfHistory.check` for the criteria. Their history is kept in memory between
+    calls, it is read again from the start of the log by a restarted worker,
+    and dropped when the calculation terminates.
+
+    :param node: CalcJobNode of the running calculation
+    :param transport: open transport to its computer
+    :returns: `CalcJobMonitorResult` killing the job, None to let it run
+    """
+    forget_terminated()
+    history = _HISTORIES.setdefault(node.uuid, ScfHistory())
+    workdir = node.get_remote_workdir()
+    path = os.path.join(workdir, f"log-{node.get_option('jobname')}.yaml")
+
+    while True:
+        data = read_appended(transport, path, history.offset)
+        if not data:
+            break
+        history.update(data)
+        if len(data) < READ_SIZE:
+            break
+
+    message = history.check(divergence, patience, improvement, min_iterations)
+    if message is None:
+        return None
+
+    forget(node)
+    write_stop_reason(transport, os.path.join(workdir, SCF_MONITOR_FILENAME), message)
+    # the log is still retrieved and parsed, the parser reporting the SCF failure
+    return CalcJobMonitorResult(message=message, override_exit_code=False)
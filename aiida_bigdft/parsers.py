@@ -4,16 +4,24 @@ Parsers provided by aiida_bigdft_new.
 Register parsers via the "aiida.parsers" entry point in setup.json.
 """
 import os
-import re
 from datetime import datetime
 import getpass
 
+import numpy as np
+from ase.units import Bohr
+
 from aiida.common import exceptions
 from aiida.engine import ExitCode
+from aiida.orm import ArrayData, Dict, TrajectoryData
 from aiida.parsers.parser import Parser
 
 from aiida_bigdft.calculations import BigDFTCalculation
 from aiida_bigdft.data.BigDFTFile import BigDFTFile, BigDFTLogfile
+from aiida_bigdft.monitors import SCF_MONITOR_FILENAME, forget
+from aiida_bigdft.utils.scheduler import get_classifier
+from aiida_bigdft.utils.serialisation import YAMLError
+from aiida_bigdft.utils.streaming import parse_log_stream, parse_log_tail, summary_parameters
+from aiida_bigdft.utils.timing import build_timing
 
 try:
     from aiida_bigdft.paths import DEBUG_PATHS
@@ -21,6 +29,21 @@ except ImportError:
     DEBUG_PATHS = None
 
 
+def split_atoms(atoms):
+    """
+    Split BigDFT atoms, `[{symbol: [x, y, z], <extra keys>}, ...]`, into
+    symbols and an `(n, 3)` array
+    """
+    symbols, values = [], []
+    for atom in atoms:
+        for symbol, value in atom.items():
+            if isinstance(value, list) and len(value) == 3:
+                symbols.append(symbol)
+                values.append(value)
+                break
+    return symbols, np.array(values, dtype=float).reshape(-1, 3)
+
+
 def debug(msg, wipe=False):
     if not DEBUG_PATHS:
         return
@@ -51,34 +74,20 @@ class BigDFTParser(Parser):
         if not issubclass(node.process_class, BigDFTCalculation):
             raise exceptions.ParsingError("Can only parse DiffCalculation")
 
-    def parse_stderr(self, inputfile):
+    def parse_stderr(self, inputfile, tail=None):
         """Parse the stderr file to get commong errors, such as OOM or timeout.
 
-        :param i inputfile: stderr file
+        Messages are classified by `aiida_bigdft.utils.scheduler`, walltime
+        errors taking precedence over memory ones.
+
+        :param i inputfile: stderr content, as a string or a (binary) stream
+        :param tail: only scan the last `tail` bytes of the stream
         :returns: exit code in case of an error, None otherwise
         """
-        timeout_messages = {
-            "DUE TO TIME LIMIT",  # slurm
-            "exceeded hard wallclock time",  # UGE
-            "TERM_RUNLIMIT: job killed",  # LFS
-            "walltime .* exceeded limit",  # PBS/Torque
-        }
-
-        oom_messages = {
-            "[oO]ut [oO]f [mM]emory",
-            "oom-kill",  # generic OOM messages
-            "Exceeded .* memory limit",  # slurm
-            "exceeds job hard limit .*mem.* of queue",  # UGE
-            "TERM_MEMLIMIT: job killed after reaching LSF memory usage limit",  # LFS
-            "mem .* exceeded limit",  # PBS/Torque
-        }
-        for message in timeout_messages:
-            if re.search(message, inputfile):
-                return self.exit_codes.ERROR_OUT_OF_WALLTIME
-        for message in oom_messages:
-            if re.search(message, inputfile):
-                return self.exit_codes.ERROR_OUT_OF_MEMORY
-        return
+        label = get_classifier().classify(inputfile, tail=tail)
+        if label is None:
+            return None
+        return self.exit_codes(label)
 
     def parse(self, **kwargs):
         """
@@ -87,13 +96,8 @@ class BigDFTParser(Parser):
         :returns: an exit code, if parsing fails (or nothing if parsing succeeds)
         """
 
-        exitcode = ExitCode(0)
+        exitcode = self.parse_scheduler_stderr()
 
-        stderr = self.node.get_scheduler_stderr()
-        if stderr:
-            exitcode = self.parse_stderr(stderr)
-            if exitcode:
-                self.logger.error("Error in stderr: " + exitcode.message)
         # jobname = self.node.get_option('jobname')
         # if jobname is not None:
         #     output_filename = "log-" + jobname + ".yaml"
@@ -109,38 +113,262 @@ class BigDFTParser(Parser):
             )
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        jobname = self.node.get_option("jobname")
+        outputs, complete = self.parse_calculation(self.node.get_option("jobname"))
+        for name, output in outputs.items():
+            self.out(name, output)
+
+        stopped = self.parse_scf_monitor()
+        if stopped:
+            return stopped
+        if not complete:
+            # if we already have OOW or OOM, failure here will be handled later
+            return exitcode or self.exit_codes.ERROR_PARSING_FAILED
+
+        return exitcode or ExitCode(0)
+
+    def parse_scheduler_stderr(self):
+        """
+        Classify the errors of the retrieved scheduler stderr, if any
+
+        :returns: exit code in case of an error, None otherwise
+        """
+        exitcode = None
+
+        stderr_filename = self.node.get_option("scheduler_stderr")
+        if stderr_filename in self.retrieved.base.repository.list_object_names():
+            with self.retrieved.base.repository.open(stderr_filename, "rb") as stderr:
+                exitcode = self.parse_stderr(
+                    stderr, tail=self.node.get_option("stderr_tail")
+                )
+            if exitcode:
+                self.logger.error("Error in stderr: " + exitcode.message)
+        return exitcode
+
+    def parse_scf_monitor(self):
+        """
+        Report the reason for the SCF monitor killing the job, if it did
+
+        :returns: exit code if the job was killed by `monitor_scf`, None otherwise
+        """
+        # the job is over, its SCF history is no longer needed by the monitor
+        forget(self.node)
+        if SCF_MONITOR_FILENAME not in self.retrieved.base.repository.list_object_names():
+            return None
+        message = self.retrieved.base.repository.get_object_content(SCF_MONITOR_FILENAME).strip()
+        self.logger.error(f"Killed by the SCF monitor: {message}")
+        return self.exit_codes.ERROR_SCF_NOT_CONVERGING.format(message=message)
+
+    def parse_calculation(self, jobname):
+        """
+        Build the output nodes of the calculation `jobname` from its retrieved files
+
+        :param jobname: name of the calculation, which its output files are named after
+        :returns: `(outputs, complete)`, the dictionary of output nodes by link
+            label, and whether the logfile and timefile were both parsed
+        """
+        outputs = {}
+
         output_filename = f'log-{jobname}.yaml'
         debug(f'looking for logfile with name {output_filename}')
-        logfile = self.parse_file(output_filename, "logfile", exitcode)
-        timefile = self.parse_file(f"time-{jobname}.yaml", "timefile", exitcode)
+        summary = self.parse_log_summary(
+            output_filename, tail=self.node.get_option("summary_tail")
+        )
+        if summary is None:
+            return outputs, False
 
-        self.out("logfile", logfile)
-        self.out("timefile", timefile)
+        outputs["output_parameters"] = self.build_output_parameters(summary)
+        arrays = self.build_output_arrays(summary)
+        if arrays is not None:
+            outputs["output_arrays"] = arrays
+        trajectory = self.build_trajectory(summary)
+        if trajectory is not None:
+            outputs["trajectory"] = trajectory
 
-        return exitcode
+        for name, filename in (
+            ("logfile", output_filename),
+            ("timefile", f"time-{jobname}.yaml"),
+        ):
+            output = self.parse_file(filename, name)
+            if output is None:
+                return outputs, False
+            outputs[name] = output
+
+        timing = self.parse_timing(f"time-{jobname}.yaml")
+        if timing is not None:
+            outputs["timing"] = timing
+
+        return outputs, True
+
+    def parse_log_summary(self, output_filename, tail=None):
+        """
+        Stream the retrieved logfile, extracting energy, forces, SCF history and warnings
+
+        The log is read from the repository in a single pass, without building its
+        full document tree. With `tail`, only the closing sections are read from
+        the end of the log (see `parse_log_tail`), unless they are not all there.
+
+        :param output_filename: name of the logfile in the retrieved folder
+        :param tail: number of bytes read from the end of the log in summary mode
+        :returns: summary dictionary, None if the log could not be read
+        """
+        try:
+            with self.retrieved.base.repository.open(output_filename, "rb") as stream:
+                summary = parse_log_tail(stream, tail=tail) if tail else None
+                if summary is None:
+                    stream.seek(0)
+                    summary = parse_log_stream(stream)
+        except (FileNotFoundError, YAMLError) as error:
+            self.logger.error(f"Impossible to stream logfile {output_filename}: {error}")
+            return None
+
+        for warning in summary["warnings"]:
+            self.logger.warning(f"BigDFT: {warning}")
+        if summary["scf_history"] is None:
+            self.logger.info(f"final energy {summary['energy']} Ha")
+        else:
+            self.logger.info(
+                f"final energy {summary['energy']} Ha after "
+                f"{len(summary['scf_history'])} SCF iterations"
+            )
+
+        return summary
 
-    def parse_file(self, output_filename, name, exitcode):
+    @staticmethod
+    def build_output_parameters(summary):
+        """
+        Build the queryable scalar results of a logfile summary
+
+        See `aiida_bigdft.utils.streaming.summary_parameters` for their units.
+
+        :param summary: dictionary returned by `parse_log_stream`
+        :returns: Dict node
+        """
+        return Dict(summary_parameters(summary))
+
+    @staticmethod
+    def build_output_arrays(summary):
+        """
+        Build the final forces and positions of a logfile summary as arrays
+
+        Forces are in Ha/Bohr, positions in the units given by the
+        `positions_units` attribute, along with the atomic `symbols`.
+
+        :param summary: dictionary returned by `parse_log_stream`
+        :returns: ArrayData node, None if the log has neither
+        """
+        arrays = ArrayData()
+        structure = summary["structure"] or {}
+        if structure.get("positions"):
+            symbols, positions = split_atoms(structure["positions"])
+            arrays.set_array("positions", positions)
+            arrays.base.attributes.set("symbols", symbols)
+            arrays.base.attributes.set("positions_units", structure.get("units", "bohr"))
+            if "cell" in structure:
+                arrays.base.attributes.set("cell", structure["cell"])
+        if summary["forces"]:
+            symbols, forces = split_atoms(summary["forces"])
+            arrays.set_array("forces", forces)
+            arrays.base.attributes.set("symbols", symbols)
+
+        if not arrays.get_arraynames():
+            return None
+        return arrays
+
+    @staticmethod
+    def build_trajectory(summary):
+        """
+        Build the trajectory of a multi-document (geometry optimisation or
+        molecular dynamics) log
+
+        Positions are converted to Angstrom. Energies (Ha) and forces (Ha/Bohr)
+        of the steps are stored as the `energies` and `forces` arrays when all
+        steps have them.
+
+        :param summary: dictionary returned by `parse_log_stream`
+        :returns: TrajectoryData node, None for single step logs or if the
+            steps do not share the same atoms
+        """
+        steps = [step for step in summary["steps"] if (step.get("structure") or {}).get("positions")]
+        if len(steps) < 2:
+            return None
+
+        symbols, positions, cells = None, [], []
+        for step in steps:
+            structure = step["structure"]
+            step_symbols, step_positions = split_atoms(structure["positions"])
+            if symbols is not None and step_symbols != symbols:
+                return None
+            symbols = step_symbols
+
+            cell = structure.get("cell")
+            cell = np.array(cell, dtype=float) if isinstance(cell, list) and len(cell) == 3 else None
+            units = str(structure.get("units", "atomic")).lower()
+            if units == "reduced" and cell is not None:
+                step_positions = step_positions * np.where(np.isfinite(cell), cell, 1)
+                units = "atomic"
+            if units in ("atomic", "bohr"):
+                step_positions = step_positions * Bohr
+                cell = None if cell is None else cell * Bohr
+            positions.append(step_positions)
+            cells.append(cell)
+
+        trajectory = TrajectoryData()
+        if all(cell is not None for cell in cells):
+            # free directions of surface and wire boundary conditions are infinite
+            pbc = tuple(bool(periodic) for periodic in np.isfinite(cells[0]))
+            cells = np.array([np.diag(np.where(np.isfinite(cell), cell, 0)) for cell in cells])
+            trajectory.set_trajectory(symbols, np.array(positions), cells=cells, pbc=pbc)
+        else:
+            trajectory.set_trajectory(symbols, np.array(positions))
+
+        energies = [step.get("energy") for step in steps]
+        if None not in energies:
+            trajectory.set_array("energies", np.array(energies, dtype=float))
+        forces = [step.get("forces") for step in steps]
+        if all(forces):
+            trajectory.set_array("forces", np.array([split_atoms(force)[1] for force in forces]))
+        return trajectory
+
+    def parse_timing(self, output_filename):
+        """
+        Parse the retrieved time report into per-category timing arrays
+
+        :param output_filename: name of the time report in the retrieved folder
+        :returns: ArrayData node, None if the report could not be read
+        """
+        try:
+            with self.retrieved.base.repository.open(output_filename, "rb") as stream:
+                return build_timing(stream)
+        except (FileNotFoundError, YAMLError, ValueError) as error:
+            self.logger.warning(f"Impossible to parse timings {output_filename}: {error}")
+            return None
+
+    def parse_file(self, output_filename, name):
         """
         Parse a retrieved file into a BigDFTFile object
+
+        The node is filled directly from the byte stream of the retrieved object,
+        without decoding it or writing it to the working directory.
+
+        :param output_filename: name of the file in the retrieved folder
+        :param name: output link label, `logfile` builds a BigDFTLogfile
+        :returns: the stored node, None on failure
         """
+        cls = BigDFTLogfile if name == "logfile" else BigDFTFile
 
         # add output file
         self.logger.info(f"Parsing '{output_filename}'")
         try:
-            with open(output_filename, "w+") as tmp:
-                tmp.write(self.retrieved.get_object_content(output_filename))
-                if name == "logfile":
-                    output = BigDFTLogfile(os.path.join(os.getcwd(), output_filename))
-                else:
-                    output = BigDFTFile(os.path.join(os.getcwd(), output_filename))
-
-        except ValueError:
+            with self.retrieved.base.repository.open(output_filename, "rb") as handle:
+                output = cls(
+                    file=handle,
+                    filename=output_filename,
+                    compression=self.node.get_option("compression"),
+                )
+        except (FileNotFoundError, ValueError):
             self.logger.error(f"Impossible to parse {name} {output_filename}")
-            if (
-                not exitcode
-            ):  # if we already have OOW or OOM, failure here will be handled later
-                return self.exit_codes.ERROR_PARSING_FAILED
+            return None
+
         try:
             output.store()
             self.logger.info(f"Successfully parsed {name} '{output_filename}'")
@@ -148,9 +376,38 @@ class BigDFTParser(Parser):
             self.logger.info(
                 f"Impossible to store {name} - ignoring '{output_filename}'"
             )
-            if (
-                not exitcode
-            ):  # if we already have OOW or OOM, failure here will be handled later
-                return self.exit_codes.ERROR_PARSING_FAILED
+            return None
 
         return output
+
+
+class BigDFTPackedParser(BigDFTParser):
+    """
+    Parser of the packed calculations of a BigDFTPackedCalculation
+
+    The outputs of each calculation are attached as `<output>.<label>`. The
+    calculations which could be parsed are kept when others failed.
+    """
+
+    def parse(self, **kwargs):
+        """
+        Parse the outputs of every packed calculation, store results in database.
+
+        :returns: an exit code, if parsing of any calculation fails (or nothing if parsing succeeds)
+        """
+        exitcode = self.parse_scheduler_stderr()
+
+        jobname = self.node.get_option("jobname")
+        failed = []
+        for label in sorted(self.node.inputs.structures):
+            outputs, complete = self.parse_calculation(f"{jobname}-{label}")
+            for name, output in outputs.items():
+                self.out(f"{name}.{label}", output)
+            if not complete:
+                failed.append(label)
+
+        if failed:
+            self.logger.error(f"Packed calculations {', '.join(failed)} failed")
+            return exitcode or self.exit_codes.ERROR_PACKED_CALCULATION_FAILED
+
+        return exitcode or ExitCode(0)
@@ -0,0 +1,261 @@
+"""
+Process-wide and persistent caching helpers
+"""
+from collections import OrderedDict
+import contextlib
+import os
+import pickle
+import tempfile
+import threading
+
+DISK_CACHE_ENV = "AIIDA_BIGDFT_DISK_CACHE"
+DISK_CACHE_SIZE_ENV = "AIIDA_BIGDFT_DISK_CACHE_SIZE"
+DEFAULT_DISK_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "aiida-bigdft"
+)
+DEFAULT_DISK_CACHE_SIZE = 4 * 1024**3
+# fraction of `maxsize` the disk cache is brought down to when evicting
+DISK_CACHE_EVICTION_TARGET = 0.9
+
+
+class LRUCache:
+    """
+    Thread safe, size-bounded least-recently-used cache
+
+    Each entry is given a size when inserted, and the least recently used
+    entries are evicted once the total size exceeds `maxsize`.
+
+    :param maxsize: maximum total size of the cached entries
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return the value stored under `key`, marking it as most recently used
+        """
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=1):
+        """
+        Store `value` under `key`, evicting old entries if needed
+
+        Values larger than the whole cache are not stored.
+        """
+        with self._lock:
+            if key in self._data:
+                self.currsize -= self._data.pop(key)[1]
+            if size > self.maxsize:
+                return
+            self._data[key] = (value, size)
+            self.currsize += size
+            while self.currsize > self.maxsize:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.currsize -= evicted
+
+    def clear(self):
+        """
+        Remove all entries and reset the statistics
+        """
+        with self._lock:
+            self._data.clear()
+            self.currsize = 0
+            self.hits = 0
+            self.misses = 0
+
+
+class DiskCache:
+    """
+    Persistent, size-bounded cache of pickled objects
+
+    Each entry is a single file in `path`, written atomically so that several
+    processes can share the same cache. Reading an entry refreshes its
+    modification time, and the least recently used entries are removed once
+    the total size of the directory exceeds `maxsize` bytes, down to
+    `DISK_CACHE_EVICTION_TARGET` of it.
+
+    The total size is kept as a running count of the entries written and
+    removed by this instance, so that writing does not scan the directory. It
+    is read from the directory on the first write and at each eviction, which
+    also accounts for the entries of other processes.
+
+    Only point this at a directory you own: entries are unpickled on read.
+
+    :param path: cache directory, created if missing
+    :param maxsize: maximum total size in bytes
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, path=DEFAULT_DISK_CACHE_DIR, maxsize=DEFAULT_DISK_CACHE_SIZE):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.maxsize = maxsize
+        self._size = None
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Build the cache configured by the environment, None if it is not enabled
+
+        `AIIDA_BIGDFT_DISK_CACHE` enables the cache and holds its directory
+        (an empty value or `default` selects `~/.cache/aiida-bigdft`), while
+        `AIIDA_BIGDFT_DISK_CACHE_SIZE` sets the size limit in MB.
+        """
+        path = os.environ.get(DISK_CACHE_ENV)
+        if path is None:
+            return None
+        if path in ("", "default"):
+            path = DEFAULT_DISK_CACHE_DIR
+
+        maxsize = os.environ.get(DISK_CACHE_SIZE_ENV)
+        if maxsize is None:
+            return cls(path)
+        return cls(path, maxsize=int(float(maxsize) * 1024**2))
+
+    def _filename(self, key):
+        return os.path.join(self.path, f"{key}{self.suffix}")
+
+    def get(self, key, default=None):
+        """
+        Return the object stored under `key`, `default` if missing or unreadable
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as inp:
+                value = pickle.load(inp)
+        except FileNotFoundError:
+            return default
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # corrupt entry, or pickled by an incompatible version
+            self.delete(key)
+            return default
+
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """
+        Store `value` under `key`, then evict entries beyond the size limit
+
+        Objects which cannot be pickled are silently skipped. The temporary
+        file is removed whatever the error.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        filename = self._filename(key)
+        previous = self._entry_size(filename)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        replaced = False
+        try:
+            with os.fdopen(fd, "wb") as out:
+                pickle.dump(value, out, protocol=pickle.HIGHEST_PROTOCOL)
+                size = out.tell()
+            os.replace(tmp, filename)
+            replaced = True
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            return
+        finally:
+            if not replaced:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+
+        if self._size is None:
+            self._size = self.currsize
+        else:
+            self._size += size - previous
+        if self._size > self.maxsize:
+            self.evict()
+
+    @staticmethod
+    def _entry_size(filename):
+        try:
+            return os.stat(filename).st_size
+        except OSError:
+            return 0
+
+    def delete(self, key):
+        """
+        Remove the entry stored under `key`, if any
+        """
+        filename = self._filename(key)
+        size = self._entry_size(filename)
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            return
+        if self._size is not None:
+            self._size = max(0, self._size - size)
+
+    def entries(self):
+        """
+        Return a list of `(key, size, mtime)` for all entries, oldest first
+        """
+        entries = []
+        try:
+            scan = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return entries
+        for entry in scan:
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.name[: -len(self.suffix)], stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    @property
+    def currsize(self):
+        """
+        Total size in bytes of the cached entries
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits
+        `DISK_CACHE_EVICTION_TARGET` of `maxsize`, if it exceeds `maxsize`
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.maxsize:
+            for key, size, _ in entries:
+                if total <= self.maxsize * DISK_CACHE_EVICTION_TARGET:
+                    break
+                self.delete(key)
+                total -= size
+        self._size = total
+
+    def clear(self):
+        """
+        Remove all entries, returning the number of entries removed
+        """
+        entries = self.entries()
+        for key, _, _ in entries:
+            self.delete(key)
+        self._size = None
+        return len(entries)
@@ -0,0 +1,94 @@
+"""
+Streaming compression of the files stored in the repository
+
+Files are compressed while they are copied into the repository and
+decompressed while they are read back, so neither the raw nor the compressed
+content is ever held in memory as a whole. gzip is always available, zstd
+needs the optional `zstandard` package (`pip install aiida-bigdft[zstd]`).
+"""
+import gzip
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("gzip", "zstd")
+
+# compression levels, favouring write throughput over the last percents of ratio
+LEVELS = {"gzip": 6, "zstd": 3}
+
+CHUNK_SIZE = 1024**2
+
+
+def check_codec(codec):
+    """
+    Raise a ValueError for unknown or unavailable codecs
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown compression {codec!r}, expected one of {CODECS}")
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the `zstandard` package")
+
+
+class CompressingReader(io.RawIOBase):
+    """
+    Read-only binary stream of the compressed content of another stream
+
+    :param stream: binary file-like object of the raw content
+    :param codec: one of `CODECS`
+    :param level: compression level, defaults to `LEVELS[codec]`
+    """
+
+    mode = "rb"
+
+    def __init__(self, stream, codec, level=None):
+        super().__init__()
+        check_codec(codec)
+        level = LEVELS[codec] if level is None else level
+        self._stream = stream
+        if codec == "gzip":
+            # wbits of 16 + 15 write the gzip container
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        self._buffer = b""
+        self._eof = False
+        self.size = 0  # number of raw bytes consumed
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._buffer) < len(buffer) and not self._eof:
+            chunk = self._stream.read(CHUNK_SIZE)
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf8")
+            if chunk:
+                self.size += len(chunk)
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        data, self._buffer = self._buffer[: len(buffer)], self._buffer[len(buffer) :]
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def decompressing_reader(stream, codec):
+    """
+    Return a read-only binary stream of the decompressed content of `stream`
+
+    The returned stream supports forward seeks, at the cost of decompressing
+    the skipped content.
+
+    :param stream: binary file-like object of the compressed content
+    :param codec: one of `CODECS`
+    """
+    check_codec(codec)
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    return zstandard.ZstdDecompressor().stream_reader(stream)
@@ -0,0 +1,212 @@
+"""
+Bulk export of stored files to a directory or a tar archive
+
+Files are copied from the repository in fixed-size chunks, decompressing them
+on the fly if needed, so that no file is ever held in memory as a whole.
+Repository handles are opened, read and closed by the calling thread only, as
+the repository backend shares its container session between the handles of a
+process. When exporting to a directory, a pool of worker threads writes the
+chunks read to the files, each worker receiving them through a bounded queue.
+A tar archive is written sequentially, as a single stream.
+"""
+import concurrent.futures
+import contextlib
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+
+from aiida.orm import SinglefileData
+
+from aiida_bigdft.utils.compression import CHUNK_SIZE
+
+
+def export_name(node):
+    """
+    Return the name a node is exported under, prefixed by its pk to avoid clashes
+    """
+    if isinstance(node, SinglefileData):
+        return f"{node.pk}-{node.filename}"
+    return f"{node.pk}-{node.label or node.__class__.__name__}.txt"
+
+
+@contextlib.contextmanager
+def open_export(node):
+    """
+    Open a binary stream of the exported content of a node
+
+    Files are read from the repository (decompressed), other nodes exported as
+    their string representation.
+    """
+    if isinstance(node, SinglefileData):
+        with node.open(mode="rb") as handle:
+            yield handle
+    else:
+        yield io.BytesIO(str(node).encode("utf8"))
+
+
+def copy_stream(source, target, chunk_size=CHUNK_SIZE):
+    """
+    Copy `source` to `target` in chunks, returning the number of bytes copied
+    """
+    size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return size
+        target.write(chunk)
+        size += len(chunk)
+
+
+def exported_size(node, handle):
+    """
+    Return the size of the exported content, rewinding the handle
+    """
+    if isinstance(node, SinglefileData) and node.base.attributes.get("compression", None):
+        return node.base.attributes.get("size")
+    handle.seek(0, os.SEEK_END)
+    size = handle.tell()
+    handle.seek(0)
+    return size
+
+
+class ExportReport:
+    """
+    Number of files and bytes exported, and the elapsed time
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def throughput(self):
+        """Throughput in MB/s"""
+        return self.bytes / 1024**2 / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"exported {self.files} files, {self.bytes / 1024**2:.1f} MB in "
+            f"{self.elapsed:.2f} s ({self.throughput:.1f} MB/s)"
+        )
+
+
+# number of chunks queued for each worker writing files
+QUEUE_SIZE = 4
+
+
+def _write_files(chunks, report, failed):
+    """
+    Write the files of a worker, from a queue of their paths followed by their chunks
+
+    The queue ends with None. After an error, `failed` is set for the reading
+    thread to stop, and the queue is still emptied so that it never blocks on it.
+    """
+    target = size = None
+    try:
+        for item in iter(chunks.get, None):
+            if isinstance(item, str):
+                if target is not None:
+                    target.close()
+                    report.add(size)
+                target, size = open(item, "wb"), 0  # pylint: disable=consider-using-with
+            else:
+                target.write(item)
+                size += len(item)
+        if target is not None:
+            target.close()
+            report.add(size)
+            target = None
+    except BaseException:
+        failed.set()
+        for _ in iter(chunks.get, None):
+            pass
+        raise
+    finally:
+        if target is not None:
+            target.close()
+
+
+def export_to_directory(nodes, directory, workers=4, chunk_size=CHUNK_SIZE):
+    """
+    Export the content of `nodes` as files of `directory`
+
+    The files are read one at a time by the calling thread, and written by
+    `workers` threads, with at most `QUEUE_SIZE` chunks waiting for each.
+    Reading stops as soon as a worker fails, its error being raised.
+
+    :param nodes: iterable of nodes
+    :param directory: target directory, created if needed
+    :param workers: number of threads writing the files
+    :param chunk_size: number of bytes copied at a time
+    :returns: ExportReport
+    """
+    os.makedirs(directory, exist_ok=True)
+    report = ExportReport()
+    queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(workers)]
+    failed = threading.Event()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_write_files, chunks, report, failed) for chunks in queues]
+        try:
+            for index, node in enumerate(nodes):
+                # the error of the failed worker is raised below
+                if failed.is_set():
+                    break
+                chunks = queues[index % workers]
+                chunks.put(os.path.join(directory, export_name(node)))
+                with open_export(node) as source:
+                    for chunk in iter(lambda source=source: source.read(chunk_size), b""):
+                        if failed.is_set():
+                            break
+                        chunks.put(chunk)
+        finally:
+            for chunks in queues:
+                chunks.put(None)
+        for future in futures:
+            future.result()
+
+    return report
+
+
+def export_to_tar(nodes, archive, chunk_size=CHUNK_SIZE):
+    """
+    Export the content of `nodes` into a single tar archive
+
+    The compression of the archive follows its extension (`.tar.gz`, `.tar.xz`, ...).
+
+    :param nodes: iterable of nodes
+    :param archive: path of the archive
+    :param chunk_size: number of bytes copied at a time
+    :returns: ExportReport
+    """
+    report = ExportReport()
+    with tarfile.open(archive, mode="w:" + _tar_compression(archive), bufsize=chunk_size) as tar:
+        for node in nodes:
+            with open_export(node) as handle:
+                info = tarfile.TarInfo(export_name(node))
+                info.size = exported_size(node, handle)
+                info.mtime = node.mtime.timestamp()
+                tar.addfile(info, handle)
+                report.add(info.size)
+    return report
+
+
+def _tar_compression(archive):
+    for extension, compression in ((".gz", "gz"), (".tgz", "gz"), (".bz2", "bz2"), (".xz", "xz")):
+        if archive.endswith(extension):
+            return compression
+    return ""
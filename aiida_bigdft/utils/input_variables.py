@@ -0,0 +1,298 @@
+"""
+Validation of BigDFT input parameters against the input variable definitions
+
+The definitions (`input_variables.yaml`, or the file given by the
+`AIIDA_BIGDFT_INPUT_VARIABLES` environment variable) are compiled once per
+process into one voluptuous schema per section. Validated parameters are
+returned in a canonical form:
+
+- values are converted to the type of their default (`"5"` becomes `5`,
+  `"Yes"` becomes `True`, a scalar grid spacing becomes a vector),
+- profile names are replaced by their values (`ixc: PBE` becomes `ixc: 11`),
+- choices take the spelling of the definitions (`method: fire` becomes `FIRE`),
+- values equal to their default, and sections left empty, are dropped,
+
+so that equivalent inputs are stored identically. Parameters importing a
+profile (`import: linear`) keep all their values, as the profile can change
+the defaults, which the definitions do not describe.
+
+The bundled definitions only cover part of the BigDFT variables: variables
+and sections missing from them are passed through unchanged, with an
+`UnknownParameterWarning` suggesting the closest known name. The structure
+(`posinp`), pseudopotentials (`psppar.*`) and the sections in `FREE_SECTIONS`
+are passed through without warning. Numerical variables also accept symbolic
+values (`inputpsiid: linear`), resolved by BigDFT from its own profiles, and
+`default` stands for the default of any variable.
+"""
+import difflib
+import functools
+import os
+import re
+import warnings
+
+from voluptuous import ALLOW_EXTRA, Invalid, MultipleInvalid, Optional, Schema
+
+from aiida_bigdft.utils import serialisation
+
+ENVIRONMENT_VARIABLE = "AIIDA_BIGDFT_INPUT_VARIABLES"
+
+DEFINITIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_variables.yaml")
+
+# keys of a variable definition which are not profiles
+METADATA = ("COMMENT", "DESCRIPTION", "DEFAULT", "RANGE", "EXCLUSIVE", "CONDITION", "PROFILE_FROM", "IMPORT")
+
+# sections not described by the bundled definitions, passed through unchanged
+FREE_SECTIONS = (
+    "posinp",
+    "import",
+    "psolver",
+    "lin_general",
+    "lin_basis",
+    "lin_kernel",
+    "lin_basis_params",
+    "chess",
+    "frag",
+    "constrained_dft",
+    "sic",
+    "tddft",
+    "md",
+    "ig_occupation",
+    "occupation",
+)
+FREE_PREFIXES = ("psppar.",)
+
+# symbolic values, such as profile names, accepted in place of numbers
+SYMBOL = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+BOOLEANS = {"yes": True, "true": True, "on": True, "no": False, "false": False, "off": False}
+
+
+class UnknownParameterWarning(UserWarning):
+    """
+    Warning of variables and sections missing from the definitions
+    """
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in BOOLEANS:
+        return BOOLEANS[value.lower()]
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise Invalid(f"expected a boolean, got {value!r}")
+
+
+def _number(kind, bounds=None):
+    """
+    Return a validator converting numbers and numeric strings to `kind`
+    """
+
+    bounds = None if bounds is None else [float(bound) for bound in bounds]
+
+    def validator(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise Invalid(f"expected {kind.__name__}, got {value!r}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise Invalid(f"expected {kind.__name__}, got {value!r}") from None
+        if kind is int:
+            if not number.is_integer():
+                raise Invalid(f"expected int, got {value!r}")
+            number = value if isinstance(value, int) else int(number)
+        if bounds is not None and not bounds[0] <= number <= bounds[1]:
+            raise Invalid(f"value {number!r} is out of range [{bounds[0]}, {bounds[1]}]")
+        return number
+
+    return validator
+
+
+def _vector(element, length):
+    """
+    Return a validator of lists of `length` elements, broadcasting scalars
+    """
+
+    def validator(value):
+        if not isinstance(value, (list, tuple)):
+            value = [value] * length
+        if len(value) != length:
+            raise Invalid(f"expected {length} values, got {len(value)}")
+        return [element(item) for item in value]
+
+    return validator
+
+
+def _choice(element, choices):
+    """
+    Return a validator of `choices`, strings being matched case insensitively
+    """
+    canonical = {str(choice).lower(): choice for choice in choices}
+
+    def validator(value):
+        value = element(value)
+        try:
+            return canonical[str(value).lower()]
+        except KeyError:
+            raise Invalid(f"{value!r} is not one of {', '.join(map(str, choices))}") from None
+
+    return validator
+
+
+def compile_variable(definition):
+    """
+    Return the validator of a variable definition, and its canonical default
+
+    The type of the variable is that of its default. Variables without a
+    default of a known type accept any value, and are never dropped. Numerical
+    variables also accept symbolic values, which are kept unchanged.
+
+    :param definition: dictionary of `DEFAULT`, `RANGE`, `EXCLUSIVE` and profiles
+    :returns: `(validator, default)`, the default being None if unknown
+    """
+    default = definition.get("DEFAULT")
+    bounds = definition.get("RANGE")
+    choices = definition.get("EXCLUSIVE")
+    profiles = {str(name).lower(): value for name, value in definition.items() if name not in METADATA}
+
+    samples = default if isinstance(default, list) else [default]
+    if samples and all(isinstance(sample, bool) for sample in samples):
+        element = _boolean
+    elif samples and all(isinstance(sample, (int, float)) and not isinstance(sample, bool) for sample in samples):
+        element = _number(float if any(isinstance(sample, float) for sample in samples) else int, bounds)
+    elif samples and all(isinstance(sample, str) for sample in samples):
+        element = str
+    else:
+        return (lambda value: value), None
+
+    numerical = element is not _boolean and element is not str
+    if choices:
+        element = _choice(element, list(choices))
+    validator = _vector(element, len(default)) if isinstance(default, list) else element
+
+    def variable(value):
+        if isinstance(value, str) and value.lower() in profiles:
+            value = profiles[value.lower()]
+        elif isinstance(value, str) and value.lower() == "default":
+            value = default
+        elif numerical and isinstance(value, str) and SYMBOL.fullmatch(value):
+            return value
+        return validator(value)
+
+    try:
+        return variable, variable(default)
+    except Invalid:
+        return variable, None
+
+
+class ParametersSchema:
+    """
+    Validator of BigDFT input parameters, see the module documentation
+
+    :param definitions: dictionary of `{section: {variable: definition}}`
+    """
+
+    def __init__(self, definitions):
+        self.schemas = {}
+        self.defaults = {}
+        for section, variables in definitions.items():
+            if not isinstance(variables, dict):
+                continue
+            validators = {}
+            self.defaults[section] = {}
+            for name, definition in variables.items():
+                if name in METADATA or not isinstance(definition, dict):
+                    continue
+                validators[Optional(name)], self.defaults[section][name] = compile_variable(definition)
+            self.schemas[section] = Schema(validators, extra=ALLOW_EXTRA)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Build the schema of a (multi-document) definitions file
+        """
+        definitions = {}
+        with open(path, "rb") as stream:
+            for document in serialisation.load_all(stream):
+                if isinstance(document, dict):
+                    definitions.update(document)
+        return cls(definitions)
+
+    def is_free(self, section):
+        """
+        Whether a section is passed through without validation
+        """
+        return section in FREE_SECTIONS or section.startswith(FREE_PREFIXES)
+
+    def __call__(self, parameters):
+        """
+        Return the canonical form of `parameters`
+
+        Unknown variables and sections are kept, see the module documentation.
+
+        :raises voluptuous.MultipleInvalid: listing every invalid value
+        """
+        canonical, errors = {}, []
+        # an imported profile sets its own defaults, explicit values override them
+        keep_defaults = "import" in (parameters or {})
+        for section, values in (parameters or {}).items():
+            if section not in self.schemas:
+                if not self.is_free(str(section)):
+                    _warn(f"unknown section {section!r}" + _suggest(section, self.schemas))
+                canonical[section] = values
+                continue
+
+            try:
+                values = self.schemas[section](values)
+            except MultipleInvalid as error:
+                errors.extend(Invalid(item.msg, path=[section] + list(item.path)) for item in error.errors)
+                continue
+            defaults = self.defaults[section]
+            for name in values:
+                if name not in defaults:
+                    _warn(f"unknown variable {section}.{name}" + _suggest(name, defaults))
+            if not keep_defaults:
+                values = {
+                    name: value for name, value in values.items() if name not in defaults or value != defaults[name]
+                }
+            if values:
+                canonical[section] = values
+
+        if errors:
+            raise MultipleInvalid(errors)
+        return canonical
+
+
+def _suggest(name, known):
+    matches = difflib.get_close_matches(str(name), [str(key) for key in known], n=1)
+    return f", did you mean {matches[0]!r}?" if matches else ""
+
+
+def _warn(message):
+    warnings.warn(f"{message} (passed to BigDFT unchanged)", UnknownParameterWarning, stacklevel=4)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(path):
+    return ParametersSchema.from_file(path)
+
+
+def get_schema(path=None):
+    """
+    Return the compiled schema of a definitions file, cached per process
+
+    :param path: definitions file, defaults to `$AIIDA_BIGDFT_INPUT_VARIABLES`
+        or the bundled definitions
+    """
+    return _compile(os.path.abspath(path or os.environ.get(ENVIRONMENT_VARIABLE) or DEFINITIONS))
+
+
+def validate_parameters(parameters, path=None):
+    """
+    Validate BigDFT input parameters, returning their canonical form
+
+    :param parameters: dictionary of input sections
+    :param path: definitions file, see `get_schema`
+    :raises voluptuous.MultipleInvalid: listing every invalid value
+    """
+    return get_schema(path)(parameters)
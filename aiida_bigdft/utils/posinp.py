@@ -0,0 +1,130 @@
+"""
+Direct writers of StructureData to BigDFT posinp files
+
+The positions are read from the attributes of the structure, without
+building its sites or an ASE Atoms object, and formatted in blocks of rows
+with a single `%` operation each, so that writing a structure is linear in
+its number of atoms with a small constant.
+
+BigDFT only handles orthorhombic cells, and its boundary conditions are
+`free`, `periodic`, `surface` (periodic along x and z) and `wire` (periodic
+along z). Other cells and periodicities raise a ValueError.
+"""
+import numpy as np
+
+FORMATS = ("xyz", "yaml")
+
+FILENAMES = {"xyz": "posinp.xyz", "yaml": "posinp.yaml"}
+
+# BigDFT boundary conditions of the (x, y, z) periodicities
+BOUNDARY_CONDITIONS = {
+    (False, False, False): "free",
+    (True, True, True): "periodic",
+    (True, False, True): "surface",
+    (False, False, True): "wire",
+}
+
+# coordinates in Angstrom, in fixed notation which every YAML and Fortran reader accepts
+COORDINATE = "%.12f"
+
+# number of atoms formatted at a time
+BLOCK_SIZE = 8192
+
+
+def boundary_conditions(structure):
+    """
+    Return the BigDFT boundary conditions and cell lengths of a structure
+
+    :param structure: StructureData
+    :returns: `(boundary conditions, [a, b, c])`, lengths in Angstrom
+    :raises ValueError: for periodicities and cells BigDFT does not handle
+    """
+    pbc = tuple(bool(periodic) for periodic in structure.pbc)
+    try:
+        conditions = BOUNDARY_CONDITIONS[pbc]
+    except KeyError:
+        raise ValueError(
+            f"BigDFT cannot handle the periodicity {pbc}, surfaces must be periodic along x and z"
+        ) from None
+
+    cell = np.asarray(structure.cell, dtype=float)
+    if conditions != "free" and np.abs(cell - np.diag(np.diag(cell))).max() > 1e-10:
+        raise ValueError("BigDFT only handles orthorhombic cells, aligned with the axes")
+    return conditions, np.diag(cell).tolist()
+
+
+def atoms(structure):
+    """
+    Return the chemical symbols and `(n, 3)` positions (Angstrom) of a structure
+
+    :raises ValueError: for alloys and vacancies
+    """
+    attributes = structure.base.attributes
+    symbols = {}
+    for kind in attributes.get("kinds", []):
+        if len(kind["symbols"]) != 1 or kind["weights"][0] < 1.0:
+            raise ValueError(f"kind {kind['name']!r} is an alloy or has vacancies")
+        symbols[kind["name"]] = kind["symbols"][0]
+
+    sites = attributes.get("sites", [])
+    names = [symbols[site["kind_name"]] for site in sites]
+    positions = np.array([site["position"] for site in sites], dtype=float).reshape(-1, 3)
+    return names, positions
+
+
+def _write_rows(handle, fmt, symbols, positions):
+    """
+    Write one `fmt % (symbol, x, y, z)` row per atom, a block at a time
+    """
+    for start in range(0, len(symbols), BLOCK_SIZE):
+        block = positions[start : start + BLOCK_SIZE]
+        rows = np.empty((len(block), 4), dtype=object)
+        rows[:, 0] = symbols[start : start + BLOCK_SIZE]
+        rows[:, 1:] = block
+        handle.write((fmt * len(block)) % tuple(rows.ravel()))
+
+
+def write_xyz(structure, handle):
+    """
+    Write a structure in the BigDFT xyz format
+
+    :param structure: StructureData
+    :param handle: text file-like object
+    """
+    conditions, lengths = boundary_conditions(structure)
+    symbols, positions = atoms(structure)
+
+    handle.write(f"{len(symbols)} angstroem\n")
+    if conditions == "free":
+        handle.write("free\n")
+    else:
+        handle.write(f"{conditions} {' '.join(COORDINATE % length for length in lengths)}\n")
+    _write_rows(handle, f"%s {COORDINATE} {COORDINATE} {COORDINATE}\n", symbols, positions)
+
+
+def write_yaml(structure, handle):
+    """
+    Write a structure in the BigDFT yaml format
+
+    Non-periodic directions of the cell are written as `.inf`.
+
+    :param structure: StructureData
+    :param handle: text file-like object
+    """
+    conditions, lengths = boundary_conditions(structure)
+    symbols, positions = atoms(structure)
+
+    handle.write("units: angstroem\n")
+    if conditions != "free":
+        periodic = structure.pbc
+        cell = ", ".join(COORDINATE % length if periodic[i] else ".inf" for i, length in enumerate(lengths))
+        handle.write(f"cell: [{cell}]\n")
+    handle.write("positions:\n" if symbols else "positions: []\n")
+    _write_rows(handle, f"- %s: [{COORDINATE}, {COORDINATE}, {COORDINATE}]\n", symbols, positions)
+
+
+def write_posinp(structure, handle, fmt="xyz"):
+    """
+    Write a structure in one of the BigDFT `FORMATS`
+    """
+    {"xyz": write_xyz, "yaml": write_yaml}[fmt](structure, handle)
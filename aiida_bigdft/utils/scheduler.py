@@ -0,0 +1,145 @@
+"""
+Classification of scheduler errors reported in the stderr of a job
+
+All known scheduler messages are compiled once per process. The stderr is
+scanned as a stream of chunks, and when several messages are found the one
+listed first in the classifier wins, regardless of where it appears in the
+file. Once a message is found, only higher priority ones are looked for in
+the rest of the stream. Lines longer than `MAX_LINE` characters, such as
+progress bars without newlines, are scanned in pieces, so that memory stays
+bounded whatever the content.
+
+Each message is searched with its own regular expression: CPython's `re` does
+not optimise alternations, and a single combined expression is several times
+slower than consecutive searches for the patterns used here.
+
+Sites can register additional messages under the
+`aiida_bigdft.scheduler_errors` entry point group. Each entry point must point
+to an iterable of `(exit code label, pattern)` pairs, which are appended after
+the built-in ones in entry point name order.
+"""
+import codecs
+import functools
+import io
+import os
+import re
+
+from aiida.plugins.entry_point import get_entry_point_names, load_entry_point
+
+ENTRY_POINT_GROUP = "aiida_bigdft.scheduler_errors"
+
+# longest line kept whole, in characters, longer lines being scanned in pieces
+MAX_LINE = 64 * 1024
+
+# (exit code label, pattern), in decreasing priority
+SCHEDULER_ERRORS = (
+    ("ERROR_OUT_OF_WALLTIME", "DUE TO TIME LIMIT"),  # slurm
+    ("ERROR_OUT_OF_WALLTIME", "exceeded hard wallclock time"),  # UGE
+    ("ERROR_OUT_OF_WALLTIME", "TERM_RUNLIMIT: job killed"),  # LFS
+    ("ERROR_OUT_OF_WALLTIME", "walltime .* exceeded limit"),  # PBS/Torque
+    ("ERROR_OUT_OF_MEMORY", "[oO]ut [oO]f [mM]emory"),
+    ("ERROR_OUT_OF_MEMORY", "oom-kill"),  # generic OOM messages
+    ("ERROR_OUT_OF_MEMORY", "Exceeded .* memory limit"),  # slurm
+    ("ERROR_OUT_OF_MEMORY", "exceeds job hard limit .*mem.* of queue"),  # UGE
+    ("ERROR_OUT_OF_MEMORY", "TERM_MEMLIMIT: job killed after reaching LSF memory usage limit"),  # LFS
+    ("ERROR_OUT_OF_MEMORY", "mem .* exceeded limit"),  # PBS/Torque
+)
+
+
+class SchedulerErrorClassifier:
+    """
+    Single pass classifier of scheduler messages
+
+    :param errors: iterable of `(exit code label, pattern)`, in decreasing priority
+    :param chunk_size: number of bytes read from the stream at a time
+    """
+
+    def __init__(self, errors=SCHEDULER_ERRORS, chunk_size=1024**2):
+        self.errors = tuple(errors)
+        self.chunk_size = chunk_size
+
+        # patterns are line-local, as `.` does not match newlines
+        self._regexes = tuple(re.compile(pattern) for _, pattern in self.errors)
+
+    @classmethod
+    def from_entry_points(cls, **kwargs):
+        """
+        Build a classifier from the built-in and registered scheduler messages
+        """
+        errors = list(SCHEDULER_ERRORS)
+        for name in get_entry_point_names(ENTRY_POINT_GROUP):
+            errors.extend(load_entry_point(ENTRY_POINT_GROUP, name))
+        return cls(errors, **kwargs)
+
+    def _best(self, text, best):
+        """
+        Return the index of the highest priority message in `text`, or `best`
+        """
+        stop = len(self._regexes) if best is None else best
+        for index, regex in enumerate(self._regexes[:stop]):
+            if regex.search(text):
+                return index
+        return best
+
+    def classify(self, stderr, tail=None):
+        """
+        Return the exit code label of the highest priority message, None if none is found
+
+        :param stderr: stderr content, as a string or a (binary) stream
+        :param tail: only scan the last `tail` bytes of a seekable stream
+        """
+        if isinstance(stderr, str):
+            stderr = io.StringIO(stderr)
+
+        skip_line = False
+        if tail is not None:
+            try:
+                stderr.seek(0, os.SEEK_END)
+                size = stderr.tell()
+                if size > tail:
+                    # start one character early, to tell whether the first line is cut
+                    stderr.seek(size - tail - 1)
+                    skip_line = True
+                else:
+                    stderr.seek(0)
+            except (OSError, ValueError):
+                pass
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        best = None
+        carry = ""
+        while best != 0:
+            chunk = stderr.read(self.chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            text = carry + chunk
+
+            # scan complete lines only, keeping the last partial one for later
+            end = text.rfind("\n") + 1
+            text, carry = text[:end], text[end:]
+            if skip_line and end:
+                # drop the line cut by the initial seek
+                text = text[text.find("\n") + 1 :]
+                skip_line = False
+            best = self._best(text, best)
+
+            if len(carry) > MAX_LINE:
+                # a line too long to be kept is scanned, then dropped
+                if not skip_line:
+                    best = self._best(carry, best)
+                carry = ""
+
+        if best != 0 and carry and not skip_line:
+            best = self._best(carry, best)
+
+        return None if best is None else self.errors[best][0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_classifier():
+    """
+    Return the process-wide classifier of built-in and registered messages
+    """
+    return SchedulerErrorClassifier.from_entry_points()
@@ -0,0 +1,61 @@
+"""
+YAML serialisation used throughout the plugin
+
+The libyaml based `CSafeLoader`/`CSafeDumper` are used when PyYAML was built
+with them, falling back on the pure-Python implementations otherwise. Both
+dumpers share the same representers, so the emitted documents are identical.
+"""
+import yaml
+from yaml.representer import SafeRepresenter
+
+LIBYAML = yaml.__with_libyaml__
+
+YAMLError = yaml.YAMLError
+
+
+class PySafeLoader(yaml.SafeLoader):
+    """Pure-Python safe loader"""
+
+
+class PySafeDumper(yaml.SafeDumper):
+    """Pure-Python safe dumper, also representing dict subclasses as plain mappings"""
+
+
+PySafeDumper.add_multi_representer(dict, SafeRepresenter.represent_dict)
+
+if LIBYAML:
+
+    class SafeLoader(yaml.CSafeLoader):
+        """libyaml safe loader"""
+
+    class SafeDumper(yaml.CSafeDumper):
+        """libyaml safe dumper, also representing dict subclasses as plain mappings"""
+
+    SafeDumper.add_multi_representer(dict, SafeRepresenter.represent_dict)
+
+else:
+    SafeLoader = PySafeLoader
+    SafeDumper = PySafeDumper
+
+
+def load(stream, Loader=SafeLoader):
+    """
+    Load a single YAML document from a string or (binary) stream
+    """
+    return yaml.load(stream, Loader=Loader)
+
+
+def load_all(stream, Loader=SafeLoader):
+    """
+    Lazily yield every YAML document of a string or (binary) stream
+    """
+    return yaml.load_all(stream, Loader=Loader)
+
+
+def dump(data, stream=None, Dumper=SafeDumper, **kwargs):
+    """
+    Dump `data` to `stream`, returning it as a string if no stream is given
+
+    Keyword arguments are those of `yaml.dump`.
+    """
+    return yaml.dump(data, stream, Dumper=Dumper, **kwargs)
@@ -0,0 +1,455 @@
+"""
+Event-driven extraction of the relevant sections of a BigDFT logfile
+
+Rather than loading the whole document tree, the YAML event stream is walked
+once and only the (small) subtrees listed in `SECTIONS` are composed and
+constructed. Everything else is skipped at the event level, so memory usage is
+bounded by the size of the largest extracted section, not by the size of the
+log itself.
+
+Multi-document logs (geometry optimisations, molecular dynamics) can also be
+indexed by the byte offsets of their documents, see `index_documents`.
+
+The closing sections of a log (final energy, forces, warnings and timings)
+can be read from its last bytes only, see `parse_log_tail`.
+"""
+import io
+import os
+import re
+
+from yaml.events import (
+    AliasEvent,
+    CollectionStartEvent,
+    DocumentStartEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+from aiida_bigdft.utils.serialisation import SafeLoader, YAMLError
+
+# path elements are mapping keys, `None` stands for any sequence item
+SECTIONS = {
+    "energy": ("Energy (Hartree)",),
+    "last_iteration": ("Last Iteration",),
+    "forces": ("Atomic Forces (Ha/Bohr)",),
+    "scf": (
+        "Ground State Optimization",
+        None,
+        "Hamiltonian Optimization",
+        None,
+        "Subspace Optimization",
+        "Wavefunctions Iterations",
+        None,
+    ),
+    "warnings": ("WARNINGS",),
+    "fermi_energy": (
+        "Ground State Optimization",
+        None,
+        "Hamiltonian Optimization",
+        None,
+        "Fermi Energy",
+    ),
+    "orbitals": (
+        "Ground State Optimization",
+        None,
+        "Hamiltonian Optimization",
+        None,
+        "Subspace Optimization",
+        "Orbitals",
+    ),
+    "forces_norm": ("Clean forces norm (Ha/Bohr)",),
+    "structure": ("Atomic structure",),
+    "walltime": ("Timings for root process", "Elapsed time (s)"),
+    "memory_peak": ("Memory Consumption Report", "Memory occupation", "Peak Value (MB)"),
+}
+
+# keys of each SCF iteration which are kept in the history
+SCF_KEYS = ("iter", "EKS", "gnrm", "D")
+
+# a document start marker, alone on its line or followed by content
+DOCUMENT_START = re.compile(rb"^---(?=[ \t\r\n]|$)", re.MULTILINE)
+# bytes of a line enough to recognise a document marker
+MARKER_SIZE = 4
+
+# sections written at the end of a log, after the SCF cycle
+TAIL_SECTIONS = ("energy", "last_iteration", "forces", "forces_norm", "warnings", "walltime", "memory_peak")
+
+# the top-level key opening the closing sections (BigDFT indents them by one space)
+LAST_ITERATION = re.compile(rb"^ ?Last Iteration[ \t]*:", re.MULTILINE)
+
+
+class LogStream:
+    """
+    Single pass walker over the YAML events of a (possibly multi-document) log
+
+    :param stream: text or binary file-like object
+    :param sections: mapping of section name to path, defaults to `SECTIONS`
+    :param Loader: loader class providing the parser, resolver and constructor
+    """
+
+    def __init__(self, stream, sections=None, Loader=SafeLoader):
+        self._loader = Loader(stream)
+        self._sections = {
+            tuple(path): name for name, path in (sections or SECTIONS).items()
+        }
+        self._prefixes = {
+            path[:i] for path in self._sections for i in range(len(path))
+        }
+        self._anchors = {}
+
+    def __iter__(self):
+        """
+        Yield `(document, name, value, anchor)` for every matching section
+
+        `document` is the index of the YAML document the section belongs to
+        """
+        document = -1
+        try:
+            while self._loader.check_event():
+                event = self._loader.get_event()
+                if isinstance(event, DocumentStartEvent):
+                    document += 1
+                    self._anchors = {}
+                    yield from self._walk(
+                        self._loader.get_event(), (), document
+                    )
+        finally:
+            self._loader.dispose()
+
+    def _walk(self, event, path, document):
+        name = self._sections.get(path)
+        if name is not None:
+            value = self._loader.construct_document(self._compose(event))
+            yield document, name, value, getattr(event, "anchor", None)
+        elif path not in self._prefixes:
+            self._skip(event)
+        elif isinstance(event, MappingStartEvent):
+            while True:
+                key = self._loader.get_event()
+                if isinstance(key, MappingEndEvent):
+                    break
+                value = self._loader.get_event()
+                if not isinstance(key, ScalarEvent):
+                    self._skip(key)
+                    self._skip(value)
+                    continue
+                yield from self._walk(value, path + (key.value,), document)
+        elif isinstance(event, SequenceStartEvent):
+            while True:
+                item = self._loader.get_event()
+                if isinstance(item, SequenceEndEvent):
+                    break
+                yield from self._walk(item, path + (None,), document)
+
+    def _skip(self, event):
+        """
+        Consume the events of the subtree started by `event`
+        """
+        if not isinstance(event, CollectionStartEvent):
+            return
+        depth = 1
+        while depth:
+            event = self._loader.get_event()
+            if isinstance(event, CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+                depth -= 1
+
+    def _compose(self, event):
+        """
+        Build the representation graph of the subtree started by `event`
+
+        Aliases of anchors defined outside the extracted sections resolve to null
+        """
+        if isinstance(event, AliasEvent):
+            return self._anchors.get(
+                event.anchor,
+                ScalarNode("tag:yaml.org,2002:null", "", event.start_mark),
+            )
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self._loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(
+                tag, event.value, event.start_mark, event.end_mark, style=event.style
+            )
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self._loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None)
+            while True:
+                item = self._loader.get_event()
+                if isinstance(item, SequenceEndEvent):
+                    break
+                node.value.append(self._compose(item))
+        else:
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self._loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None)
+            while True:
+                key = self._loader.get_event()
+                if isinstance(key, MappingEndEvent):
+                    break
+                node.value.append(
+                    (self._compose(key), self._compose(self._loader.get_event()))
+                )
+
+        if event.anchor is not None:
+            self._anchors[event.anchor] = node
+        return node
+
+
+def parse_log_stream(stream, Loader=SafeLoader):
+    """
+    Extract the final energy, forces, SCF history and warnings from a log
+
+    For multi-document logs the energy, forces, Fermi level, frontier orbitals
+    and structure are those of the last document, while SCF history, warnings
+    and wall time are accumulated over all of them. The memory peak is the largest one. The
+    energy, forces and structure of every document are listed in `steps`.
+
+    :param stream: text or binary file-like object
+    :param Loader: loader class, see `LogStream`
+    :returns: summary dictionary
+    """
+    summary = {
+        "energy": None,
+        "forces": None,
+        "scf_history": [],
+        "warnings": [],
+        "fermi_energy": None,
+        "homo": None,
+        "lumo": None,
+        "forces_norm": None,
+        "structure": None,
+        "walltime": None,
+        "memory_peak": None,
+        "steps": [],
+        "documents": 0,
+    }
+    last_iteration = {}
+    steps = {}
+    orbitals = None
+    for document, name, value, anchor in LogStream(stream, Loader=Loader):
+        summary["documents"] = document + 1
+        if name in ("energy", "forces", "structure"):
+            steps.setdefault(document, {})[name] = value
+        if name == "energy":
+            summary["energy"] = value
+        elif name == "last_iteration":
+            last_iteration[document] = value
+        elif name == "forces":
+            summary["forces"] = value
+        elif name == "warnings":
+            summary["warnings"].extend(value or [])
+        elif name in ("fermi_energy", "structure", "forces_norm"):
+            summary[name] = value
+        elif name == "orbitals":
+            orbitals = value
+        elif name == "walltime" and value is not None:
+            summary["walltime"] = (summary["walltime"] or 0) + value
+        elif name == "memory_peak" and value is not None:
+            summary["memory_peak"] = max(summary["memory_peak"] or 0, value)
+        elif name == "scf" and isinstance(value, dict):
+            # the converged iteration is repeated under a FINAL anchor
+            if anchor is not None and anchor.startswith("FINAL"):
+                continue
+            summary["scf_history"].append(
+                {key: value[key] for key in SCF_KEYS if key in value}
+            )
+
+    for document in range(summary["documents"]):
+        step = steps.setdefault(document, {})
+        if step.get("energy") is None and last_iteration.get(document):
+            final = last_iteration[document]
+            step["energy"] = final.get("FKS", final.get("EKS"))
+        summary["steps"].append(step)
+
+    if summary["energy"] is None and last_iteration:
+        final = last_iteration[max(last_iteration)] or {}
+        summary["energy"] = final.get("FKS", final.get("EKS"))
+
+    summary["homo"], summary["lumo"] = frontier_orbitals(orbitals)
+    return summary
+
+
+def frontier_orbitals(orbitals):
+    """
+    Return the energies of the highest occupied and lowest unoccupied orbitals
+
+    :param orbitals: BigDFT eigenvalues, `[{e: energy, f: occupation}, ...]`
+    :returns: `(homo, lumo)`, None for those missing from the list
+    """
+    occupied, empty = [], []
+    for orbital in orbitals or []:
+        if not isinstance(orbital, dict) or orbital.get("e") is None:
+            continue
+        (occupied if orbital.get("f", 0) > 1e-6 else empty).append(orbital["e"])
+    return max(occupied, default=None), min(empty, default=None)
+
+
+def index_documents(stream, chunk_size=1024**2):
+    """
+    Return the byte offsets at which the documents of a YAML stream start
+
+    Only the `---` markers at the start of a line are looked for, without
+    parsing, so indexing costs a single sequential read of the stream. Content
+    preceding the first marker (other than comments and blank lines) is a
+    document of its own, starting at 0.
+
+    Markers are searched for in each chunk in place. Of a line running over
+    the end of a chunk, only its first bytes are kept, so that memory is
+    bounded by the chunk size whatever the size of the stream.
+
+    :param stream: binary file-like object, read from its current position
+    :param chunk_size: number of bytes read at a time
+    :returns: list of offsets relative to the initial position
+    """
+    offsets = []
+    position = 0  # offset of the chunk
+    head = True  # only comments and blank lines seen so far
+    # the line running over from the previous chunks: its offset, first bytes
+    # and first non-blank byte
+    line_start, prefix, lead = 0, b"", b""
+    while True:
+        chunk = stream.read(chunk_size)
+        end = chunk.find(b"\n")
+        if chunk and end < 0:
+            # the line goes on in the next chunk
+            prefix += chunk[: MARKER_SIZE - len(prefix)]
+            lead = lead or chunk.lstrip()[:1]
+            position += len(chunk)
+            continue
+
+        # the line started in a previous chunk ends here (or at the end of the stream)
+        if DOCUMENT_START.match(prefix + chunk[: max(end, 0)][: MARKER_SIZE - len(prefix)]):
+            head = False
+            offsets.append(line_start)
+        elif head and (lead or chunk[: max(end, 0)].lstrip()[:1]) not in (b"", b"#"):
+            head = False
+            offsets.append(0)
+        if not chunk:
+            return offsets
+
+        # complete lines of the chunk
+        start, last = end + 1, chunk.rfind(b"\n") + 1
+        for match in DOCUMENT_START.finditer(chunk, start, last):
+            if head and _has_content(chunk[start : match.start()]):
+                offsets.append(0)
+            head = False
+            offsets.append(position + match.start())
+        if head and _has_content(chunk[start:last]):
+            offsets.append(0)
+            head = False
+
+        line_start = position + last
+        prefix = chunk[last : last + MARKER_SIZE]
+        lead = chunk[last:].lstrip()[:1]
+        position += len(chunk)
+
+
+def _has_content(text):
+    """
+    Whether `text` holds anything other than comments and blank lines
+    """
+    return any(
+        line.strip() and not line.lstrip().startswith(b"#")
+        for line in text.splitlines()
+    )
+
+
+def parse_log_tail(stream, tail=256 * 1024, Loader=SafeLoader):
+    """
+    Extract the closing sections of a log from its last `tail` bytes
+
+    Only the final energy, forces, warnings, wall time and memory peak of the
+    last document are read, the rest of the summary is left empty (`None` for
+    the SCF history and the number of documents, which are unknown). The tail
+    is parsed from the `Last Iteration` key, which opens the closing sections.
+
+    :param stream: seekable binary file-like object
+    :param tail: number of bytes read from the end of the stream
+    :param Loader: loader class, see `LogStream`
+    :returns: summary dictionary as `parse_log_stream`, None if the tail does
+        not hold all the closing sections (truncated log or too short a tail)
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    start = max(0, size - tail)
+    stream.seek(start)
+    data = stream.read()
+
+    # only the last document
+    markers = list(DOCUMENT_START.finditer(data))
+    if markers:
+        data = data[markers[-1].end() :]
+        data = data[data.find(b"\n") + 1 :]
+
+    matches = list(LAST_ITERATION.finditer(data))
+    if not matches:
+        return None
+
+    sections = {name: SECTIONS[name] for name in TAIL_SECTIONS}
+    try:
+        values = {
+            name: value
+            for _, name, value, _ in LogStream(
+                io.BytesIO(data[matches[-1].start() :]), sections=sections, Loader=Loader
+            )
+        }
+    except YAMLError:
+        return None
+
+    if values.get("energy") is None:
+        return None
+    return {
+        "energy": values["energy"],
+        "forces": values.get("forces"),
+        "scf_history": None,
+        "warnings": values.get("warnings") or [],
+        "fermi_energy": None,
+        "homo": None,
+        "lumo": None,
+        "forces_norm": values.get("forces_norm"),
+        "structure": None,
+        "walltime": values.get("walltime"),
+        "memory_peak": values.get("memory_peak"),
+        "steps": [],
+        "documents": None,
+    }
+
+
+def summary_parameters(summary):
+    """
+    Return the scalar results of a summary, as stored in `output_parameters`
+
+    Energies are in Hartree, forces in Ha/Bohr, the wall time in seconds and
+    the memory peak in MB. Values missing from the log are left out.
+
+    :param summary: dictionary returned by `parse_log_stream` or `parse_log_tail`
+    :returns: dictionary
+    """
+    forces_norm = summary["forces_norm"] or {}
+    homo, lumo = summary["homo"], summary["lumo"]
+    parameters = {
+        "energy": summary["energy"],
+        "fermi_energy": summary["fermi_energy"],
+        "homo": homo,
+        "lumo": lumo,
+        "homo_lumo_gap": None if homo is None or lumo is None else lumo - homo,
+        "forces_max": forces_norm.get("maxval"),
+        "forces_fnrm2": forces_norm.get("fnrm2"),
+        "scf_iterations": None if summary["scf_history"] is None else len(summary["scf_history"]),
+        "walltime": summary["walltime"],
+        "memory_peak": summary["memory_peak"],
+        "warnings": len(summary["warnings"]),
+        "documents": summary["documents"],
+    }
+    return {key: value for key, value in parameters.items() if value is not None}
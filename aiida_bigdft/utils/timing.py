@@ -0,0 +1,289 @@
+"""
+Array representation of the BigDFT time-{jobname}.yaml report
+
+For each section of the run (INIT, WFN_OPT, LAST, ...) the time report gives,
+for every class and category of operations, the percentage of the section,
+the time spent on the root process and the maximal and minimal load of the MPI
+processes relative to the average. These are stored as `(n, 4)` arrays of
+`COLUMNS`, so that timings of many calculations can be compared without
+reading their yaml reports.
+
+BigDFT only reports the load spread over the MPI processes, not the time of
+each of them, so the load imbalance of a category is `max_load - min_load`.
+"""
+import re
+
+import numpy as np
+
+from aiida.orm import ArrayData
+
+from aiida_bigdft.utils import serialisation
+
+COLUMNS = ("percent", "time", "max_load", "min_load")
+
+# keys of a time report which are not sections
+METADATA = ("SUMMARY", "CPU parallelism", "Report timestamp", "Hostnames")
+
+
+def array_name(section):
+    """
+    Return the array name prefix used for a section
+    """
+    return re.sub(r"\W", "_", section).lower()
+
+
+def _rows(entries, data=lambda value: value):
+    """
+    Split `{name: value}` entries into names and an `(n, 4)` array of `COLUMNS`
+    """
+    names, rows = [], []
+    for name, value in (entries or {}).items():
+        value = data(value)
+        if not isinstance(value, list) or len(value) < len(COLUMNS):
+            continue
+        names.append(str(name))
+        rows.append(value[: len(COLUMNS)])
+    return names, np.array(rows, dtype=float).reshape(-1, len(COLUMNS))
+
+
+def _combine(first, second):
+    """
+    Accumulate the rows of `second` into `first`, both `(names, array)`
+
+    Times are summed and loads averaged with the time as weight. Percentages
+    are recomputed by `parse_time_report` once all documents are combined.
+    """
+    names = list(first[0])
+    array = first[1].copy()
+    for name, row in zip(*second):
+        if name not in names:
+            names.append(name)
+            array = np.vstack([array, row])
+            continue
+        old = array[names.index(name)]
+        time = old[1] + row[1]
+        weights = (old[1], row[1]) if time else (1, 1)
+        old[2:] = np.average([old[2:], row[2:]], axis=0, weights=weights)
+        old[1] = time
+    return names, array
+
+
+def parse_time_report(stream):
+    """
+    Parse a (possibly multi-document) time report into arrays
+
+    Runs appending to the same report, such as geometry optimisations, write
+    one document per step. Their timings are accumulated.
+
+    :param stream: text or binary file-like object
+    :returns: dictionary with `sections` (`{section: {"classes": (names,
+        array), "categories": (names, classes, array)}}`), `summary` (names and
+        `(n, 2)` array of percent and time), `mpi_tasks`, `omp_threads`,
+        `hostnames` and `documents`
+    """
+    timing = {
+        "sections": {},
+        "summary": ([], np.zeros((0, 2))),
+        "mpi_tasks": None,
+        "omp_threads": None,
+        "hostnames": {},
+        "documents": 0,
+    }
+    category_classes = {}
+
+    for document in serialisation.load_all(stream):
+        if not isinstance(document, dict):
+            continue
+        timing["documents"] += 1
+
+        for section, content in document.items():
+            if section in METADATA or not isinstance(content, dict):
+                continue
+            classes = _rows(content.get("Classes"))
+            categories = _rows(
+                content.get("Categories"),
+                lambda value: value.get("Data") if isinstance(value, dict) else None,
+            )
+            for name, value in (content.get("Categories") or {}).items():
+                if isinstance(value, dict):
+                    category_classes.setdefault(section, {})[str(name)] = value.get("Class")
+
+            previous = timing["sections"].get(section)
+            if previous is not None:
+                classes = _combine(previous["classes"], classes)
+                categories = _combine(previous["categories"], categories)
+            timing["sections"][section] = {"classes": classes, "categories": categories}
+
+        names, summary = timing["summary"]
+        for name, value in (document.get("SUMMARY") or {}).items():
+            if name not in names:
+                names.append(name)
+                summary = np.vstack([summary, np.zeros(2)])
+            row = summary[names.index(name)]
+            row[0], row[1] = value[0], row[1] + value[1]
+        timing["summary"] = names, summary
+
+        parallelism = document.get("CPU parallelism") or {}
+        timing["mpi_tasks"] = parallelism.get("MPI tasks", timing["mpi_tasks"])
+        timing["omp_threads"] = parallelism.get("OMP threads", timing["omp_threads"])
+        timing["hostnames"] = document.get("Hostnames") or timing["hostnames"]
+
+    names, summary = timing["summary"]
+    if "Total" in names and timing["documents"] > 1:
+        # percentages of accumulated reports, relative to the accumulated times
+        summary[:, 0] = 100 * summary[:, 1] / summary[names.index("Total"), 1]
+        for section, content in timing["sections"].items():
+            total = summary[names.index(section), 1] if section in names else 0
+            for key in ("classes", "categories"):
+                array = content[key][1]
+                array[:, 0] = 100 * array[:, 1] / total if total else 0
+
+    for section, content in timing["sections"].items():
+        names, array = content["categories"]
+        classes = [category_classes.get(section, {}).get(name) for name in names]
+        content["categories"] = names, classes, array
+
+    return timing
+
+
+def build_timing(stream):
+    """
+    Build an ArrayData of a time report, see `parse_time_report`
+
+    Arrays are named `<section>_classes` and `<section>_categories` (section
+    names lowercased, see `array_name`), their row names are stored in the
+    `class_names`, `category_names` and `category_classes` attributes keyed by
+    section. The run summary is in the `summary` array of percent and time.
+
+    :param stream: text or binary file-like object
+    :returns: ArrayData node
+    """
+    timing = parse_time_report(stream)
+
+    node = ArrayData()
+    class_names, category_names, category_classes = {}, {}, {}
+    for section, content in timing["sections"].items():
+        key = array_name(section)
+        class_names[key], classes = content["classes"]
+        category_names[key], category_classes[key], categories = content["categories"]
+        node.set_array(f"{key}_classes", classes)
+        node.set_array(f"{key}_categories", categories)
+
+    names, summary = timing["summary"]
+    node.set_array("summary", summary)
+
+    node.base.attributes.set_many(
+        {
+            "columns": list(COLUMNS),
+            "sections": list(timing["sections"]),
+            "summary_names": names,
+            "class_names": class_names,
+            "category_names": category_names,
+            "category_classes": category_classes,
+            "mpi_tasks": timing["mpi_tasks"],
+            "omp_threads": timing["omp_threads"],
+            "hostnames": timing["hostnames"],
+            "documents": timing["documents"],
+        }
+    )
+    return node
+
+
+def get_section(node, section, kind="classes"):
+    """
+    Return `{name: row}` of the `kind` ("classes" or "categories") of a section
+
+    :param node: ArrayData built by `build_timing`
+    :param section: section name, as in the time report
+    :returns: dictionary of name to array of `COLUMNS`
+    """
+    key = array_name(section)
+    attribute = {"classes": "class_names", "categories": "category_names"}[kind]
+    names = node.base.attributes.get(attribute)[key]
+    return dict(zip(names, node.get_array(f"{key}_{kind}")))
+
+
+def summarise(node):
+    """
+    Reduce a timing node to its parallelisation, time and load imbalance
+
+    Class times are summed over the sections. The imbalance is the average of
+    `max_load - min_load` over the categories, weighted by their time.
+
+    :param node: ArrayData built by `build_timing`
+    :returns: dictionary with `mpi_tasks`, `omp_threads`, `time`, `imbalance`
+        and `classes` (`{class: time}`)
+    """
+    attributes = node.base.attributes
+    names = attributes.get("summary_names")
+    summary = node.get_array("summary")
+    time = summary[names.index("Total"), 1] if "Total" in names else summary[:, 1].sum()
+
+    classes = {}
+    loads, weights = [], []
+    for section in attributes.get("sections"):
+        for name, row in get_section(node, section).items():
+            if name != "Total":
+                classes[name] = classes.get(name, 0) + row[1]
+        for row in get_section(node, section, "categories").values():
+            loads.append(row[2] - row[3])
+            weights.append(row[1])
+
+    imbalance = np.average(loads, weights=weights) if sum(weights) else 0.0
+    return {
+        "mpi_tasks": attributes.get("mpi_tasks"),
+        "omp_threads": attributes.get("omp_threads"),
+        "time": float(time),
+        "imbalance": float(imbalance),
+        "classes": classes,
+    }
+
+
+def profile(nodes):
+    """
+    Aggregate timing nodes by MPI and OpenMP counts
+
+    Speedup and parallel efficiency are relative to the configuration using
+    the fewest cores.
+
+    :param nodes: iterable of ArrayData built by `build_timing`
+    :returns: list of dictionaries, one per `(mpi_tasks, omp_threads)`, sorted
+        by number of cores, with `runs`, `cores`, mean `time`, `speedup`,
+        `efficiency`, mean `imbalance` and `classes` (`{class: percent}`)
+    """
+    groups = {}
+    for node in nodes:
+        summary = summarise(node)
+        key = (summary["mpi_tasks"] or 1, summary["omp_threads"] or 1)
+        groups.setdefault(key, []).append(summary)
+
+    rows = []
+    for (mpi_tasks, omp_threads), summaries in groups.items():
+        time = np.mean([summary["time"] for summary in summaries])
+        classes = {}
+        for summary in summaries:
+            for name, value in summary["classes"].items():
+                classes[name] = classes.get(name, 0) + value
+        total = sum(summary["time"] for summary in summaries)
+        rows.append(
+            {
+                "mpi_tasks": mpi_tasks,
+                "omp_threads": omp_threads,
+                "cores": mpi_tasks * omp_threads,
+                "runs": len(summaries),
+                "time": float(time),
+                "imbalance": float(np.mean([summary["imbalance"] for summary in summaries])),
+                "classes": {
+                    name: 100 * value / total if total else 0.0
+                    for name, value in classes.items()
+                },
+            }
+        )
+
+    rows.sort(key=lambda row: (row["cores"], row["mpi_tasks"]))
+    if rows:
+        reference = rows[0]
+        for row in rows:
+            row["speedup"] = reference["time"] / row["time"] if row["time"] else 0.0
+            row["efficiency"] = row["speedup"] * reference["cores"] / row["cores"]
+    return rows
@@ -0,0 +1,6 @@
+from .base import BigDFTBaseWorkChain
+from .convergence import BigDFTConvergenceWorkChain
+from .relax import BigDFTRelaxWorkChain
+from .sweep import BigDFTSweepWorkChain
+
+__all__ = ['BigDFTBaseWorkChain', 'BigDFTConvergenceWorkChain', 'BigDFTRelaxWorkChain', 'BigDFTSweepWorkChain']
@@ -0,0 +1,269 @@
+"""
+Restart loop of BigDFT calculations, escalating their resources on failure
+
+Calculations running out of memory or walltime are resubmitted with more
+resources, following an escalation `policy`, and restarted from the orbitals
+of the failed run when they are found in its remote folder.
+"""
+import math
+
+from voluptuous import ALLOW_EXTRA, All, Any, Coerce, Invalid, Optional, Range, Schema
+
+from aiida.common import AttributeDict
+from aiida.engine import BaseRestartWorkChain, ProcessHandlerReport, process_handler, while_
+from aiida.orm import Dict, load_node
+
+from aiida_bigdft.calculations import BigDFTCalculation
+
+# ways of giving more memory to each MPI process: spreading the processes over
+# more machines, requesting more memory per machine, or running fewer MPI
+# processes per machine with more OpenMP threads each
+MEMORY_STRATEGIES = ("machines", "memory", "threads")
+
+_FACTOR = All(Coerce(float), Range(min=1.0, min_included=False))
+_LIMIT = Any(None, All(Coerce(int), Range(min=1)))
+
+POLICY = Schema(
+    {
+        Optional("out_of_memory", default="machines"): Any(*MEMORY_STRATEGIES),
+        Optional("memory_factor", default=2.0): _FACTOR,
+        Optional("walltime_factor", default=1.5): _FACTOR,
+        Optional("max_num_machines", default=None): _LIMIT,
+        Optional("max_memory_kb", default=None): _LIMIT,
+        Optional("max_wallclock_seconds", default=None): _LIMIT,
+        Optional("restart_from_orbitals", default=True): bool,
+    },
+    extra=ALLOW_EXTRA,
+)
+
+
+# values of `output.orbitals` for which BigDFT writes no orbitals
+NO_ORBITALS = ("none", "no", "false", "off", "0", "")
+
+
+def validate_policy(value, _):
+    """Check the escalation policy"""
+    if value is None:
+        return None
+    try:
+        POLICY(value.get_dict())
+    except Invalid as error:
+        return f"invalid escalation policy: {error}"
+
+
+def get_policy(policy=None):
+    """
+    Return the escalation policy with its defaults
+
+    :param policy: Dict node or dictionary, None for the default policy
+    """
+    if isinstance(policy, Dict):
+        policy = policy.get_dict()
+    return POLICY(policy or {})
+
+
+def writes_orbitals(parameters):
+    """
+    Whether BigDFT is asked to write the orbitals, from the `output.orbitals` of its parameters
+
+    :param parameters: dictionary of BigDFT input parameters
+    """
+    orbitals = (parameters.get("output") or {}).get("orbitals")
+    if orbitals is None or orbitals is False:
+        return False
+    return str(orbitals).strip().lower() not in NO_ORBITALS
+
+
+def find_orbitals(node):
+    """
+    Return the names of the orbital files of a calculation, in the `data-<jobname>` directory of its remote folder
+
+    The job name is that of the calculation which actually ran for cached
+    calculations. An empty list if the directory is missing or cannot be listed.
+
+    :param node: BigDFTCalculation node with a `remote_folder` output
+    """
+    source = node
+    cache_source = node.base.caching.get_cache_source()
+    if cache_source is not None:
+        source = load_node(cache_source)
+    jobname = source.base.attributes.get("jobname", None)
+    if jobname is None:
+        return []
+    try:
+        return node.outputs.remote_folder.listdir(f"data-{jobname}")
+    except OSError:
+        return []
+
+
+def scale(value, factor, limit=None):
+    """
+    Return `value` multiplied by `factor` and rounded up, at most `limit`
+
+    :returns: the scaled value, None if it is already at the limit
+    """
+    scaled = math.ceil(value * factor)
+    if limit is not None:
+        scaled = min(scaled, limit)
+    return scaled if scaled > value else None
+
+
+class BigDFTBaseWorkChain(BaseRestartWorkChain):
+    """
+    Run a BigDFTCalculation, restarting it with more resources on memory or walltime failures
+
+    Out of memory (401), the calculation is rerun with more memory per MPI
+    process, according to the `out_of_memory` strategy of the policy. Out of
+    walltime (400), with a longer `max_wallclock_seconds`, or on more machines
+    if the calculation had no walltime set. Each escalation multiplies the
+    resource by the factor of the policy, up to its maximum.
+    """
+
+    _process_class = BigDFTCalculation
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the work chain."""
+        super().define(spec)
+
+        spec.expose_inputs(BigDFTCalculation, namespace="bigdft")
+        spec.input("policy",
+                   valid_type=Dict,
+                   required=False,
+                   validator=validate_policy,
+                   help="escalation of the resources: out_of_memory strategy (one of "
+                        + ", ".join(MEMORY_STRATEGIES) + "), memory_factor, walltime_factor, "
+                        "max_num_machines, max_memory_kb, max_wallclock_seconds and restart_from_orbitals")
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_process)(
+                cls.run_process,
+                cls.inspect_process,
+            ),
+            cls.results,
+        )
+
+        spec.expose_outputs(BigDFTCalculation)
+
+        spec.exit_code(310, 'ERROR_RESOURCES_EXHAUSTED',
+                       message='The calculation failed with the maximum resources of the escalation policy.')
+
+    def setup(self):
+        """Set up the inputs of the first calculation and the escalation policy."""
+        super().setup()
+        self.ctx.inputs = AttributeDict(self.exposed_inputs(BigDFTCalculation, "bigdft"))
+        self.ctx.policy = get_policy(self.inputs.get("policy", None))
+
+    @property
+    def resources(self):
+        return dict(self.ctx.inputs.metadata.options.resources)
+
+    def set_resources(self, **resources):
+        """
+        Update the resources of the next calculation, keeping their total number of MPI processes consistent
+        """
+        resources = {**self.resources, **resources}
+        if "tot_num_mpiprocs" in resources:
+            resources["tot_num_mpiprocs"] = resources.get("num_machines", 1) * resources.get("num_mpiprocs_per_machine", 1)
+        self.ctx.inputs.metadata.options.resources = resources
+
+    def restart_from(self, node):
+        """
+        Restart the next calculation from the orbitals of `node`, if it was asked to write them and did
+
+        Calculations killed before writing their orbitals, which is common when
+        running out of memory or walltime, are not restarted from them.
+        """
+        if not self.ctx.policy["restart_from_orbitals"] or "remote_folder" not in node.outputs:
+            return
+        if not writes_orbitals(node.inputs.parameters.get_dict()):
+            return
+        if not find_orbitals(node):
+            self.report(f"{self.ctx.process_name}<{node.pk}> wrote no orbitals, not restarting from them")
+            return
+        self.ctx.inputs.parent_folder = node.outputs.remote_folder
+
+    def escalate_machines(self):
+        """
+        Run the next calculation on more machines
+
+        :returns: description of the change, None at the maximum
+        """
+        machines = self.resources.get("num_machines", 1)
+        scaled = scale(machines, self.ctx.policy["memory_factor"], self.ctx.policy["max_num_machines"])
+        if scaled is None:
+            return None
+        self.set_resources(num_machines=scaled)
+        return f"num_machines {machines} -> {scaled}"
+
+    def escalate_memory(self):
+        """
+        Run the next calculation with more memory per machine
+
+        :returns: description of the change, None at the maximum or without a memory request
+        """
+        memory = self.ctx.inputs.metadata.options.get("max_memory_kb", None)
+        if memory is None:
+            return None
+        scaled = scale(memory, self.ctx.policy["memory_factor"], self.ctx.policy["max_memory_kb"])
+        if scaled is None:
+            return None
+        self.ctx.inputs.metadata.options.max_memory_kb = scaled
+        return f"max_memory_kb {memory} -> {scaled}"
+
+    def escalate_threads(self):
+        """
+        Run the next calculation with fewer MPI processes per machine, each with more OpenMP threads
+
+        :returns: description of the change, None with a single MPI process per machine
+        """
+        resources = self.resources
+        processes = resources.get("num_mpiprocs_per_machine", 1)
+        threads = resources.get("num_cores_per_mpiproc", 1)
+        fewer = max(1, int(processes // self.ctx.policy["memory_factor"]))
+        if fewer == processes:
+            return None
+        more = threads * processes // fewer
+        self.set_resources(num_mpiprocs_per_machine=fewer, num_cores_per_mpiproc=more)
+        return f"{processes} x {threads} -> {fewer} x {more} MPI processes x threads per machine"
+
+    def escalate_walltime(self):
+        """
+        Run the next calculation with a longer walltime, or on more machines without any
+
+        :returns: description of the change, None at the maximum
+        """
+        walltime = self.ctx.inputs.metadata.options.get("max_wallclock_seconds", None)
+        if walltime is None:
+            return self.escalate_machines()
+        scaled = scale(walltime, self.ctx.policy["walltime_factor"], self.ctx.policy["max_wallclock_seconds"])
+        if scaled is None:
+            return None
+        self.ctx.inputs.metadata.options.max_wallclock_seconds = scaled
+        return f"max_wallclock_seconds {walltime} -> {scaled}"
+
+    def escalate(self, node, change):
+        """
+        Report the escalation of the resources after the failure of `node`
+
+        :param change: description of the change, None if the resources are exhausted
+        """
+        if change is None:
+            self.report(f"{self.ctx.process_name}<{node.pk}> failed ({node.exit_message}) with the maximum resources")
+            return ProcessHandlerReport(True, self.exit_codes.ERROR_RESOURCES_EXHAUSTED)
+
+        self.restart_from(node)
+        self.report(f"{self.ctx.process_name}<{node.pk}> failed ({node.exit_message}), restarting with {change}")
+        return ProcessHandlerReport(True)
+
+    @process_handler(priority=500, exit_codes=[BigDFTCalculation.exit_codes.ERROR_OUT_OF_MEMORY])
+    def handle_out_of_memory(self, node):
+        """Give more memory to each MPI process, see `MEMORY_STRATEGIES`."""
+        strategy = self.ctx.policy["out_of_memory"]
+        return self.escalate(node, getattr(self, f"escalate_{strategy}")())
+
+    @process_handler(priority=400, exit_codes=[BigDFTCalculation.exit_codes.ERROR_OUT_OF_WALLTIME])
+    def handle_out_of_walltime(self, node):
+        """Give more time to the calculation."""
+        return self.escalate(node, self.escalate_walltime())
@@ -0,0 +1,198 @@
+"""
+Convergence of the BigDFT grid, `hgrids` and `rmult`, with respect to energy and forces
+
+The `settings` go from the coarsest, cheapest grid to the finest. They are run
+in parallel batches of `batch_size`, and each setting is compared with the
+next one: the first setting whose energy per atom and forces agree with the
+next within the tolerances is converged, and no further batch is launched.
+As the grids get finer, it is the cheapest converged setting.
+"""
+import numpy as np
+
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, calcfunction, while_
+from aiida.orm import ArrayData, Float, Int, List, load_node
+
+from aiida_bigdft.data.BigDFTParameters import BigDFTParameters
+from aiida_bigdft.workflows.base import BigDFTBaseWorkChain
+
+# grid spacings (Bohr) and radii multipliers, from the coarsest grid to the finest
+DEFAULT_SETTINGS = [
+    {"hgrids": 0.55, "rmult": [4.0, 7.0]},
+    {"hgrids": 0.5, "rmult": [4.5, 7.5]},
+    {"hgrids": 0.45, "rmult": [5.0, 8.0]},
+    {"hgrids": 0.4, "rmult": [5.5, 8.5]},
+    {"hgrids": 0.35, "rmult": [6.0, 9.0]},
+    {"hgrids": 0.3, "rmult": [6.5, 9.5]},
+    {"hgrids": 0.25, "rmult": [7.0, 10.0]},
+]
+
+
+def validate_settings(value, _):
+    """Check that every setting has `hgrids` and `rmult`"""
+    if value is None:
+        return None
+    settings = value.get_list()
+    if len(settings) < 2:
+        return "at least two settings are needed to compare them"
+    for setting in settings:
+        if not isinstance(setting, dict) or set(setting) != {"hgrids", "rmult"}:
+            return f"settings must be dictionaries of 'hgrids' and 'rmult', got {setting!r}"
+
+
+def agree(first, second, natoms, energy_tolerance, forces_tolerance):
+    """
+    Whether two results agree within the tolerances
+
+    :param first: dictionary of the `energy` (Ha) and `(n, 3)` `forces` (Ha/Bohr)
+        of a calculation, forces being None when missing
+    :param second: same for the other calculation
+    :param natoms: number of atoms, the energy tolerance being per atom
+    :param energy_tolerance: Ha/atom
+    :param forces_tolerance: largest difference of a force component, Ha/Bohr
+    """
+    if abs(first["energy"] - second["energy"]) > energy_tolerance * natoms:
+        return False
+    if first["forces"] is None or second["forces"] is None:
+        return True
+    return np.abs(np.asarray(first["forces"]) - np.asarray(second["forces"])).max() <= forces_tolerance
+
+
+@calcfunction
+def collect_convergence(settings, **results):
+    """
+    Tabulate the `hgrids`, `rmult` and `energy` (Ha) of the settings run so far
+
+    The grid is read from the settings, as the canonical parameters leave out
+    the values equal to their default.
+
+    :param settings: List of the settings of the work chain
+    :param results: `results_<i>`, the output_parameters of the settings run
+    """
+    settings = settings.get_list()[: len(results)]
+    table = ArrayData()
+    table.set_array("hgrids", np.array([setting["hgrids"] for setting in settings], dtype=float))
+    table.set_array("rmult", np.array([setting["rmult"] for setting in settings], dtype=float))
+    table.set_array("energy", np.array([results[f"results_{i}"]["energy"] for i in range(len(settings))], dtype=float))
+    return table
+
+
+class BigDFTConvergenceWorkChain(WorkChain):
+    """
+    Find the cheapest grid converging the energy and forces of a structure
+
+    The `hgrids` and `rmult` of the `dft` section of the parameters are set by
+    the settings, the other parameters are those of `base.bigdft.parameters`.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the work chain."""
+        super().define(spec)
+
+        spec.expose_inputs(BigDFTBaseWorkChain, namespace="base", exclude=("bigdft.parent_folder",))
+        spec.input("settings",
+                   valid_type=List,
+                   default=lambda: List(DEFAULT_SETTINGS),
+                   validator=validate_settings,
+                   help="list of `{hgrids, rmult}`, from the coarsest grid to the finest")
+        spec.input("energy_tolerance",
+                   valid_type=Float,
+                   default=lambda: Float(1.0e-4),
+                   help="largest energy difference of converged settings (Ha/atom)")
+        spec.input("forces_tolerance",
+                   valid_type=Float,
+                   default=lambda: Float(1.0e-4),
+                   help="largest difference of the force components of converged settings (Ha/Bohr)")
+        spec.input("batch_size",
+                   valid_type=Int,
+                   default=lambda: Int(3),
+                   help="number of settings run in parallel")
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_batch)(
+                cls.run_batch,
+                cls.inspect_batch,
+            ),
+            cls.results,
+        )
+
+        spec.output("converged_parameters", valid_type=BigDFTParameters, help="parameters of the converged setting")
+        spec.output("convergence", valid_type=ArrayData, help="hgrids, rmult and energy of the settings run")
+
+        spec.exit_code(401, 'ERROR_SETTING_FAILED',
+                       message='The calculation of a setting failed.')
+        spec.exit_code(402, 'ERROR_NOT_CONVERGED',
+                       message='No setting agrees with the next one within the tolerances.')
+
+    def setup(self):
+        """Start from the coarsest setting."""
+        self.ctx.settings = self.inputs.settings.get_list()
+        self.ctx.steps = []
+        self.ctx.converged = None
+
+    def should_run_batch(self):
+        return self.ctx.converged is None and len(self.ctx.steps) < len(self.ctx.settings)
+
+    def run_batch(self):
+        """Run the next batch of settings in parallel."""
+        inputs = AttributeDict(self.exposed_inputs(BigDFTBaseWorkChain, namespace="base"))
+        parameters = inputs.bigdft.get("parameters", None)
+        parameters = parameters.get_dict() if parameters is not None else {}
+
+        start = self.ctx.batch_start = len(self.ctx.steps)
+        for index in range(start, min(start + self.inputs.batch_size.value, len(self.ctx.settings))):
+            setting = self.ctx.settings[index]
+            inputs.bigdft.parameters = BigDFTParameters(
+                {**parameters, "dft": {**parameters.get("dft", {}), **setting}}
+            )
+            inputs.metadata = {"call_link_label": f"setting_{index}"}
+            node = self.submit(BigDFTBaseWorkChain, **inputs)
+            self.report(f"launching BigDFTBaseWorkChain<{node.pk}> for setting {index}, {setting}")
+            self.ctx.steps.append(node.pk)
+            self.to_context(**{f"setting_{index}": node})
+
+    def result(self, index):
+        """Return the energy and forces of a setting"""
+        node = load_node(self.ctx.steps[index])
+        forces = None
+        if "output_arrays" in node.outputs and "forces" in node.outputs.output_arrays.get_arraynames():
+            forces = node.outputs.output_arrays.get_array("forces")
+        return {"energy": node.outputs.output_parameters["energy"], "forces": forces}
+
+    def inspect_batch(self):
+        """Compare each setting of the batch with the next, stopping at the first agreement."""
+        start = self.ctx.batch_start
+        for pk in self.ctx.steps[start:]:
+            node = load_node(pk)
+            if not node.is_finished_ok or "output_parameters" not in node.outputs:
+                self.report(f"BigDFTBaseWorkChain<{pk}> failed with exit status {node.exit_status}")
+                return self.exit_codes.ERROR_SETTING_FAILED
+
+        natoms = len(self.inputs.base.bigdft.structure.sites)
+        # the last setting of the previous batch is compared with the first of this one
+        for index in range(max(start - 1, 0), len(self.ctx.steps) - 1):
+            first, second = self.result(index), self.result(index + 1)
+            self.report(
+                f"setting {index}: energy {first['energy']} Ha, {second['energy'] - first['energy']:+.2e} Ha "
+                f"with the next setting"
+            )
+            if agree(first, second, natoms, self.inputs.energy_tolerance.value, self.inputs.forces_tolerance.value):
+                self.ctx.converged = index
+                break
+        return None
+
+    def results(self):
+        """Attach the parameters of the converged setting."""
+        results = {
+            f"results_{index}": load_node(pk).outputs.output_parameters for index, pk in enumerate(self.ctx.steps)
+        }
+        self.out("convergence", collect_convergence(self.inputs.settings, **results))
+
+        if self.ctx.converged is None:
+            return self.exit_codes.ERROR_NOT_CONVERGED
+        setting = self.ctx.settings[self.ctx.converged]
+        self.report(f"converged with hgrids {setting['hgrids']}, rmult {setting['rmult']}")
+        self.out("converged_parameters", load_node(self.ctx.steps[self.ctx.converged]).inputs.bigdft.parameters)
+        return None
@@ -0,0 +1,239 @@
+"""
+Geometry optimisation as an outer loop of BigDFT single point calculations
+
+Each step is a `BigDFTBaseWorkChain`, whose forces move the atoms with the
+FIRE algorithm (Bitzek et al., Phys. Rev. Lett. 97, 170201, 2006). With
+`warm_start`, every step restarts from the orbitals of the previous one, the
+density being rebuilt from them, so that only the first step starts its SCF
+cycle from scratch.
+
+A relaxation driven by BigDFT itself is a single `BigDFTCalculation` with a
+`geopt` section, whose steps are in its `trajectory` output.
+"""
+import numpy as np
+from ase.units import Bohr, Hartree
+
+from aiida.common import AttributeDict
+from aiida.engine import ToContext, WorkChain, calcfunction, while_
+from aiida.orm import ArrayData, Bool, Float, Int, StructureData, TrajectoryData
+
+from aiida_bigdft.data.BigDFTParameters import BigDFTParameters
+from aiida_bigdft.workflows.base import BigDFTBaseWorkChain
+
+# FIRE parameters of ASE, for forces in eV/Angstrom and displacements in Angstrom
+FIRE = {
+    "dt": 0.1,
+    "dtmax": 1.0,
+    "maxstep": 0.2,
+    "nmin": 5,
+    "finc": 1.1,
+    "fdec": 0.5,
+    "astart": 0.1,
+    "fa": 0.99,
+}
+
+
+def fire_step(state, forces):
+    """
+    Return the FIRE displacement of the atoms under `forces`
+
+    :param state: dictionary of the velocities (None for the first step), time
+        step `dt`, mixing `a` and number of steps with positive power
+        `npositive`, updated in place with lists only, so that it can be kept in
+        the context of a work chain
+    :param forces: `(n, 3)` forces, in eV/Angstrom
+    :returns: `(n, 3)` displacements, in Angstrom
+    """
+    forces = np.asarray(forces, dtype=float)
+    if state.get("velocities") is None:
+        velocities = np.zeros_like(forces)
+        state.update(dt=FIRE["dt"], a=FIRE["astart"], npositive=0)
+    else:
+        velocities = np.asarray(state["velocities"], dtype=float)
+        power = np.vdot(forces, velocities)
+        if power > 0.0:
+            velocities = (1.0 - state["a"]) * velocities + state["a"] * forces / np.sqrt(
+                np.vdot(forces, forces)
+            ) * np.sqrt(np.vdot(velocities, velocities))
+            if state["npositive"] > FIRE["nmin"]:
+                state["dt"] = min(state["dt"] * FIRE["finc"], FIRE["dtmax"])
+                state["a"] *= FIRE["fa"]
+            state["npositive"] += 1
+        else:
+            velocities[:] = 0.0
+            state.update(dt=state["dt"] * FIRE["fdec"], a=FIRE["astart"], npositive=0)
+
+    velocities += state["dt"] * forces
+    displacements = state["dt"] * velocities
+    norm = np.sqrt(np.vdot(displacements, displacements))
+    if norm > FIRE["maxstep"]:
+        displacements *= FIRE["maxstep"] / norm
+    state["velocities"] = velocities.tolist()
+    return displacements
+
+
+@calcfunction
+def update_positions(structure, positions):
+    """
+    Return a copy of `structure` with the `positions` array (Angstrom) of an ArrayData
+    """
+    updated = structure.clone()
+    updated.reset_sites_positions(positions.get_array("positions").tolist())
+    return updated
+
+
+@calcfunction
+def collect_trajectory(**steps):
+    """
+    Build the trajectory of the relaxation from the `structure_<i>`, `arrays_<i>`
+    and `parameters_<i>` of its steps
+
+    Positions are in Angstrom, `energies` in Hartree, `forces` in Ha/Bohr (NaN
+    for the steps without forces), and `scf_iterations` counts the SCF
+    iterations of each step.
+    """
+    count = len([name for name in steps if name.startswith("structure_")])
+    structures = [steps[f"structure_{i}"] for i in range(count)]
+
+    def forces(i):
+        arrays = steps[f"arrays_{i}"]
+        if "forces" in arrays.get_arraynames():
+            return arrays.get_array("forces")
+        return np.full((len(structures[i].sites), 3), np.nan)
+
+    trajectory = TrajectoryData()
+    trajectory.set_trajectory(
+        [site.kind_name for site in structures[0].sites],
+        np.array([[site.position for site in structure.sites] for structure in structures]),
+        cells=np.array([structure.cell for structure in structures]),
+        pbc=structures[0].pbc,
+    )
+    trajectory.set_array("energies", np.array([steps[f"parameters_{i}"]["energy"] for i in range(count)]))
+    trajectory.set_array("forces", np.array([forces(i) for i in range(count)]))
+    trajectory.set_array(
+        "scf_iterations",
+        np.array([steps[f"parameters_{i}"].get("scf_iterations", 0) for i in range(count)], dtype=int),
+    )
+    return trajectory
+
+
+class BigDFTRelaxWorkChain(WorkChain):
+    """
+    Relax the positions of a structure with steps of BigDFT single point calculations
+
+    The relaxation converges when the largest atomic force is below `fmax`.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the work chain."""
+        super().define(spec)
+
+        spec.expose_inputs(BigDFTBaseWorkChain, namespace="base", exclude=("bigdft.structure", "bigdft.parent_folder"))
+        spec.input("structure", valid_type=StructureData, help="structure to relax")
+        spec.input("fmax",
+                   valid_type=Float,
+                   default=lambda: Float(1.0e-3),
+                   help="largest atomic force of the relaxed structure (Ha/Bohr)")
+        spec.input("max_steps",
+                   valid_type=Int,
+                   default=lambda: Int(50),
+                   help="maximum number of single point calculations")
+        spec.input("warm_start",
+                   valid_type=Bool,
+                   default=lambda: Bool(True),
+                   help="restart each step from the orbitals of the previous one")
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_step)(
+                cls.run_step,
+                cls.inspect_step,
+            ),
+            cls.results,
+        )
+
+        spec.output("relaxed_structure", valid_type=StructureData)
+        spec.output("trajectory",
+                    valid_type=TrajectoryData,
+                    help="positions, energies, forces and SCF iterations of the steps")
+
+        spec.exit_code(401, 'ERROR_STEP_FAILED',
+                       message='The single point calculation of a step failed.')
+        spec.exit_code(402, 'ERROR_MAXIMUM_STEPS',
+                       message='The relaxation did not converge within the maximum number of steps.')
+        spec.exit_code(403, 'ERROR_NO_FORCES',
+                       message='The single point calculation of a step did not output forces.')
+
+    def setup(self):
+        """Start from the input structure."""
+        self.ctx.structure = self.inputs.structure
+        self.ctx.steps = []
+        self.ctx.structures = []
+        self.ctx.fire = {}
+        self.ctx.converged = False
+
+    def should_run_step(self):
+        return not self.ctx.converged and len(self.ctx.steps) < self.inputs.max_steps.value
+
+    def run_step(self):
+        """Run the single point calculation of the current structure."""
+        inputs = AttributeDict(self.exposed_inputs(BigDFTBaseWorkChain, namespace="base"))
+        inputs.bigdft.structure = self.ctx.structure
+        if self.inputs.warm_start.value:
+            parameters = inputs.bigdft.get("parameters", None)
+            parameters = parameters.get_dict() if parameters is not None else {}
+            output = parameters.get("output", {})
+            if str(output.get("orbitals", "none")).lower() == "none":
+                inputs.bigdft.parameters = BigDFTParameters({**parameters, "output": {**output, "orbitals": "binary"}})
+            if self.ctx.steps:
+                inputs.bigdft.parent_folder = self.ctx.steps[-1].outputs.remote_folder
+        inputs.metadata = {"call_link_label": f"step_{len(self.ctx.steps):02d}"}
+
+        node = self.submit(BigDFTBaseWorkChain, **inputs)
+        self.report(f"launching BigDFTBaseWorkChain<{node.pk}> for step {len(self.ctx.steps)}")
+        return ToContext(step=node)
+
+    def inspect_step(self):
+        """Check the forces of the step, moving the atoms if they are not converged."""
+        node = self.ctx.step
+        if not node.is_finished_ok or "output_arrays" not in node.outputs:
+            self.report(f"step {len(self.ctx.steps)} failed with exit status {node.exit_status}")
+            return self.exit_codes.ERROR_STEP_FAILED
+        if "forces" not in node.outputs.output_arrays.get_arraynames():
+            self.report(f"step {len(self.ctx.steps)} has no forces, check that the logfile reports them")
+            return self.exit_codes.ERROR_NO_FORCES
+        self.ctx.steps.append(node)
+        self.ctx.structures.append(self.ctx.structure)
+
+        forces = node.outputs.output_arrays.get_array("forces")
+        fmax = np.sqrt((forces**2).sum(axis=1)).max()
+        self.report(
+            f"step {len(self.ctx.steps) - 1}: energy {node.outputs.output_parameters['energy']} Ha, "
+            f"largest force {fmax:.2e} Ha/Bohr"
+        )
+        if fmax < self.inputs.fmax.value:
+            self.ctx.converged = True
+            return None
+
+        displacements = fire_step(self.ctx.fire, forces * Hartree / Bohr)
+        positions = ArrayData()
+        positions.set_array("positions", np.array([site.position for site in self.ctx.structure.sites]) + displacements)
+        self.ctx.structure = update_positions(self.ctx.structure, positions)
+        return None
+
+    def results(self):
+        """Attach the relaxed structure and the trajectory of the steps."""
+        steps = {}
+        for i, node in enumerate(self.ctx.steps):
+            steps[f"structure_{i}"] = self.ctx.structures[i]
+            steps[f"arrays_{i}"] = node.outputs.output_arrays
+            steps[f"parameters_{i}"] = node.outputs.output_parameters
+        self.out("trajectory", collect_trajectory(**steps))
+        self.out("relaxed_structure", self.ctx.structures[-1])
+
+        if not self.ctx.converged:
+            self.report(f"not converged after {len(self.ctx.steps)} steps")
+            return self.exit_codes.ERROR_MAXIMUM_STEPS
+        self.report(f"converged after {len(self.ctx.steps)} steps")
+        return None
@@ -0,0 +1,193 @@
+"""
+High-throughput sweep of BigDFT calculations over structures and parameters
+
+Every structure of a group is run with every set of parameters of a grid, as
+`BigDFTBaseWorkChain`, with at most `max_concurrent` of them in flight. The
+queue of pending pairs and the pks of the running ones are kept in the
+context, which is checkpointed after each step, so that a work chain
+interrupted by a daemon restart resumes where it stopped.
+
+The engine only resumes a work chain once all the processes it waits for are
+finished, so the sweep waits for the oldest running calculation, then
+collects every finished one and refills their slots. A calculation much
+longer than the others delays the refill until it finishes.
+"""
+import itertools
+
+import numpy as np
+
+from aiida.common import AttributeDict, exceptions
+from aiida.engine import ToContext, WorkChain, calcfunction, while_
+from aiida.orm import ArrayData, Int, List, Str, StructureData, load_group, load_node
+
+from aiida_bigdft.analysis import COLUMNS
+from aiida_bigdft.data.BigDFTParameters import BigDFTParameters
+from aiida_bigdft.workflows.base import BigDFTBaseWorkChain
+
+
+def parameter_grid(grid, parameters=None):
+    """
+    Return the BigDFTParameters of every combination of the values of a grid
+
+    :param grid: dictionary of `"section.variable"` to the list of its values,
+        such as `{"dft.hgrids": [0.4, 0.45], "dft.ixc": ["LDA", "PBE"]}`
+    :param parameters: dictionary of the parameters shared by the grid
+    :returns: dictionary of `grid_<i>` to BigDFTParameters, in the order of
+        `itertools.product`, the last variable varying fastest
+    """
+    names = list(grid)
+    points = {}
+    for index, values in enumerate(itertools.product(*(grid[name] for name in names))):
+        point = {section: dict(variables) for section, variables in (parameters or {}).items()}
+        for name, value in zip(names, values):
+            section, variable = name.split(".", 1)
+            point.setdefault(section, {})[variable] = value
+        points[f"grid_{index}"] = BigDFTParameters(point)
+    return points
+
+
+def validate_group(value, _):
+    """Check that the group exists and only holds structures"""
+    if value is None:
+        return None
+    try:
+        group = load_group(label=value.value)
+    except exceptions.NotExistent:
+        return f"no group with label {value.value!r}"
+    if not group.count():
+        return f"group {value.value!r} is empty"
+    if any(not isinstance(node, StructureData) for node in group.nodes):
+        return f"group {value.value!r} holds nodes which are not StructureData"
+
+
+@calcfunction
+def tabulate(rows, **results):
+    """
+    Build the results table of a sweep
+
+    :param rows: List of `[pk, structure uuid, parameters label, exit status, key]`
+        of the calculations, `key` naming their `output_parameters` in `results`,
+        None if they have none
+    :returns: ArrayData of the `pk`, `uuid`, `structure`, `parameters` and
+        `exit_status` columns, and of the `COLUMNS` of `aiida_bigdft.analysis`
+        (NaN where missing). Load it with `ResultsTable.from_array`.
+    """
+    rows = rows.get_list()
+    table = ArrayData()
+    table.set_array("pk", np.array([row[0] for row in rows], dtype=np.int64))
+    table.set_array("uuid", np.array([load_node(row[0]).uuid for row in rows], dtype="U36"))
+    table.set_array("structure", np.array([row[1] for row in rows], dtype="U36"))
+    table.set_array("parameters", np.array([row[2] for row in rows], dtype=str))
+    table.set_array("exit_status", np.array([row[3] for row in rows], dtype=np.int64))
+
+    values = np.full((len(rows), len(COLUMNS)), np.nan)
+    for index, row in enumerate(rows):
+        if row[4] is None:
+            continue
+        parameters = results[row[4]].get_dict()
+        values[index] = [np.nan if parameters.get(column) is None else parameters[column] for column in COLUMNS]
+    for index, column in enumerate(COLUMNS):
+        table.set_array(column, values[:, index])
+    return table
+
+
+class BigDFTSweepWorkChain(WorkChain):
+    """
+    Run every structure of a group with every set of parameters, a limited number at a time
+
+    Failed calculations are reported in the results table, with their exit
+    status, and do not stop the sweep.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        """Define inputs, outputs and outline of the work chain."""
+        super().define(spec)
+
+        spec.expose_inputs(
+            BigDFTBaseWorkChain, namespace="base", exclude=("bigdft.structure", "bigdft.parameters", "bigdft.parent_folder")
+        )
+        spec.input("group", valid_type=Str, validator=validate_group, help="label of the group of structures")
+        spec.input_namespace("parameters",
+                             valid_type=BigDFTParameters,
+                             dynamic=True,
+                             help="parameters of the sweep, see `parameter_grid`, the defaults if empty")
+        spec.input("max_concurrent",
+                   valid_type=Int,
+                   default=lambda: Int(10),
+                   help="maximum number of calculations in flight")
+
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run)(
+                cls.launch,
+                cls.collect,
+            ),
+            cls.results,
+        )
+
+        spec.output("results", valid_type=ArrayData, help="results table of the calculations")
+
+        spec.exit_code(401, 'ERROR_ALL_FAILED', message='All the calculations of the sweep failed.')
+
+    def setup(self):
+        """Queue every pair of structure and parameters."""
+        structures = sorted(node.uuid for node in load_group(label=self.inputs.group.value).nodes)
+        labels = sorted(self.inputs.parameters) or [None]
+        self.ctx.queue = [[uuid, label] for uuid in structures for label in labels]
+        self.ctx.running = []
+        self.ctx.finished = []
+        self.report(f"sweeping {len(structures)} structures with {len(labels)} sets of parameters")
+
+    def should_run(self):
+        return bool(self.ctx.queue or self.ctx.running)
+
+    def launch(self):
+        """Fill the free slots, then wait for the oldest running calculation."""
+        inputs = AttributeDict(self.exposed_inputs(BigDFTBaseWorkChain, namespace="base"))
+        while self.ctx.queue and len(self.ctx.running) < self.inputs.max_concurrent.value:
+            uuid, label = self.ctx.queue.pop(0)
+            structure = load_node(uuid)
+            inputs.bigdft.structure = structure
+            if label is None:
+                inputs.bigdft.pop("parameters", None)
+            else:
+                inputs.bigdft.parameters = self.inputs.parameters[label]
+            inputs.metadata = {"call_link_label": f"structure_{structure.pk}_{label or 'default'}"}
+            node = self.submit(BigDFTBaseWorkChain, **inputs)
+            self.ctx.running.append([node.pk, uuid, label])
+
+        self.report(f"{len(self.ctx.running)} running, {len(self.ctx.queue)} queued, {len(self.ctx.finished)} finished")
+        return ToContext(oldest=load_node(self.ctx.running[0][0]))
+
+    def collect(self):
+        """Move the finished calculations out of their slots."""
+        running = []
+        for pk, uuid, label in self.ctx.running:
+            node = load_node(pk)
+            if node.is_terminated:
+                self.ctx.finished.append([pk, uuid, label])
+                if not node.is_finished_ok:
+                    self.report(f"{node.process_label}<{pk}> failed with exit status {node.exit_status}")
+            else:
+                running.append([pk, uuid, label])
+        self.ctx.running = running
+
+    def results(self):
+        """Tabulate the results of the calculations."""
+        rows, results = [], {}
+        for pk, uuid, label in self.ctx.finished:
+            node = load_node(pk)
+            key = None
+            if "output_parameters" in node.outputs:
+                key = f"result_{len(results)}"
+                results[key] = node.outputs.output_parameters
+            # excepted and killed calculations have no exit status
+            exit_status = -1 if node.exit_status is None else node.exit_status
+            rows.append([pk, uuid, label or "default", exit_status, key])
+        self.out("results", tabulate(List(rows), **results))
+
+        if not results:
+            return self.exit_codes.ERROR_ALL_FAILED
+        self.report(f"{len(results)} of {len(rows)} calculations succeeded")
+        return None
@@ -0,0 +1,67 @@
+"""
+Stored size, write throughput and read latency of the compression codecs of
+`aiida_bigdft.utils.compression`
+
+Each synthetic log is compressed as it would be on its way into the
+repository, then read back with a full decompression and with a streamed
+parse of its summary.
+
+Usage: python benchmarks/bench_compression.py [iterations ...]
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from aiida_bigdft.utils.compression import CODECS, CompressingReader, decompressing_reader, zstandard
+from aiida_bigdft.utils.streaming import parse_log_stream
+
+from synthetic import write_log
+
+
+def store(path, codec):
+    """Return the stored bytes of the file at `path`"""
+    target = io.BytesIO()
+    with open(path, "rb") as source:
+        stream = source if codec is None else CompressingReader(source, codec)
+        shutil.copyfileobj(stream, target)
+    return target.getvalue()
+
+
+def read(data, codec, func):
+    source = io.BytesIO(data)
+    stream = source if codec is None else decompressing_reader(source, codec)
+    return func(stream)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    codecs = [None] + [codec for codec in CODECS if codec != "zstd" or zstandard is not None]
+    print(
+        f"{'iterations':>10} {'codec':>6} {'size (MB)':>10} {'ratio':>6} "
+        f"{'write (MB/s)':>12} {'read (s)':>9} {'parse (s)':>10}"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for iterations in sizes:
+            path = os.path.join(tmpdir, "log-bench.yaml")
+            size = write_log(path, natoms=128, norbitals=512, iterations=iterations)
+            for codec in codecs:
+                data, write = timed(store, path, codec)
+                _, latency = timed(read, data, codec, lambda stream: stream.read())
+                _, parse = timed(read, data, codec, parse_log_stream)
+                print(
+                    f"{iterations:>10} {codec or 'none':>6} {len(data) / 1024**2:>10.2f} "
+                    f"{size / len(data):>6.1f} {size / 1024**2 / write:>12.1f} "
+                    f"{latency:>9.3f} {parse:>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 5000, 20000])
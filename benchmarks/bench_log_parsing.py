@@ -0,0 +1,63 @@
+"""
+Memory and latency of the full `yaml.safe_load` of a logfile against the
+single pass event stream of `aiida_bigdft.utils.streaming` and the summary
+mode reading only the end of the log
+
+Usage: python benchmarks/bench_log_parsing.py [iterations ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from aiida_bigdft.utils import serialisation
+from aiida_bigdft.utils.streaming import parse_log_stream, parse_log_tail
+
+from synthetic import write_log
+
+
+def full_load(path):
+    with open(path, "rb") as stream:
+        return serialisation.load(stream)
+
+
+def streamed(path):
+    with open(path, "rb") as stream:
+        return parse_log_stream(stream)
+
+
+def tail(path):
+    with open(path, "rb") as stream:
+        summary = parse_log_tail(stream)
+    assert summary is not None
+    return summary
+
+
+def measure(func, path):
+    """Return (wall time in s, peak traced memory in MB) of func(path)"""
+    start = time.perf_counter()
+    func(path)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak / 1024**2
+
+
+def main(sizes):
+    print(f"{'iterations':>10} {'size (MB)':>10} {'method':>8} {'time (s)':>9} {'peak (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for iterations in sizes:
+            path = os.path.join(tmpdir, "log-bench.yaml")
+            size = write_log(path, natoms=128, norbitals=512, iterations=iterations)
+            for label, func in (("full", full_load), ("stream", streamed), ("tail", tail)):
+                elapsed, peak = measure(func, path)
+                print(f"{iterations:>10} {size / 1024**2:>10.1f} {label:>8} {elapsed:>9.3f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 5000, 20000])
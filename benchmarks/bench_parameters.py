@@ -0,0 +1,50 @@
+"""
+Validation throughput of BigDFT input parameters
+
+Compiles the input variable definitions, then validates batches of distinct
+parameter sets, as during a bulk submission, against the cached schema.
+
+Usage: python benchmarks/bench_parameters.py [count ...]
+"""
+import sys
+import time
+
+from aiida_bigdft.utils.input_variables import DEFINITIONS, ParametersSchema, get_schema
+
+
+def parameters(index):
+    """Return a parameter set mixing strings, profiles, scalars and defaults"""
+    return {
+        "dft": {
+            "ixc": ("LDA", "PBE", 11)[index % 3],
+            "hgrids": 0.3 + (index % 20) / 100,
+            "rmult": [5.0, 8.0],
+            "itermax": str(50 + index % 100),
+            "gnrm_cv": ("fast", "accurate", 1e-4)[index % 3],
+            "nspin": 1 + index % 2,
+        },
+        "output": {"orbitals": ("none", "Binary")[index % 2]},
+        "geopt": {"method": "fire", "ncount_cluster_x": index % 200},
+        "perf": {"accel": "no", "psp_onfly": "yes"},
+        "import": "linear",
+    }
+
+
+def main(counts):
+    start = time.perf_counter()
+    ParametersSchema.from_file(DEFINITIONS)
+    print(f"compiled definitions in {1000 * (time.perf_counter() - start):.2f} ms")
+
+    schema = get_schema()
+    print(f"{'count':>8} {'total (s)':>10} {'per set (us)':>13}")
+    for count in counts:
+        batch = [parameters(index) for index in range(count)]
+        start = time.perf_counter()
+        for values in batch:
+            schema(values)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>8} {elapsed:>10.3f} {1e6 * elapsed / count:>13.1f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000, 100000])
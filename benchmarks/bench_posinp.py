@@ -0,0 +1,68 @@
+"""
+Writing the structure of a calculation: ASE json against the direct posinp writers
+
+For random periodic structures of increasing size, times the former
+`get_ase().write()` route and the xyz and yaml writers of
+`aiida_bigdft.utils.posinp`, and reports the time per atom, which stays
+constant when the writer scales linearly. Nodes are never stored, a
+temporary profile is loaded to create them.
+
+Usage: python benchmarks/bench_posinp.py [natoms ...]
+"""
+import io
+import sys
+import time
+
+import numpy as np
+
+from aiida import load_profile
+from aiida.orm import StructureData
+from aiida.storage.sqlite_temp import SqliteTempBackend
+
+from aiida_bigdft.utils.posinp import write_xyz, write_yaml
+
+
+def random_structure(natoms, seed=0):
+    """Return an unstored TiO2 structure of `natoms` random positions"""
+    rng = np.random.default_rng(seed)
+    length = 2.5 * natoms ** (1 / 3)
+    structure = StructureData(cell=np.diag([length] * 3).tolist())
+    symbols = np.where(np.arange(natoms) % 3, "O", "Ti")
+    structure.base.attributes.set_many(
+        {
+            "kinds": [
+                {"name": symbol, "symbols": [symbol], "weights": [1.0], "mass": mass}
+                for symbol, mass in (("Ti", 47.867), ("O", 15.999))
+            ],
+            "sites": [
+                {"kind_name": str(symbol), "position": position}
+                for symbol, position in zip(symbols, rng.uniform(0, length, (natoms, 3)).tolist())
+            ],
+        }
+    )
+    return structure
+
+
+def write_ase(structure, handle):
+    structure.get_ase().write(handle, format="json")
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(sizes):
+    load_profile(SqliteTempBackend.create_profile("bench-posinp"), allow_switch=True)
+    writers = {"ase": write_ase, "xyz": write_xyz, "yaml": write_yaml}
+    print(f"{'natoms':>8} {'writer':>6} {'time (s)':>9} {'per atom (us)':>14}")
+    for natoms in sizes:
+        structure = random_structure(natoms)
+        for name, writer in writers.items():
+            elapsed = timed(writer, structure, io.StringIO())
+            print(f"{natoms:>8} {name:>6} {elapsed:>9.3f} {1e6 * elapsed / natoms:>14.2f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000, 100000])
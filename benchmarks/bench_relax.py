@@ -0,0 +1,55 @@
+"""
+Relaxing a structure: steps restarted from the previous orbitals against cold starts
+
+Runs the `BigDFTRelaxWorkChain` of a structure twice, with and without
+`warm_start`, and reports the number of steps, the SCF iterations summed over
+the steps and the wall time of each. Unlike the other benchmarks, it needs a
+configured profile and a BigDFT code, the calculations being run by the
+current interpreter.
+
+Usage: python benchmarks/bench_relax.py <code label> <structure file> [fmax (Ha/Bohr)]
+"""
+import sys
+import time
+
+import ase.io
+
+from aiida import load_profile
+from aiida.engine import run_get_node
+from aiida.orm import Bool, Float, StructureData, load_code
+
+from aiida_bigdft.workflows.relax import BigDFTRelaxWorkChain
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(label, filename, fmax=1.0e-3):
+    load_profile()
+    code = load_code(label)
+    structure = StructureData(ase=ase.io.read(filename))
+    base = {
+        "bigdft": {
+            "code": code,
+            "metadata": {"options": {"jobname": "relax", "resources": {"num_machines": 1}}},
+        }
+    }
+    print(f"{'start':>6} {'exit':>5} {'steps':>6} {'SCF iterations':>15} {'time (s)':>9}")
+    for warm in (False, True):
+        (results, node), elapsed = timed(
+            run_get_node, BigDFTRelaxWorkChain, base=base, structure=structure, fmax=Float(fmax), warm_start=Bool(warm)
+        )
+        iterations = results["trajectory"].get_array("scf_iterations") if "trajectory" in results else []
+        print(
+            f"{'warm' if warm else 'cold':>6} {node.exit_status:>5} {len(iterations):>6} "
+            f"{int(sum(iterations)):>15} {elapsed:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2], *[float(arg) for arg in sys.argv[3:4]])
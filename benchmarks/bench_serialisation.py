@@ -0,0 +1,52 @@
+"""
+libyaml against pure-Python YAML loading and dumping of BigDFT files
+
+Loads synthetic logs of increasing size with both loaders, dumps the result
+back with both dumpers and checks that the two emitted documents are identical.
+
+Usage: python benchmarks/bench_serialisation.py [iterations ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from aiida_bigdft.utils import serialisation
+
+from synthetic import write_log
+
+IMPLEMENTATIONS = {
+    "libyaml": (serialisation.SafeLoader, serialisation.SafeDumper),
+    "python": (serialisation.PySafeLoader, serialisation.PySafeDumper),
+}
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    if not serialisation.LIBYAML:
+        print("PyYAML was built without libyaml, both columns use the pure-Python implementation")
+
+    print(f"{'iterations':>10} {'size (MB)':>10} {'impl':>8} {'load (s)':>9} {'dump (s)':>9}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for iterations in sizes:
+            path = os.path.join(tmpdir, "log-bench.yaml")
+            size = write_log(path, natoms=128, norbitals=512, iterations=iterations)
+
+            dumped = {}
+            for label, (loader, dumper) in IMPLEMENTATIONS.items():
+                with open(path, "rb") as stream:
+                    content, load_time = timed(serialisation.load, stream, Loader=loader)
+                dumped[label], dump_time = timed(serialisation.dump, content, Dumper=dumper)
+                print(f"{iterations:>10} {size / 1024**2:>10.1f} {label:>8} {load_time:>9.3f} {dump_time:>9.3f}")
+
+            if dumped["libyaml"] != dumped["python"]:
+                raise RuntimeError("libyaml and pure-Python dumpers produced different output")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 5000, 20000])
@@ -0,0 +1,78 @@
+"""
+Generators of synthetic BigDFT output files for the benchmarks
+
+The layout follows the logs written by BigDFT 1.9 (cubic code), sized by the
+number of atoms, orbitals and SCF iterations rather than by physical content.
+"""
+import random
+
+SYMBOLS = ("Ti", "O", "O")
+
+
+def write_log(path, natoms=64, norbitals=256, iterations=200, documents=1, seed=0):
+    """
+    Write a synthetic `log-{jobname}.yaml` to `path`, returning its size in bytes
+
+    Each document is one (geometry) step of `iterations` SCF iterations.
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf8") as out:
+        for step in range(documents):
+            _write_document(out, rng, step, natoms, norbitals, iterations)
+        return out.tell()
+
+
+def _write_document(out, rng, step, natoms, norbitals, iterations):
+    symbols = [SYMBOLS[i % len(SYMBOLS)] for i in range(natoms)]
+    out.write("---\n")
+    out.write(" Version Number                        : 1.9.2\n")
+    out.write(" Number of MPI tasks                   :  8\n")
+    out.write(" Maximal OpenMP threads per MPI task   :  4\n")
+    out.write(" radical: bench\n")
+    out.write(" dft:\n   ixc: LDA\n   hgrids: [0.45, 0.45, 0.45]\n   rmult: [5.0, 8.0]\n")
+    out.write(" Atomic System Properties:\n")
+    out.write(f"   Number of atoms                     :  {natoms}\n")
+    out.write(" Atomic structure:\n   units: angstroem\n   positions:\n")
+    for i, symbol in enumerate(symbols):
+        x, y, z = (rng.uniform(0, 20) for _ in range(3))
+        out.write(f"   - {symbol}: [ {x:.9f}, {y:.9f}, {z:.9f}] # a{i + 1:04d}\n")
+    out.write(" Estimated Memory Peak (MB)            :  142\n")
+    out.write(" Ground State Optimization:\n - Hamiltonian Optimization:\n")
+    out.write("   - Subspace Optimization:\n       Wavefunctions Iterations:\n")
+    energy = -100.0 - step
+    gnrm = 0.5
+    for it in range(1, iterations + 1):
+        energy -= gnrm * 1e-2
+        gnrm *= 0.95
+        out.write(
+            "       - { #------------------------------------------------- iter: %d\n"
+            " GPU acceleration: No, Rho Commun: RED_SCT, Total electronic charge: 23.999999999,\n"
+            " Poisson Solver: {BC: Periodic, Box: [ 48, 48, 48 ], MPI tasks: 8},\n"
+            " Energies: {Ekin:  5.61234567E+01, Epot: -6.19876543E+01, Enl:  1.42345678E+01,\n"
+            " EH:  2.51234567E+01, EXC: -1.73456789E+01, EvXC: -2.28765432E+01},\n"
+            " iter: %d, EKS: %.17E, gnrm: %.2E, D: -1.11E-04,\n"
+            " DIIS weights: [ 1.00E+00,  1.00E+00], Orthoconstraint: Yes, Preconditioning: Yes}\n"
+            % (it, it, energy, gnrm)
+        )
+    out.write(
+        "       - &FINAL%03d { iter: %d, EKS: %.17E, gnrm: %.2E, D: -1.11E-04}\n"
+        % (step + 1, iterations, energy, gnrm)
+    )
+    out.write("       Orbitals: [\n")
+    for i in range(norbitals):
+        sep = "]" if i == norbitals - 1 else ","
+        out.write(f" {{e: {-1.0 + i / norbitals:.12E}, f:  2.0000}}{sep}  # {i + 1:05d}\n")
+    out.write(f"     Fermi Energy: {-1.0 + (norbitals - 1) / norbitals:.12E}\n")
+    out.write(f" Last Iteration                        : *FINAL{step + 1:03d}\n")
+    out.write(" Atomic Forces (Ha/Bohr):\n")
+    for i, symbol in enumerate(symbols):
+        fx, fy, fz = (rng.uniform(-1e-2, 1e-2) for _ in range(3))
+        out.write(f" -  {{{symbol}: [ {fx:.12E}, {fy:.12E}, {fz:.12E}]}} # {i + 1:04d}\n")
+    out.write(" Clean forces norm (Ha/Bohr): {maxval:  2.673E-03, fnrm2:  1.165E-05}\n")
+    out.write(f" Energy (Hartree)                      : {energy:.17E}\n")
+    out.write(" WARNINGS:\n - Synthetic benchmark log.\n")
+    out.write(" Timings for root process:\n")
+    out.write("   CPU time (s)                        :  1.2345678E+02\n")
+    out.write("   Elapsed time (s)                    :  3.8765432E+01\n")
+    out.write(" Memory Consumption Report:\n   Memory occupation:\n")
+    out.write("     Peak Value (MB)                   :  128.456\n")
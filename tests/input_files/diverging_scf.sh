@@ -0,0 +1,10 @@
+#!/bin/bash
+# Stub of the BigDFT wrapper, writing the log of a diverging SCF cycle one iteration at a time
+jobname=$(awk '/^jobname:/ {print $2}' "$6")
+log="log-${jobname}.yaml"
+echo " Ground State Optimization:" > "$log"
+for i in $(seq 1 40); do
+    gnrm=$(awk -v i="$i" 'BEGIN {printf "%.2E", (i <= 5 ? 0.1 * 0.5 ^ i : 0.1 * 0.5 ^ 5 * 2 ^ (i - 5))}')
+    echo " iter: $i, EKS: -1.09E+02, gnrm:  $gnrm, D: -1.0E-02," >> "$log"
+    sleep 0.25
+done
@@ -0,0 +1,49 @@
+""" Tests for the results table."""
+import os
+
+import numpy as np
+
+from aiida.common.links import LinkType
+from aiida.orm import CalcJobNode, Dict, Group
+
+from aiida_bigdft.analysis import COLUMNS, ResultsTable, gather
+from aiida_bigdft.data import BigDFTLogfile
+
+from . import TEST_DIR
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
+
+
+def generate_calc(group, outputs):
+    """Store a BigDFTCalculation node of `group` with `outputs` ({label: node})"""
+    node = CalcJobNode(process_type="aiida.calculations:bigdft").store()
+    for label, output in outputs.items():
+        output.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label=label)
+        output.store()
+    group.add_nodes(node)
+    return node
+
+
+def test_gather(tmp_path):
+    """Test gathering results from output_parameters and, for older calculations, logs"""
+    group = Group(label="bigdft-analysis").store()
+    parsed = generate_calc(group, {"output_parameters": Dict({"energy": -1.5, "walltime": 2.0})})
+    older = generate_calc(group, {"logfile": BigDFTLogfile(LOGFILE)})
+    generate_calc(Group(label="bigdft-analysis-other").store(), {"output_parameters": Dict({"energy": 0.0})})
+
+    table = gather(group, workers=0)
+    assert len(table) == 2
+    assert list(table["pk"]) == sorted([parsed.pk, older.pk])
+    index = list(table["pk"]).index(older.pk)
+    assert table["energy"][index] == -109.24578901234568
+    assert table["energy"][1 - index] == -1.5
+    assert np.isnan(table["homo"][1 - index])
+
+    table = gather(group, parse_missing=False, workers=0)
+    assert list(table["pk"]) == [parsed.pk]
+
+    path = tmp_path / "results.npz"
+    gather(group, workers=0).save(path)
+    loaded = ResultsTable.load(path)
+    assert set(loaded) == {"pk", "uuid", *COLUMNS}
+    assert loaded["uuid"][0] in (parsed.uuid, older.uuid)
@@ -0,0 +1,113 @@
+""" Tests for the resource autotuner."""
+import os
+
+import numpy as np
+import pytest
+
+from aiida.common.folders import SandboxFolder
+from aiida.common.links import LinkType
+from aiida.engine.utils import instantiate_process
+from aiida.manage import get_manager
+from aiida.orm import CalcJobNode, Group
+
+from aiida_bigdft.autotune import CostModel, gather_samples, tune
+from aiida_bigdft.calculations import BigDFTCalculation
+from aiida_bigdft.data import BigDFTParameters
+from aiida_bigdft.utils import serialisation
+from aiida_bigdft.utils.timing import build_timing
+
+from . import TEST_DIR
+from .test_calculations import generate_structure
+
+TIMEFILE = os.path.join(TEST_DIR, "input_files", "time-TiO2.yaml")
+
+COEFFICIENTS = [2.0e-3, 2.0e-4, 1.0e-5, 0.5, 3.0]
+
+
+def generate_samples():
+    """Return timings following the cost model, with an exponent of 2"""
+    model = CostModel(2.0, COEFFICIENTS)
+    samples = []
+    for natoms in (8, 32, 128, 512):
+        for mpi_tasks, omp_threads in ((1, 1), (4, 2), (16, 1), (64, 4)):
+            time = float(model.predict(natoms, 0.45, mpi_tasks, omp_threads))
+            samples.append(
+                {"natoms": natoms, "hgrids": 0.45, "num_machines": 1, "mpi_tasks": mpi_tasks,
+                 "omp_threads": omp_threads, "time": time}
+            )
+    return samples
+
+
+def test_fit():
+    """Test that the model fitted to exact timings recovers them"""
+    model = CostModel.fit(generate_samples())
+    assert model.exponent == 2.0
+    assert model.error < 1e-6
+    np.testing.assert_allclose(model.coefficients, COEFFICIENTS, rtol=1e-4)
+    # a finer grid is more work
+    assert model.predict(128, 0.3, 16, 1) > model.predict(128, 0.45, 16, 1)
+
+    with pytest.raises(ValueError):
+        CostModel.fit(generate_samples()[:4])
+
+
+def test_rank():
+    """Test that the objectives trade time against core-hours"""
+    model = CostModel(2.0, COEFFICIENTS)
+    cheapest = model.rank(512, 0.45, 16, max_machines=4)[0]
+    fastest = model.rank(512, 0.45, 16, max_machines=4, objective="time")[0]
+    assert cheapest["resources"]["num_machines"] == 1
+    assert fastest["resources"]["num_machines"] == 4
+    assert fastest["time"] < cheapest["time"]
+    assert fastest["core_hours"] > cheapest["core_hours"]
+    for candidate in (cheapest, fastest):
+        resources = candidate["resources"]
+        assert resources["num_mpiprocs_per_machine"] * resources["num_cores_per_mpiproc"] == 16
+
+    assert not model.rank(512, 0.45, 16, max_machines=4, max_time=1.0)
+    with pytest.raises(ValueError):
+        model.rank(512, 0.45, 16, objective="energy")
+
+
+def test_gather_samples(aiida_local_code_factory):
+    """Test gathering the samples of stored calculations, and tuning a builder"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    group = Group(label="bigdft-autotune").store()
+    node = CalcJobNode(computer=code.computer, process_type="aiida.calculations:bigdft")
+    node.set_option("resources", {"num_machines": 2, "num_mpiprocs_per_machine": 4})
+    node.base.links.add_incoming(generate_structure().store(), link_type=LinkType.INPUT_CALC, link_label="structure")
+    node.base.links.add_incoming(
+        BigDFTParameters({"dft": {"hgrids": 0.35}}).store(), link_type=LinkType.INPUT_CALC, link_label="parameters"
+    )
+    node.store()
+    with open(TIMEFILE, encoding="utf-8") as handle:
+        timing = build_timing(handle)
+    timing.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="timing")
+    timing.store()
+    group.add_nodes(node)
+
+    [sample] = gather_samples(group)
+    assert sample == pytest.approx(
+        {"natoms": 2, "hgrids": 0.35, "num_machines": 2, "mpi_tasks": 8, "omp_threads": 4, "time": 98.3}
+    )
+
+    builder = BigDFTCalculation.get_builder()
+    builder.code = code
+    builder.structure = generate_structure()
+    best = tune(builder, CostModel(2.0, COEFFICIENTS), cores_per_machine=8, max_machines=2, objective="time")
+    resources = best["resources"]
+    assert resources["num_machines"] == 1
+    mpi_tasks = resources["num_mpiprocs_per_machine"]
+    assert builder.metadata.options.resources == {**resources, "tot_num_mpiprocs": mpi_tasks}
+
+    # the tuned resources reach the BigDFT wrapper
+    builder.metadata.options.jobname = "TiO2"
+    builder.metadata.options.local_dir = "/tmp/TiO2"
+    process = instantiate_process(get_manager().get_runner(), builder)
+    with SandboxFolder() as folder:
+        process.prepare_for_submission(folder)
+        with folder.open("submission_parameters.yaml", "rb") as handle:
+            submission = serialisation.load(handle)
+    assert submission["mpi"] == mpi_tasks
+    assert submission["nodes"] == 1
+    assert submission["OMP"] == resources["num_cores_per_mpiproc"]
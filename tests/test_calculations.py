@@ -1,10 +1,24 @@
 """ Tests for calculations."""
 import os
 
+from plumpy import ProcessState
+import pytest
+
+from aiida.common.datastructures import CodeRunMode
+from aiida.common.exceptions import InputValidationError
+from aiida.common.folders import SandboxFolder
+from aiida.common.links import LinkType
 from aiida.engine import run
-from aiida.orm import SinglefileData
+from aiida.engine.utils import instantiate_process
+from aiida.manage import get_manager
+from aiida.manage.caching import enable_caching
+from aiida.orm import CalcJobNode, QueryBuilder, RemoteData, SinglefileData, StructureData, load_node
 from aiida.plugins import CalculationFactory, DataFactory
 
+from aiida_bigdft.calculations import BigDFTCalcJobNode, BigDFTCalculation, BigDFTPackedCalculation
+from aiida_bigdft.data import BigDFTParameters
+from aiida_bigdft.utils import serialisation
+
 from . import TEST_DIR
 
 
@@ -35,3 +49,171 @@ def test_process(pybigdft_plugin_code):
 
     assert "content1" in computed_diff
     assert "content2" in computed_diff
+
+
+def generate_structure(shift=0.0):
+    """Return a TiO2 structure, with the oxygen displaced by `shift` Angstrom"""
+    structure = StructureData(cell=[[4.6, 0.0, 0.0], [0.0, 4.6, 0.0], [0.0, 0.0, 2.96]])
+    structure.append_atom(position=(0.0, 0.0, 0.0), symbols="Ti")
+    structure.append_atom(position=(1.4 + shift, 1.4, 0.0), symbols="O")
+    return structure
+
+
+def instantiate(code, parameters=None, jobname="TiO2", shift=0.0, parent_folder=None, **options):
+    """Return a BigDFTCalculation process, with its node stored"""
+    inputs = {
+        "code": code,
+        "structure": generate_structure(shift),
+        "parameters": BigDFTParameters(parameters),
+        "metadata": {"options": {"jobname": jobname, "local_dir": f"/tmp/{jobname}", **options}},
+    }
+    if parent_folder is not None:
+        inputs["parent_folder"] = parent_folder
+    return instantiate_process(get_manager().get_runner(), BigDFTCalculation, **inputs)
+
+
+def test_prepare_for_submission(aiida_local_code_factory):
+    """Test that the structure is written in the requested format"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+
+    formats = (("xyz", "posinp.xyz", "2 angstroem"), ("yaml", "posinp.yaml", "units"), (None, "structure.json", "{"))
+    for structure_format, filename, header in formats:
+        # the ASE json of earlier versions by default
+        options = {} if structure_format is None else {"structure_format": structure_format}
+        process = instantiate(code, **options)
+        with SandboxFolder() as folder:
+            calcinfo = process.prepare_for_submission(folder)
+            assert calcinfo.codes_info[0].cmdline_params[:2] == ["--structure", filename]
+            with folder.open(filename) as handle:
+                assert handle.readline().startswith(header)
+
+
+def test_restart(aiida_local_code_factory):
+    """Test that the orbitals of the parent calculation are copied and read"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+
+    parent = instantiate(code, jobname="parent").node
+    parent_folder = RemoteData(computer=code.computer, remote_path="/scratch/parent")
+    parent_folder.base.links.add_incoming(parent, link_type=LinkType.CREATE, link_label="remote_folder")
+    parent_folder.store()
+
+    cases = (
+        ({"dft": {"hgrids": 0.4}}, 2),
+        ({"import": "linear"}, 12),
+        ({"dft": {"inputpsiid": 1}}, 1),
+        # the default, explicitly set over the linear profile
+        ({"import": "linear", "dft": {"inputpsiid": 0}}, 0),
+    )
+    for parameters, inputpsiid in cases:
+        process = instantiate(code, parameters, parent_folder=parent_folder)
+        with SandboxFolder() as folder:
+            calcinfo = process.prepare_for_submission(folder)
+            assert calcinfo.remote_copy_list == [(code.computer.uuid, "/scratch/parent/data-parent", "data-TiO2")]
+            with folder.open("input.yaml", "rb") as handle:
+                assert serialisation.load(handle)["dft"]["inputpsiid"] == inputpsiid
+
+    # not created by a calculation, the folder holds the orbitals
+    process = instantiate(code, parent_folder=RemoteData(computer=code.computer, remote_path="/scratch/orbitals"))
+    with SandboxFolder() as folder:
+        assert process.prepare_for_submission(folder).remote_copy_list[0][1] == "/scratch/orbitals"
+
+
+def test_caching(aiida_local_code_factory):
+    """Test that equivalent submissions are cached and physically different ones are not"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+
+    def launch(parameters, **kwargs):
+        return instantiate(code, parameters, **kwargs).node
+
+    node = launch({"dft": {"itermax": 5, "ixc": "PBE"}})
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(0)
+    node.seal()
+
+    with enable_caching(identifier="aiida.calculations:bigdft"):
+        # other job name and staging directory, equivalent parameters, numerical noise
+        cached = launch({"dft": {"ixc": 11, "itermax": "5"}}, jobname="TiO2-bis", shift=1e-9)
+        assert cached.base.caching.get_cache_source() == node.uuid
+
+        assert not launch({"dft": {"itermax": 6, "ixc": "PBE"}}).base.caching.is_created_from_cache
+        assert not launch({"dft": {"itermax": 5, "ixc": "PBE"}}, shift=0.01).base.caching.is_created_from_cache
+
+
+def test_rehash(aiida_local_code_factory):
+    """Test that loaded calculations are hashed like the cache lookup"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    node = instantiate(code, {"dft": {"itermax": 5}}).node
+    other = instantiate(code, {"dft": {"itermax": "5"}}, jobname="TiO2-bis", shift=1e-9).node
+    stored = node.base.caching.get_hash()
+    assert other.base.caching.get_hash() == stored
+
+    loaded = load_node(other.pk)
+    assert isinstance(loaded, BigDFTCalcJobNode)
+    assert loaded.base.caching.compute_hash() == stored
+    loaded.base.caching.rehash()
+    assert loaded.base.caching.get_hash() == stored
+    assert QueryBuilder().append(CalcJobNode, filters={"id": node.pk}).count() == 1
+
+
+def test_packed(aiida_local_code_factory):
+    """Test that packed calculations are written to their own folder, sharing the resources in parallel"""
+    code = aiida_local_code_factory(entry_point="bigdft.packed", executable="true")
+
+    def instantiate_packed(count, parameters=None, **options):
+        inputs = {
+            "code": code,
+            "structures": {f"s{i}": generate_structure(0.1 * i) for i in range(count)},
+            "parameters": parameters or {},
+            "metadata": {
+                "options": {
+                    "jobname": "TiO2",
+                    "local_dir": "/tmp/TiO2",
+                    "resources": {"num_machines": 1, "num_mpiprocs_per_machine": 4},
+                    **options,
+                }
+            },
+        }
+        return instantiate_process(get_manager().get_runner(), BigDFTPackedCalculation, **inputs)
+
+    process = instantiate_packed(
+        2, {"s1": BigDFTParameters({"dft": {"ixc": "PBE"}})}, packing="parallel", structure_format="xyz"
+    )
+    with SandboxFolder() as folder:
+        calcinfo = process.prepare_for_submission(folder)
+        assert calcinfo.codes_run_mode == CodeRunMode.PARALLEL
+        assert [info.cmdline_params for info in calcinfo.codes_info][1] == [
+            "--structure", "s1/posinp.xyz", "--parameters", "s1/input.yaml", "--submission", "s1/submission_parameters.yaml"
+        ]
+        assert "log-TiO2-s1.yaml" in calcinfo.retrieve_list
+        with folder.open("s1/submission_parameters.yaml", "rb") as handle:
+            submission = serialisation.load(handle)
+        assert submission["jobname"] == "TiO2-s1"
+        assert submission["mpi"] == 2
+        with folder.open("s1/input.yaml", "rb") as handle:
+            assert serialisation.load(handle) == {"dft": {"ixc": 11}}
+        with folder.open("s0/input.yaml", "rb") as handle:
+            assert not serialisation.load(handle)
+
+    process = instantiate_packed(2)
+    with SandboxFolder() as folder:
+        calcinfo = process.prepare_for_submission(folder)
+        assert calcinfo.codes_run_mode == CodeRunMode.SERIAL
+        with folder.open("s0/submission_parameters.yaml", "rb") as handle:
+            assert serialisation.load(handle)["jobname"] == "TiO2-s0"
+
+    # the processes left over by the split go to the first calculations
+    process = instantiate_packed(3, packing="parallel")
+    assert [item["tot_num_mpiprocs"] for item in process.item_resources(3)] == [2, 1, 1]
+    with SandboxFolder() as folder:
+        process.prepare_for_submission(folder)
+        for label, mpi in (("s0", 2), ("s2", 1)):
+            with folder.open(f"{label}/submission_parameters.yaml", "rb") as handle:
+                assert serialisation.load(handle)["mpi"] == mpi
+
+    # more calculations than processes
+    process = instantiate_packed(5, packing="parallel")
+    with SandboxFolder() as folder, pytest.raises(InputValidationError):
+        process.prepare_for_submission(folder)
+
+    with pytest.raises(ValueError, match="without a structure"):
+        instantiate_packed(1, {"s1": BigDFTParameters()})
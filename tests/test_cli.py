@@ -1,9 +1,26 @@
 """ Tests for command line interface."""
+import io
+import json
+import os
+import tarfile
+import threading
+
 from click.testing import CliRunner
+import pytest
 
+from aiida.common.links import LinkType
+from aiida.orm import CalcJobNode, Group
 from aiida.plugins import DataFactory
 
-from aiida_bigdft.cli import export, list_
+from aiida_bigdft.cli import export, list_, profile
+from aiida_bigdft.data import BigDFTLogfile
+from aiida_bigdft.utils import export as export_module
+from aiida_bigdft.utils.timing import build_timing
+
+from . import TEST_DIR
+from .test_timing import read
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
 
 
 # pylint: disable=attribute-defined-outside-init
@@ -12,8 +29,8 @@ class TestDataCli:
 
     def setup_method(self):
         """Prepare nodes for cli tests."""
-        DiffParameters = DataFactory("pybigdft_plugin")
-        self.parameters = DiffParameters({"ignore-case": True})
+        DiffParameters = DataFactory("bigdft")
+        self.parameters = DiffParameters({"dft": {"ixc": "PBE"}})
         self.parameters.store()
         self.runner = CliRunner()
 
@@ -25,6 +42,31 @@ class TestDataCli:
         result = self.runner.invoke(list_, catch_exceptions=False)
         assert str(self.parameters.pk) in result.output
 
+    def test_data_list_paginated(self):
+        """Test limit, offset, filters and JSON output of the list"""
+        DiffParameters = DataFactory("bigdft")
+        nodes = [self.parameters]
+        for i in range(4):
+            node = DiffParameters({"dft": {"itermax": 10 + i}})
+            node.label = f"params-{i}"
+            nodes.append(node.store())
+
+        result = self.runner.invoke(list_, ["--limit", "2", "--offset", "1"], catch_exceptions=False)
+        lines = result.output.splitlines()
+        assert lines[0].split() == ["pk", "uuid", "ctime", "label"]
+        assert [int(line.split()[0]) for line in lines[1:]] == [nodes[1].pk, nodes[2].pk]
+
+        result = self.runner.invoke(
+            list_, ["--label", "params-%", "--format", "json", "-p", "1"], catch_exceptions=False
+        )
+        rows = json.loads(result.output)
+        assert [row["pk"] for row in rows] == [node.pk for node in nodes[1:]]
+        assert rows[0]["uuid"] == nodes[1].uuid
+
+        filters = json.dumps({"attributes.dft.itermax": {">": 12}})
+        result = self.runner.invoke(list_, ["--filters", filters, "--format", "json"], catch_exceptions=False)
+        assert [row["label"] for row in json.loads(result.output)] == ["params-3"]
+
     def test_data_diff_export(self):
         """Test 'verdi data pybigdft_plugin export'
 
@@ -34,4 +76,77 @@ class TestDataCli:
         result = self.runner.invoke(
             export, [str(self.parameters.pk)], catch_exceptions=False
         )
-        assert "ignore-case" in result.output
+        assert "ixc" in result.output
+
+
+def test_data_profile():
+    """Test 'verdi data bigdft profile' on a group of calculations"""
+    group = Group(label="bigdft-profile").store()
+    for _ in range(2):
+        node = CalcJobNode(process_type="aiida.calculations:bigdft").store()
+        timing = build_timing(io.StringIO(read()))
+        timing.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="timing")
+        timing.store()
+        group.add_nodes(node)
+
+    result = CliRunner().invoke(profile, [group.label, "--classes"], catch_exceptions=False)
+    lines = result.output.splitlines()
+    assert "Convolutions (%)" in lines[0]
+    assert lines[2].split()[:4] == ["8", "4", "32", "2"]
+
+
+def test_data_export_bulk(tmp_path):
+    """Test exporting the files of a group to a directory and a tar archive"""
+    group = Group(label="bigdft-export").store()
+    logs = [BigDFTLogfile(LOGFILE, compression="gzip" if i else None).store() for i in range(3)]
+    group.add_nodes(logs[:2])
+    runner = CliRunner()
+
+    directory = tmp_path / "logs"
+    result = runner.invoke(
+        export,
+        [str(logs[2].pk), "--group", group.label, "-d", str(directory), "-w", "2", "--chunk-size", "1"],
+        catch_exceptions=False,
+    )
+    assert "exported 3 files" in result.output
+    with open(LOGFILE, "rb") as stream:
+        raw = stream.read()
+    for node in logs:
+        assert (directory / f"{node.pk}-log-TiO2.yaml").read_bytes() == raw
+
+    archive = tmp_path / "logs.tar.gz"
+    filters = json.dumps({"attributes.compression": "gzip"})
+    result = runner.invoke(export, ["--filters", filters, "--tar", str(archive)], catch_exceptions=False)
+    with tarfile.open(archive) as tar:
+        assert sorted(tar.getnames()) == sorted(f"{node.pk}-log-TiO2.yaml" for node in logs[1:])
+        assert tar.extractfile(tar.getmembers()[0]).read() == raw
+
+    result = runner.invoke(export, [str(logs[1].pk)], catch_exceptions=False)
+    assert result.output == raw.decode("utf8")
+
+
+def test_export_to_directory_threads(tmp_path, monkeypatch):
+    """Test that repository handles are only used by the calling thread, and that write errors are raised"""
+    logs = [BigDFTLogfile(LOGFILE).store() for _ in range(8)]
+    threads = set()
+    open_export = export_module.open_export
+
+    def recording_open_export(node):
+        threads.add(threading.current_thread())
+        return open_export(node)
+
+    monkeypatch.setattr(export_module, "open_export", recording_open_export)
+    report = export_module.export_to_directory(logs, tmp_path / "logs", workers=3, chunk_size=7)
+    assert report.files == 8
+    assert threads == {threading.current_thread()}
+    with open(LOGFILE, "rb") as stream:
+        raw = stream.read()
+    assert all((tmp_path / "logs" / f"{node.pk}-log-TiO2.yaml").read_bytes() == raw for node in logs)
+
+    # a file which cannot be written stops reading the others
+    (tmp_path / "clash" / f"{logs[1].pk}-log-TiO2.yaml").mkdir(parents=True)
+    opened = []
+    monkeypatch.setattr(export_module, "open_export", lambda node: opened.append(node) or open_export(node))
+    with pytest.raises(IsADirectoryError):
+        export_module.export_to_directory(logs, tmp_path / "clash", workers=2, chunk_size=7)
+    assert opened == logs[:2]
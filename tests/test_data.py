@@ -0,0 +1,246 @@
+""" Tests for data types."""
+import copy
+import inspect
+import io
+import os
+import warnings
+
+from BigDFT import InputActions
+import pytest
+from voluptuous import MultipleInvalid
+
+from aiida.orm import load_node
+
+from aiida_bigdft.data import BigDFTLogfile, BigDFTParameters
+from aiida_bigdft.utils.cache import DiskCache
+from aiida_bigdft.utils.input_variables import UnknownParameterWarning, get_schema, validate_parameters
+
+from . import TEST_DIR
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
+
+
+def test_content_cache():
+    """Test that stored content is parsed once and shared between instances"""
+    BigDFTLogfile.content_cache.clear()
+
+    node = BigDFTLogfile(LOGFILE).store()
+    # nothing is parsed until the content is requested
+    assert len(BigDFTLogfile.content_cache) == 0
+
+    content = node.content
+    assert content["Energy (Hartree)"] == -109.24578901234568
+
+    loaded = load_node(node.pk)
+    assert loaded.content is content
+    assert BigDFTLogfile.content_cache.hits == 1
+
+    assert loaded.logfile is loaded.logfile
+
+
+def test_disk_cache(tmp_path, monkeypatch):
+    """Test that parsed content and logfile persist in the disk cache"""
+    disk_cache = DiskCache(str(tmp_path), maxsize=1024**2)
+    monkeypatch.setattr(BigDFTLogfile, "disk_cache", disk_cache)
+    BigDFTLogfile.content_cache.clear()
+
+    node = BigDFTLogfile(LOGFILE).store()
+    content = node.content
+    assert node.logfile.energy == content["Energy (Hartree)"]
+    assert len(disk_cache.entries()) == 2
+
+    # a new session only sees the persistent cache
+    BigDFTLogfile.content_cache.clear()
+    loaded = load_node(node.pk)
+    assert loaded.content == content
+    assert loaded.logfile.energy == content["Energy (Hartree)"]
+
+    disk_cache.maxsize = 0
+    disk_cache.evict()
+    assert not disk_cache.entries()
+
+
+def test_disk_cache_writes(tmp_path, monkeypatch):
+    """Test that writes keep a running size, and never leave temporary files"""
+    disk_cache = DiskCache(str(tmp_path), maxsize=10000)
+    value = b"x" * 1000
+    disk_cache.set("first", value)
+
+    scans = []
+    entries = disk_cache.entries
+    monkeypatch.setattr(disk_cache, "entries", lambda: scans.append(1) or entries())
+    for i in range(8):
+        disk_cache.set(f"entry-{i}", value)
+    disk_cache.set("first", value)
+    assert not scans
+    # over the limit, the oldest entries are evicted below it
+    disk_cache.set("last", value)
+    assert len(scans) == 1
+    assert disk_cache.get("entry-0") is None
+    assert disk_cache.get("last") == value
+    assert disk_cache.currsize <= 0.9 * disk_cache.maxsize
+
+    def failing_replace(*_):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        disk_cache.set("full", value)
+    disk_cache.set("unpicklable", lambda: None)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_documents():
+    """Test indexed and lazy access to the documents of a multi-step log"""
+    with open(LOGFILE, encoding="utf8") as stream:
+        content = stream.read()
+    steps = [content.replace("-1.09245789012345678E+02", f"-1.1{i}E+02") for i in range(3)]
+
+    steps = [step.encode() for step in steps]
+
+    node = BigDFTLogfile(io.BytesIO(b"".join(steps)), filename="log-geopt.yaml").store()
+    assert node.base.attributes.get("document_offsets") == [0, len(steps[0]), 2 * len(steps[0])]
+
+    loaded = load_node(node.pk)
+    assert loaded.number_of_documents == 3
+    assert loaded.get_document(1)["Energy (Hartree)"] == -111.0
+    assert loaded.get_document(-1)["Energy (Hartree)"] == -112.0
+    assert [doc["Energy (Hartree)"] for doc in loaded.iter_documents(start=1)] == [-111.0, -112.0]
+    assert len(loaded.content) == 3
+
+
+def test_summary():
+    """Test the summary mode, and its fallback on the whole log"""
+    node = BigDFTLogfile(LOGFILE).store()
+    summary = node.summary()
+    assert summary["energy"] == -109.24578901234568
+    assert summary["scf_history"] is None
+    assert len(summary["forces"]) == 3
+
+    # the closing sections are not all in the tail
+    summary = node.summary(tail=1024)
+    assert summary["energy"] == -109.24578901234568
+    assert len(summary["scf_history"]) == 5
+
+
+def test_compression(tmp_path):
+    """Test that compressed files are transparently decompressed"""
+    with open(LOGFILE, "rb") as stream:
+        raw = stream.read()
+
+    for codec in ("gzip", "zstd"):
+        if codec == "zstd":
+            pytest.importorskip("zstandard")
+        node = BigDFTLogfile(LOGFILE, compression=codec).store()
+        assert node.base.attributes.get("compression") == codec
+        assert node.base.attributes.get("size") == len(raw)
+        with node.base.repository.open(node.filename, "rb") as stream:
+            assert len(stream.read()) < len(raw) / 2
+
+        loaded = load_node(node.pk)
+        with loaded.open() as stream:
+            assert stream.read() == raw.decode("utf8")
+        assert loaded.content["Energy (Hartree)"] == -109.24578901234568
+        assert loaded.get_document(0)["Energy (Hartree)"] == -109.24578901234568
+        assert loaded.summary()["energy"] == -109.24578901234568
+
+        path = tmp_path / f"log-{codec}.yaml"
+        loaded.dump_file(str(path))
+        assert path.read_bytes() == raw
+
+
+def test_parameters():
+    """Test that parameters are validated and stored in canonical form"""
+    parameters = {
+        "dft": {"ixc": "PBE", "itermax": "5", "hgrids": 0.4, "nspin": 1, "disablesym": "Yes"},
+        "output": {"orbitals": "Binary"},
+        "geopt": {"method": "none"},
+    }
+    assert BigDFTParameters(parameters).get_dict() == {
+        "dft": {"ixc": 11, "itermax": 5, "hgrids": [0.4, 0.4, 0.4], "disablesym": True},
+        "output": {"orbitals": "binary"},
+    }
+    # an imported profile changes the defaults, explicit values are kept
+    assert BigDFTParameters({**parameters, "import": "linear"}).get_dict() == {
+        "dft": {"ixc": 11, "itermax": 5, "hgrids": [0.4, 0.4, 0.4], "nspin": 1, "disablesym": True},
+        "output": {"orbitals": "binary"},
+        "geopt": {"method": "none"},
+        "import": "linear",
+    }
+    assert BigDFTParameters({"import": "linear", "dft": {"inputpsiid": 0}}).get_dict() == {
+        "import": "linear", "dft": {"inputpsiid": 0}
+    }
+    assert BigDFTParameters({"dft": {"ixc": 11, "itermax": 5.0}}).get_dict() == {"dft": {"ixc": 11, "itermax": 5}}
+    assert not BigDFTParameters().get_dict()
+
+    # symbolic values are resolved by BigDFT, "default" by the definitions
+    assert BigDFTParameters({"dft": {"inputpsiid": "linear", "gnrm_cv": "default", "hgrids": "accurate"}}).get_dict() == {
+        "dft": {"inputpsiid": "linear", "hgrids": [0.3, 0.3, 0.3]}
+    }
+
+    # variables and sections missing from the definitions are kept
+    with pytest.warns(UnknownParameterWarning) as record:
+        node = BigDFTParameters({"dft": {"itermx": 5, "ngrids": 64}, "ouptut": {"orbitals": True}})
+    assert node.get_dict() == {"dft": {"itermx": 5, "ngrids": 64}, "ouptut": {"orbitals": True}}
+    messages = sorted(str(item.message) for item in record)
+    assert messages[0] == "unknown section 'ouptut', did you mean 'output'? (passed to BigDFT unchanged)"
+    assert messages[1] == "unknown variable dft.itermx, did you mean 'itermax'? (passed to BigDFT unchanged)"
+
+    with pytest.raises(MultipleInvalid) as error:
+        BigDFTParameters({"dft": {"nspin": 3, "gnrm_cv": "1e-4x", "disablesym": "maybe"}})
+    messages = sorted(str(item) for item in error.value.errors)
+    assert messages == [
+        "3 is not one of 1, 2, 4 @ data['dft']['nspin']",
+        "expected a boolean, got 'maybe' @ data['dft']['disablesym']",
+        "expected float, got '1e-4x' @ data['dft']['gnrm_cv']",
+    ]
+
+
+def test_parameters_input_actions(tmp_path):
+    """Test that the inputs built by the PyBigDFT InputActions are accepted"""
+    psp = tmp_path / "psppar.Ti"
+    psp.write_text("Pseudopotential type: HGH-K\n")
+    arguments = {
+        "set_external_potential": {"mm_pot": {"values": []}},
+        "set_kpt_mesh": {"method": "mpgrid", "ngkpt": [2, 2, 2]},
+        "set_psp_file": {"filename": str(psp)},
+    }
+    inputs = {"calculate_pdos": {"dft": {"inputpsiid": 0}}}
+    # helpers which need objects of a calculation, or other helpers
+    skipped = ("add_cdft_constraint", "remove")
+
+    helpers = [
+        (name, helper)
+        for name, helper in inspect.getmembers(InputActions, inspect.isfunction)
+        if helper.__module__ == InputActions.__name__ and not name.startswith("_") and name not in skipped
+    ]
+    assert len(helpers) > 40
+    for name, helper in helpers:
+        parameters = copy.deepcopy(inputs.get(name, {}))
+        helper(parameters, **arguments.get(name, {}))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UnknownParameterWarning)
+            # `psppar.*` keys are valid inputs, but not valid attribute names of a node
+            validate_parameters(parameters)
+
+
+def test_parameters_hash():
+    """Test that parameters hash their canonical form"""
+    node = BigDFTParameters({"dft": {"itermax": 5, "ixc": "PBE"}}).store()
+    modified = BigDFTParameters({"dft": {"ixc": 11}})
+    modified["dft"] = {"itermax": "5", "ixc": "PBE", "nspin": 1}
+    assert modified.store().base.caching.get_hash() == node.base.caching.get_hash()
+    assert BigDFTParameters({"dft": {"itermax": 6}}).store().base.caching.get_hash() != node.base.caching.get_hash()
+
+
+def test_parameters_definitions(tmp_path, monkeypatch):
+    """Test validating against another definitions file"""
+    path = tmp_path / "input_variables.yaml"
+    path.write_text("dft:\n  itermax:\n    DEFAULT: 50\n---\nlin_general:\n  nit:\n    DEFAULT: [4, 4]\n")
+    monkeypatch.setenv("AIIDA_BIGDFT_INPUT_VARIABLES", str(path))
+    assert get_schema() is get_schema()
+
+    node = BigDFTParameters({"dft": {"itermax": "50"}, "lin_general": {"nit": 10}})
+    assert node.get_dict() == {"lin_general": {"nit": [10, 10]}}
+    with pytest.warns(UnknownParameterWarning):
+        assert BigDFTParameters({"dft": {"ixc": 11}}).get_dict() == {"dft": {"ixc": 11}}
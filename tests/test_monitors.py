@@ -0,0 +1,141 @@
+""" Tests for monitors."""
+import math
+import os
+
+from plumpy import ProcessState
+
+from aiida.engine import run_get_node
+from aiida.orm import CalcJobNode, Dict, InstalledCode
+
+from aiida_bigdft.calculations import BigDFTCalculation
+from aiida_bigdft.monitors import _HISTORIES, SCF_MONITOR_FILENAME, ScfHistory, monitor_scf
+
+from . import TEST_DIR
+from .test_calculations import generate_structure
+
+
+def iterations(residues, start=1):
+    return "".join(
+        f" iter: {i}, EKS: -1.09E+02, gnrm:  {residue:.2E}, D: -1.0E-02,\n" for i, residue in enumerate(residues, start)
+    ).encode()
+
+
+def test_scf_history():
+    """Test that residues are read across chunks, and the stop criteria"""
+    data = iterations([1e-1, 1e-2, 1e-3])
+    history = ScfHistory()
+    history.update(data[:50])
+    history.update(data[50:])
+    assert history.offset == len(data)
+    assert history.residues == [1e-1, 1e-2, 1e-3]
+    # the final iteration repeats the last one
+    history.update(iterations([1e-3], start=3))
+    assert len(history.residues) == 3
+    assert history.check() is None
+
+    history.update(iterations([1e-2, 5e-2], start=4))
+    assert history.check() is None
+    history.update(iterations([2e-1], start=6))
+    assert "diverges" in history.check()
+    assert history.check(divergence=1000.0) is None
+
+    history = ScfHistory()
+    history.update(iterations([1e-1] + [5e-2] * 11))
+    assert history.check(patience=20) is None
+    assert "stalls" in history.check(patience=10)
+
+    history = ScfHistory()
+    history.update(b" iter: 1, EKS: -1.09E+02, gnrm: ********, D: -1.0E-02,\n")
+    assert math.isnan(history.residues[0])
+    assert "nan" in history.check()
+
+
+def test_scf_history_cycles():
+    """Test that each SCF cycle of a multi-step run has its own history"""
+    converged = iterations([1e-1, 1e-2, 1e-3, 1e-4, 1e-5, 1e-6])
+    history = ScfHistory()
+    # the counter restarts for the next step of a geometry optimisation
+    history.update(converged + iterations([1e-1, 5e-2]))
+    assert history.residues == [1e-1, 5e-2]
+    assert history.check(min_iterations=1) is None
+
+    # a new document starts the next step as well
+    history = ScfHistory()
+    history.update(converged + b"---\n" + iterations([1e-1], start=7))
+    assert history.residues == [1e-1]
+
+    # a single cycle still diverges
+    history = ScfHistory()
+    history.update(converged + iterations([1e-1], start=7))
+    assert "diverges" in history.check()
+
+
+def test_monitor_scf(aiida_localhost, tmp_path):
+    """Test that the monitor only reads the appended bytes of the remote log and kills diverging runs"""
+    node = CalcJobNode(computer=aiida_localhost, process_type="aiida.calculations:bigdft")
+    node.set_option("resources", {"num_machines": 1, "num_mpiprocs_per_machine": 1})
+    node.set_option("jobname", "TiO2")
+    node.set_remote_workdir(str(tmp_path))
+    node.store()
+    log = tmp_path / "log-TiO2.yaml"
+
+    with aiida_localhost.get_transport() as transport:
+        assert monitor_scf(node, transport) is None
+
+        log.write_bytes(iterations([1e-1, 1e-2, 1e-3]))
+        assert monitor_scf(node, transport) is None
+
+        # only the appended iterations are read
+        with open(log, "r+b") as handle:
+            handle.write(b"#" * len(iterations([1e-1, 1e-2, 1e-3])))
+            handle.write(iterations([1e-2, 1.0], start=4))
+        result = monitor_scf(node, transport, min_iterations=3)
+
+    assert "diverges" in result.message
+    assert not result.override_exit_code
+    assert (tmp_path / SCF_MONITOR_FILENAME).read_text().strip() == result.message
+    assert node.uuid not in _HISTORIES
+
+
+def test_monitor_terminated(aiida_localhost, tmp_path):
+    """Test that the histories of terminated calculations are dropped"""
+    nodes = []
+    for name in ("finished", "running"):
+        node = CalcJobNode(computer=aiida_localhost, process_type="aiida.calculations:bigdft")
+        node.set_option("resources", {"num_machines": 1, "num_mpiprocs_per_machine": 1})
+        node.set_option("jobname", name)
+        node.set_remote_workdir(str(tmp_path))
+        node.store()
+        (tmp_path / f"log-{name}.yaml").write_bytes(iterations([1e-1, 1e-2]))
+        nodes.append(node)
+
+    with aiida_localhost.get_transport() as transport:
+        for node in nodes:
+            assert monitor_scf(node, transport) is None
+        assert {node.uuid for node in nodes} <= set(_HISTORIES)
+
+        nodes[0].set_process_state(ProcessState.FINISHED)
+        assert monitor_scf(nodes[1], transport) is None
+    assert nodes[0].uuid not in _HISTORIES
+    assert nodes[1].uuid in _HISTORIES
+
+
+def test_monitor_kill(aiida_localhost):
+    """Test that a calculation writing a diverging log is killed, and reported as such by the parser"""
+    aiida_localhost.set_minimum_job_poll_interval(1)
+    code = InstalledCode(
+        computer=aiida_localhost,
+        filepath_executable=os.path.join(TEST_DIR, "input_files", "diverging_scf.sh"),
+        default_calc_job_plugin="bigdft",
+    ).store()
+
+    inputs = {
+        "code": code,
+        "structure": generate_structure(),
+        "monitors": {"scf": Dict({"entry_point": "bigdft.scf", "kwargs": {"divergence": 100.0}})},
+        "metadata": {"options": {"jobname": "TiO2", "local_dir": "/tmp/TiO2"}},
+    }
+    _, node = run_get_node(BigDFTCalculation, **inputs)
+
+    assert node.exit_status == BigDFTCalculation.exit_codes.ERROR_SCF_NOT_CONVERGING.status
+    assert "diverges" in node.exit_message
@@ -0,0 +1,241 @@
+""" Tests for parsers."""
+import os
+import tracemalloc
+
+from aiida.common.links import LinkType
+from aiida.orm import CalcJobNode, Dict, FolderData, QueryBuilder, StructureData
+
+from aiida_bigdft.monitors import _HISTORIES, SCF_MONITOR_FILENAME, ScfHistory
+from aiida_bigdft.parsers import BigDFTPackedParser, BigDFTParser
+
+from . import TEST_DIR
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
+TIMEFILE = os.path.join(TEST_DIR, "input_files", "time-TiO2.yaml")
+
+
+def generate_calc_node(computer, files, jobname="TiO2", entry_point="bigdft", inputs=None, **options):
+    """Return a stored BigDFTCalculation node with `files` ({name: bytes}) retrieved"""
+    node = CalcJobNode(computer=computer, process_type=f"aiida.calculations:{entry_point}")
+    node.set_option("resources", {"num_machines": 1, "num_mpiprocs_per_machine": 1})
+    node.set_option("jobname", jobname)
+    for name, value in options.items():
+        node.set_option(name, value)
+    for label, data in (inputs or {}).items():
+        node.base.links.add_incoming(data.store(), link_type=LinkType.INPUT_CALC, link_label=label)
+    node.store()
+
+    retrieved = FolderData()
+    for name, content in files.items():
+        retrieved.base.repository.put_object_from_bytes(content, name)
+    retrieved.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="retrieved")
+    retrieved.store()
+
+    return node
+
+
+def read(path):
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+def test_parse(aiida_localhost):
+    """Test that the logfile and timefile outputs are created"""
+    node = generate_calc_node(
+        aiida_localhost,
+        {"log-TiO2.yaml": read(LOGFILE), "time-TiO2.yaml": read(TIMEFILE)},
+    )
+
+    # the SCF history of the monitor is dropped once the job is parsed
+    _HISTORIES[node.uuid] = ScfHistory()
+    parser = BigDFTParser(node)
+    exit_code = parser.parse()
+
+    assert exit_code.status == 0
+    assert node.uuid not in _HISTORIES
+    assert parser.outputs["logfile"].content["Energy (Hartree)"] == -109.24578901234568
+    assert "SUMMARY" in parser.outputs["timefile"].content
+
+    parameters = parser.outputs["output_parameters"].get_dict()
+    assert parameters["energy"] == -109.24578901234568
+    assert parameters["fermi_energy"] == -0.2912345678901
+    assert parameters["homo"] == -0.2912345678901
+    assert parameters["forces_max"] == 0.002673
+    assert parameters["scf_iterations"] == 5
+    assert parameters["walltime"] == 38.765432
+    assert parameters["memory_peak"] == 128.456
+
+    arrays = parser.outputs["output_arrays"]
+    assert arrays.get_array("forces").shape == (3, 3)
+    assert arrays.get_array("forces")[0, 0] == -1.234567890123e-03
+    assert arrays.get_array("positions")[1].tolist() == [2.0, 2.0, 0.0]
+    assert arrays.base.attributes.get("symbols") == ["Ti", "O", "O"]
+    assert arrays.base.attributes.get("positions_units") == "angstroem"
+
+    timing = parser.outputs["timing"]
+    assert timing.base.attributes.get("mpi_tasks") == 8
+    assert timing.get_array("wfn_opt_classes").shape == (6, 4)
+
+    # results are filtered in the database
+    parser.outputs["output_parameters"].store()
+    query = QueryBuilder().append(
+        Dict, filters={"attributes.energy": {"<": -109.0}}, project="uuid"
+    )
+    assert parser.outputs["output_parameters"].uuid in query.all(flat=True)
+
+
+def test_parse_packed(aiida_localhost):
+    """Test that the outputs of packed calculations are split per calculation"""
+    structures = {label: StructureData(cell=[[4.0, 0.0, 0.0], [0.0, 4.0, 0.0], [0.0, 0.0, 4.0]]) for label in "ab"}
+    node = generate_calc_node(
+        aiida_localhost,
+        {
+            "log-TiO2-a.yaml": read(LOGFILE),
+            "time-TiO2-a.yaml": read(TIMEFILE),
+            "log-TiO2-b.yaml": read(LOGFILE).replace(b"-1.09245789012345678E+02", b"-1.1E+02"),
+        },
+        entry_point="bigdft.packed",
+        inputs={f"structures__{label}": structure for label, structure in structures.items()},
+    )
+
+    parser = BigDFTPackedParser(node)
+    exit_code = parser.parse()
+
+    # the timefile of b is missing, a is kept
+    assert exit_code.status == parser.exit_codes.ERROR_PACKED_CALCULATION_FAILED.status
+    assert parser.outputs["logfile.a"].filename == "log-TiO2-a.yaml"
+    assert "SUMMARY" in parser.outputs["timefile.a"].content
+    assert parser.outputs["timing.a"].base.attributes.get("mpi_tasks") == 8
+    assert parser.outputs["output_parameters.a"]["energy"] == -109.24578901234568
+    assert parser.outputs["output_parameters.b"]["energy"] == -110.0
+    assert "timefile.b" not in parser.outputs
+
+
+def test_parse_summary_tail(aiida_localhost):
+    """Test that summary mode only reads the end of the log"""
+    node = generate_calc_node(
+        aiida_localhost,
+        {"log-TiO2.yaml": read(LOGFILE), "time-TiO2.yaml": read(TIMEFILE)},
+        summary_tail=4096,
+    )
+
+    parser = BigDFTParser(node)
+    assert parser.parse().status == 0
+
+    parameters = parser.outputs["output_parameters"].get_dict()
+    assert parameters["energy"] == -109.24578901234568
+    assert parameters["memory_peak"] == 128.456
+    # not part of the closing sections
+    assert "scf_iterations" not in parameters
+    assert "fermi_energy" not in parameters
+    assert parser.outputs["output_arrays"].get_array("forces").shape == (3, 3)
+
+
+def test_parse_trajectory(aiida_localhost):
+    """Test that multi-step logs produce a trajectory"""
+    with open(LOGFILE, encoding="utf8") as stream:
+        content = stream.read()
+    steps = [
+        content.replace("-1.09245789012345678E+02", f"-1.1{i}E+02").replace(
+            "Ti: [ 2.000000000", f"Ti: [ 2.{i}00000000"
+        )
+        for i in range(3)
+    ]
+    node = generate_calc_node(
+        aiida_localhost,
+        {"log-TiO2.yaml": "".join(steps).encode(), "time-TiO2.yaml": read(TIMEFILE)},
+    )
+
+    parser = BigDFTParser(node)
+    assert parser.parse().status == 0
+
+    trajectory = parser.outputs["trajectory"]
+    assert trajectory.numsteps == 3
+    assert trajectory.symbols == ["Ti", "O", "O"]
+    assert trajectory.get_positions()[:, 0, 0].tolist() == [2.0, 2.1, 2.2]
+    assert trajectory.get_cells()[0].tolist() == [[4, 0, 0], [0, 4, 0], [0, 0, 4]]
+    assert trajectory.get_array("energies").tolist() == [-110.0, -111.0, -112.0]
+    assert trajectory.get_array("forces").shape == (3, 3, 3)
+    assert parser.outputs["logfile"].get_document(1)["Energy (Hartree)"] == -111.0
+
+
+def test_parse_stderr(aiida_localhost):
+    """Test that scheduler errors found in the stderr set the exit code"""
+    stderr = b"slurmstepd: error: Detected 1 oom-kill event\n" + b"noise\n" * 100
+    node = generate_calc_node(
+        aiida_localhost,
+        {
+            "log-TiO2.yaml": read(LOGFILE),
+            "time-TiO2.yaml": read(TIMEFILE),
+            "_scheduler-stderr.txt": stderr,
+        },
+        scheduler_stderr="_scheduler-stderr.txt",
+    )
+    exit_code = BigDFTParser(node).parse()
+    assert exit_code.status == BigDFTParser(node).exit_codes.ERROR_OUT_OF_MEMORY.status
+
+    node = generate_calc_node(
+        aiida_localhost,
+        {
+            "log-TiO2.yaml": read(LOGFILE),
+            "time-TiO2.yaml": read(TIMEFILE),
+            "_scheduler-stderr.txt": stderr,
+        },
+        scheduler_stderr="_scheduler-stderr.txt",
+        stderr_tail=100,
+    )
+    assert BigDFTParser(node).parse().status == 0
+
+
+def test_parse_scf_monitor(aiida_localhost):
+    """Test that jobs killed by the SCF monitor report it, with their partial outputs"""
+    node = generate_calc_node(
+        aiida_localhost,
+        {
+            "log-TiO2.yaml": read(LOGFILE),
+            "time-TiO2.yaml": read(TIMEFILE),
+            SCF_MONITOR_FILENAME: b"SCF stalls\n",
+        },
+    )
+    parser = BigDFTParser(node)
+    exit_code = parser.parse()
+    assert exit_code.status == parser.exit_codes.ERROR_SCF_NOT_CONVERGING.status
+    assert exit_code.message.endswith("SCF stalls")
+    assert "logfile" in parser.outputs
+
+
+def test_parse_same_jobname(aiida_localhost, tmp_path, monkeypatch):
+    """Test parsing two calculations with the same jobname side by side
+
+    Daemon workers share their working directory, so the file steps of both
+    parsers are interleaved there. Nothing must be written to the directory,
+    each parser must see its own log, and no log may be held in memory as a
+    whole.
+    """
+    monkeypatch.chdir(tmp_path)
+
+    log = read(LOGFILE)
+    logs = [
+        log * 1000,
+        log.replace(b"-1.09245789012345678E+02", b"-1.1E+02") * 1000,
+    ]
+    nodes = [
+        generate_calc_node(
+            aiida_localhost, {"log-TiO2.yaml": content, "time-TiO2.yaml": read(TIMEFILE)}
+        )
+        for content in logs
+    ]
+    parsers = [BigDFTParser(node) for node in nodes]
+
+    tracemalloc.start()
+    logfiles = [parser.parse_file("log-TiO2.yaml", "logfile") for parser in parsers]
+    timefiles = [parser.parse_file("time-TiO2.yaml", "timefile") for parser in parsers]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert not os.listdir(tmp_path)
+    for logfile, content in zip(logfiles, logs):
+        assert logfile.get_content("rb") == content
+    assert all(timefile.filename == "time-TiO2.yaml" for timefile in timefiles)
+    # the previous implementation held a decoded and an encoded copy of each log
+    assert peak < len(logs[0]) / 2
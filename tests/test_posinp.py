@@ -0,0 +1,48 @@
+""" Tests for the posinp writers."""
+import io
+
+from BigDFT.IO import read_xyz, read_yaml
+import numpy as np
+import pytest
+
+from aiida.orm import StructureData
+
+from aiida_bigdft.utils.posinp import write_xyz, write_yaml
+
+
+def generate_structure(pbc=(True, True, True)):
+    """Return a TiO2 rutile cell"""
+    structure = StructureData(cell=[[4.6, 0.0, 0.0], [0.0, 4.6, 0.0], [0.0, 0.0, 2.96]], pbc=pbc)
+    structure.append_atom(position=(0.0, 0.0, 0.0), symbols="Ti")
+    structure.append_atom(position=(1.4, 1.4, 0.0), symbols="O", name="O1")
+    structure.append_atom(position=(3.2, 3.2, 1e-5), symbols="O", name="O2")
+    return structure
+
+
+@pytest.mark.parametrize("write,read", [(write_xyz, read_xyz), (write_yaml, read_yaml)])
+def test_round_trip(write, read):
+    """Test that BigDFT reads back the written structures"""
+    for pbc, conditions in (((True, True, True), "periodic"), ((True, False, True), "surface"), ((False,) * 3, "free")):
+        handle = io.StringIO()
+        write(generate_structure(pbc), handle)
+        handle.seek(0)
+        system = read(handle)
+
+        atoms = [atom for fragment in system.values() for atom in fragment]
+        assert [atom.sym for atom in atoms] == ["Ti", "O", "O"]
+        positions = [atom.get_position("angstroem") for atom in atoms]
+        assert np.allclose(positions, [[0.0, 0.0, 0.0], [1.4, 1.4, 0.0], [3.2, 3.2, 1e-5]], atol=1e-12)
+        assert system.cell.get_boundary_condition().startswith(conditions)
+        if conditions != "free":
+            assert system.cell.get_posinp("angstroem")[::2] == [4.6, 2.96]
+
+
+def test_unsupported():
+    """Test that cells BigDFT cannot handle are rejected"""
+    with pytest.raises(ValueError):
+        write_xyz(generate_structure(pbc=(True, True, False)), io.StringIO())
+
+    structure = generate_structure()
+    structure.set_cell([[4.6, 0.1, 0.0], [0.0, 4.6, 0.0], [0.0, 0.0, 2.96]])
+    with pytest.raises(ValueError):
+        write_yaml(structure, io.StringIO())
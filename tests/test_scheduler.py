@@ -0,0 +1,66 @@
+""" Tests for the classification of scheduler errors."""
+import io
+
+from aiida_bigdft.utils import scheduler
+from aiida_bigdft.utils.scheduler import ENTRY_POINT_GROUP, MAX_LINE, SchedulerErrorClassifier
+
+
+def test_classify_priority():
+    """Test that walltime errors win over memory ones, wherever they appear"""
+    classifier = SchedulerErrorClassifier(chunk_size=16)
+
+    assert classifier.classify("") is None
+    assert classifier.classify("all good\n" * 10) is None
+    assert classifier.classify("slurmstepd: oom-kill event\n") == "ERROR_OUT_OF_MEMORY"
+
+    stderr = (
+        "slurmstepd: error: Detected 1 oom-kill event\n"
+        + "noise\n" * 20
+        + "slurmstepd: error: *** JOB 42 CANCELLED DUE TO TIME LIMIT ***"
+    )
+    assert classifier.classify(stderr) == "ERROR_OUT_OF_WALLTIME"
+    assert classifier.classify(io.BytesIO(stderr.encode())) == "ERROR_OUT_OF_WALLTIME"
+
+
+def test_classify_tail():
+    """Test that only complete lines of the tail are scanned"""
+    classifier = SchedulerErrorClassifier(chunk_size=4)
+    line = "walltime 10 exceeded limit"
+    stderr = io.BytesIO(f"a\nb\n{line}\n".encode())
+
+    assert classifier.classify(stderr, tail=len(line) + 1) == "ERROR_OUT_OF_WALLTIME"
+    # the message line is cut by the seek
+    assert classifier.classify(stderr, tail=len(line)) is None
+    assert classifier.classify(stderr, tail=1000) == "ERROR_OUT_OF_WALLTIME"
+
+
+def test_classify_long_lines():
+    """Test that lines without newlines are scanned with a bounded carry"""
+    classifier = SchedulerErrorClassifier(chunk_size=16)
+    decoded = []
+    scan = classifier._best  # pylint: disable=protected-access
+
+    def recording_best(text, best):
+        decoded.append(len(text))
+        return scan(text, best)
+
+    classifier._best = recording_best  # pylint: disable=protected-access
+    progress = "#" * (3 * MAX_LINE)
+    assert classifier.classify(io.BytesIO(progress.encode())) is None
+    assert max(decoded) <= MAX_LINE + 2 * classifier.chunk_size
+    assert classifier.classify(io.BytesIO(f"{progress}\noom-kill\n".encode())) == "ERROR_OUT_OF_MEMORY"
+    assert classifier.classify(io.BytesIO(b"\xff\xfe" * MAX_LINE + b"oom-kill")) == "ERROR_OUT_OF_MEMORY"
+
+
+def test_entry_points(monkeypatch):
+    """Test that the messages registered by a site are classified after the built-in ones"""
+    site = [("ERROR_OUT_OF_MEMORY", "MPI_ABORT .* ENOMEM")]
+    monkeypatch.setattr(
+        scheduler, "get_entry_point_names", lambda group: ["site"] if group == ENTRY_POINT_GROUP else []
+    )
+    monkeypatch.setattr(scheduler, "load_entry_point", lambda group, name: site)
+
+    classifier = SchedulerErrorClassifier.from_entry_points()
+    assert classifier.errors[-1] == site[0]
+    assert classifier.classify("rank 3: MPI_ABORT called with ENOMEM\n") == "ERROR_OUT_OF_MEMORY"
+    assert classifier.classify("MPI_ABORT ENOMEM\nDUE TO TIME LIMIT\n") == "ERROR_OUT_OF_WALLTIME"
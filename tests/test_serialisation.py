@@ -0,0 +1,29 @@
+""" Tests for the YAML serialisation helpers."""
+import os
+
+from aiida.common.extendeddicts import AttributeDict
+
+from aiida_bigdft.utils import serialisation
+
+from . import TEST_DIR
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
+
+
+def test_identical_output():
+    """Test that libyaml and pure-Python implementations agree"""
+    with open(LOGFILE, "rb") as stream:
+        content = serialisation.load(stream)
+    with open(LOGFILE, "rb") as stream:
+        assert serialisation.load(stream, Loader=serialisation.PySafeLoader) == content
+
+    data = {
+        "log": content,
+        "resources": AttributeDict({"num_machines": 2, "num_mpiprocs_per_machine": 4}),
+        "long": "word " * 100,
+        "unicode": "ångström",
+    }
+    dumped = serialisation.dump(data)
+    assert dumped == serialisation.dump(data, Dumper=serialisation.PySafeDumper)
+    # dict subclasses are written as plain mappings
+    assert serialisation.load(dumped)["resources"] == {"num_machines": 2, "num_mpiprocs_per_machine": 4}
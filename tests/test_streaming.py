@@ -0,0 +1,98 @@
+""" Tests for the event-driven logfile extraction."""
+import io
+import os
+
+import yaml
+
+from aiida_bigdft.utils.streaming import (
+    frontier_orbitals,
+    index_documents,
+    parse_log_stream,
+    parse_log_tail,
+    summary_parameters,
+)
+
+from . import TEST_DIR
+
+LOGFILE = os.path.join(TEST_DIR, "input_files", "log-TiO2.yaml")
+
+
+def test_parse_log_stream():
+    """Test that the streamed summary matches the fully loaded document"""
+    with open(LOGFILE, "rb") as stream:
+        summary = parse_log_stream(stream)
+
+    with open(LOGFILE, encoding="utf8") as stream:
+        full = yaml.safe_load(stream)
+
+    assert summary["documents"] == 1
+    assert summary["energy"] == full["Energy (Hartree)"]
+    assert summary["forces"] == full["Atomic Forces (Ha/Bohr)"]
+    assert summary["warnings"] == full["WARNINGS"]
+    # the FINAL repetition of the last iteration is not part of the history
+    assert [step["iter"] for step in summary["scf_history"]] == [1, 2, 3, 4, 5]
+    assert summary["scf_history"][-1]["gnrm"] == full["Last Iteration"]["gnrm"]
+    assert summary["fermi_energy"] == -0.2912345678901
+    assert summary["structure"] == full["Atomic structure"]
+    assert summary["walltime"] == 38.765432
+    assert summary["memory_peak"] == 128.456
+    assert summary["forces_norm"]["maxval"] == 0.002673
+
+
+def test_summary_parameters():
+    """Test the frontier orbitals and scalar results of a summary"""
+    orbitals = [{"e": -0.5, "f": 2.0}, {"e": -0.3, "f": 2.0}, {"e": 0.1, "f": 0.0}, {"e": 0.2, "f": 0.0}]
+    assert frontier_orbitals(orbitals) == (-0.3, 0.1)
+    assert frontier_orbitals(None) == (None, None)
+
+    with open(LOGFILE, "rb") as stream:
+        parameters = summary_parameters(parse_log_stream(stream))
+    assert parameters["forces_max"] == 0.002673
+    assert parameters["warnings"] == 2
+    assert "lumo" not in parameters
+
+
+def test_parse_log_stream_multidocument():
+    """Test that energy and forces are taken from the last document"""
+    with open(LOGFILE, encoding="utf8") as stream:
+        content = stream.read()
+    second = content.replace("-1.09245789012345678E+02", "-1.1E+02")
+
+    summary = parse_log_stream(io.StringIO(content + second))
+
+    assert summary["documents"] == 2
+    assert summary["energy"] == -110.0
+    assert len(summary["scf_history"]) == 10
+    assert len(summary["warnings"]) == 4
+    assert summary["walltime"] == 2 * 38.765432
+
+
+def test_index_documents():
+    """Test that markers are found across chunk boundaries, reading small chunks"""
+    content = b"# comment\n\n--- !tag\na: 1\n----\n x: ---\n---\nb: 2\n---"
+    expected = [11, 38, 47]
+    for chunk_size in (1, 2, 3, 5, 8, 1024):
+        assert index_documents(io.BytesIO(content), chunk_size=chunk_size) == expected
+    # content before the first marker is a document of its own
+    assert index_documents(io.BytesIO(b"a: 1\n" + content), chunk_size=3) == [0] + [5 + offset for offset in expected]
+    assert index_documents(io.BytesIO(b"# only a comment"), chunk_size=4) == []
+
+
+def test_parse_log_tail():
+    """Test that the closing sections are read from the end of the log only"""
+    with open(LOGFILE, "rb") as stream:
+        content = stream.read()
+    full = parse_log_stream(io.BytesIO(content))
+
+    summary = parse_log_tail(io.BytesIO(content), tail=2048)
+    for key in ("energy", "forces", "warnings", "walltime", "memory_peak"):
+        assert summary[key] == full[key]
+    assert summary["scf_history"] is None
+
+    # closing sections cut by the tail, or missing from a truncated log
+    assert parse_log_tail(io.BytesIO(content), tail=1024) is None
+    assert parse_log_tail(io.BytesIO(content[: len(content) // 2])) is None
+
+    # only the last document is read
+    second = content.replace(b"-1.09245789012345678E+02", b"-1.1E+02")
+    assert parse_log_tail(io.BytesIO(content + second))["energy"] == -110.0
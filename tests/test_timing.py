@@ -0,0 +1,65 @@
+""" Tests for the array representation of time reports."""
+import io
+import os
+
+import numpy as np
+
+from aiida_bigdft.utils.timing import build_timing, get_section, parse_time_report, profile
+
+from . import TEST_DIR
+
+TIMEFILE = os.path.join(TEST_DIR, "input_files", "time-TiO2.yaml")
+
+
+def read():
+    with open(TIMEFILE, encoding="utf8") as stream:
+        return stream.read()
+
+
+def test_parse_time_report():
+    """Test that sections, categories and parallelisation are read"""
+    timing = parse_time_report(io.StringIO(read()))
+
+    assert list(timing["sections"]) == ["INIT", "WFN_OPT", "LAST"]
+    assert timing["mpi_tasks"] == 8
+    assert timing["omp_threads"] == 4
+    names, classes, categories = timing["sections"]["WFN_OPT"]["categories"]
+    assert names[3] == "Allreduce, Large Size"
+    assert classes[3] == "Communications"
+    assert categories[3].tolist() == [12.3, 10.8, 1.42, 0.71]
+
+
+def test_parse_time_report_multidocument():
+    """Test that the documents of appended runs are accumulated"""
+    content = read()
+    timing = parse_time_report(io.StringIO(content + content))
+
+    assert timing["documents"] == 2
+    names, summary = timing["summary"]
+    assert summary[names.index("Total")].tolist() == [100.0, 2 * 98.3]
+    names, classes = timing["sections"]["LAST"]["classes"]
+    assert classes[names.index("Convolutions"), 1] == 2 * 3.98
+    # identical runs keep their percentages and loads
+    _, single = parse_time_report(io.StringIO(content))["sections"]["LAST"]["classes"]
+    np.testing.assert_allclose(classes[:, [0, 2, 3]], single[:, [0, 2, 3]], atol=1)
+
+
+def test_profile():
+    """Test the aggregation of timings by MPI and OpenMP counts"""
+    content = read()
+    serial = build_timing(io.StringIO(
+        content.replace("MPI tasks                   :  8", "MPI tasks                   :  1")
+        .replace("OMP threads                 :  4", "OMP threads                 :  1")
+        .replace("Total                       : [ 100.0,  9.83E+01]", "Total                       : [ 100.0,  1.966E+03]")
+    ))
+    parallel = build_timing(io.StringIO(content))
+
+    assert get_section(parallel, "WFN_OPT")["Total"][1] == 87.7
+    assert parallel.get_array("wfn_opt_categories").shape == (6, 4)
+
+    rows = profile([parallel, serial, parallel])
+    assert [(row["mpi_tasks"], row["omp_threads"], row["runs"]) for row in rows] == [(1, 1, 1), (8, 4, 2)]
+    assert rows[1]["speedup"] == 20.0
+    assert rows[1]["efficiency"] == 20.0 / 32
+    assert 0 < rows[1]["imbalance"] < 1
+    assert abs(sum(rows[1]["classes"].values()) - 100) < 2
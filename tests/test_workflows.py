@@ -0,0 +1,236 @@
+""" Tests for workflows."""
+import numpy as np
+from plumpy import ProcessState
+
+from aiida.common.links import LinkType
+from aiida.engine.utils import instantiate_process
+from aiida.manage import get_manager
+from aiida.orm import ArrayData, CalcJobNode, Dict, List, RemoteData, WorkChainNode
+
+from aiida_bigdft.analysis import ResultsTable
+from aiida_bigdft.calculations import BigDFTCalculation
+from aiida_bigdft.data import BigDFTParameters
+from aiida_bigdft.workflows.base import BigDFTBaseWorkChain, writes_orbitals
+from aiida_bigdft.workflows.convergence import agree, validate_settings
+from aiida_bigdft.workflows.relax import (
+    FIRE,
+    BigDFTRelaxWorkChain,
+    collect_trajectory,
+    fire_step,
+    update_positions,
+)
+from aiida_bigdft.workflows.sweep import parameter_grid, tabulate
+
+from .test_calculations import generate_structure
+
+
+def generate_base_workchain(code, parameters=None, policy=None, **options):
+    """Return a BigDFTBaseWorkChain process, set up"""
+    inputs = {
+        "bigdft": {
+            "code": code,
+            "structure": generate_structure(),
+            "parameters": BigDFTParameters(parameters),
+            "metadata": {"options": {"jobname": "TiO2", "local_dir": "/tmp/TiO2", **options}},
+        },
+    }
+    if policy is not None:
+        inputs["policy"] = Dict(policy)
+    process = instantiate_process(get_manager().get_runner(), BigDFTBaseWorkChain, **inputs)
+    process.setup()
+    return process
+
+
+def generate_failed_calculation(code, exit_code, parameters=None, remote_path="/scratch/failed"):
+    """Return a BigDFTCalculation node which failed with `exit_code`, with its remote folder"""
+    node = CalcJobNode(computer=code.computer, process_type="aiida.calculations:bigdft")
+    node.set_option("resources", {"num_machines": 1, "num_mpiprocs_per_machine": 1})
+    node.set_option("jobname", "TiO2")
+    node.base.links.add_incoming(BigDFTParameters(parameters).store(), link_type=LinkType.INPUT_CALC, link_label="parameters")
+    node.store()
+
+    remote = RemoteData(computer=code.computer, remote_path=str(remote_path))
+    remote.base.links.add_incoming(node, link_type=LinkType.CREATE, link_label="remote_folder")
+    remote.store()
+
+    node.set_process_state(ProcessState.FINISHED)
+    node.set_exit_status(exit_code.status)
+    node.set_exit_message(exit_code.message)
+    node.seal()
+    return node
+
+
+def test_out_of_memory(aiida_local_code_factory):
+    """Test the memory escalation strategies, up to the maximum resources"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    out_of_memory = BigDFTCalculation.exit_codes.ERROR_OUT_OF_MEMORY
+    resources = {"num_machines": 1, "num_mpiprocs_per_machine": 8, "tot_num_mpiprocs": 8}
+
+    process = generate_base_workchain(code, policy={"max_num_machines": 3}, resources=resources)
+    node = generate_failed_calculation(code, out_of_memory)
+    assert process.handle_out_of_memory(node).exit_code.status == 0
+    assert process.ctx.inputs.metadata.options.resources == {
+        "num_machines": 2, "num_mpiprocs_per_machine": 8, "tot_num_mpiprocs": 16
+    }
+    # the failed calculation did not write its orbitals
+    assert "parent_folder" not in process.ctx.inputs
+    process.handle_out_of_memory(node)
+    assert process.ctx.inputs.metadata.options.resources["num_machines"] == 3
+    report = process.handle_out_of_memory(node)
+    assert report.exit_code == process.exit_codes.ERROR_RESOURCES_EXHAUSTED
+
+    process = generate_base_workchain(code, policy={"out_of_memory": "threads"}, resources=resources)
+    process.handle_out_of_memory(node)
+    resources = process.ctx.inputs.metadata.options.resources
+    assert (resources["num_mpiprocs_per_machine"], resources["num_cores_per_mpiproc"]) == (4, 2)
+
+    process = generate_base_workchain(code, policy={"out_of_memory": "memory"}, max_memory_kb=1000)
+    process.handle_out_of_memory(node)
+    assert process.ctx.inputs.metadata.options.max_memory_kb == 2000
+
+
+def test_out_of_walltime(aiida_local_code_factory, tmp_path):
+    """Test that the walltime is extended, and the calculation restarted from its orbitals"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    out_of_walltime = BigDFTCalculation.exit_codes.ERROR_OUT_OF_WALLTIME
+    parameters = {"output": {"orbitals": "binary"}}
+    (tmp_path / "data-TiO2").mkdir()
+    (tmp_path / "data-TiO2" / "wavefunction-k001-NR.bin.b000001").write_bytes(b"")
+    node = generate_failed_calculation(code, out_of_walltime, parameters, remote_path=tmp_path)
+
+    process = generate_base_workchain(code, parameters, policy={"max_wallclock_seconds": 5000}, max_wallclock_seconds=3600)
+    assert process.handle_out_of_walltime(node).exit_code.status == 0
+    assert process.ctx.inputs.metadata.options.max_wallclock_seconds == 5000
+    assert process.ctx.inputs.parent_folder.uuid == node.outputs.remote_folder.uuid
+    assert process.handle_out_of_walltime(node).exit_code == process.exit_codes.ERROR_RESOURCES_EXHAUSTED
+
+    # killed before writing its orbitals
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    for remote_path in (empty, tmp_path / "deleted"):
+        node = generate_failed_calculation(code, out_of_walltime, parameters, remote_path=remote_path)
+        process = generate_base_workchain(code, parameters, max_wallclock_seconds=3600)
+        assert process.handle_out_of_walltime(node).exit_code.status == 0
+        assert "parent_folder" not in process.ctx.inputs
+
+
+def test_writes_orbitals():
+    """Test the output of the orbitals, YAML booleans and numbers included"""
+    assert writes_orbitals({"output": {"orbitals": "binary"}})
+    assert writes_orbitals({"output": {"orbitals": True}})
+    for orbitals in ("none", "None", "No", False, 0, None):
+        assert not writes_orbitals({"output": {"orbitals": orbitals}})
+    assert not writes_orbitals({})
+
+
+def test_fire_step():
+    """Test that FIRE relaxes a harmonic potential, within its maximum step"""
+    minimum = np.array([[0.0, 0.0, 0.0], [1.5, 0.0, 0.0]])
+    positions = minimum + [[0.3, -0.2, 0.1], [-0.4, 0.0, 0.2]]
+    state = {}
+    for _ in range(200):
+        displacements = fire_step(state, -(positions - minimum))
+        assert np.sqrt(np.vdot(displacements, displacements)) <= FIRE["maxstep"] + 1e-12
+        positions += displacements
+    assert np.abs(positions - minimum).max() < 1e-3
+    # the state is kept in the context of a work chain
+    assert isinstance(state["velocities"], list)
+
+
+def test_relax_trajectory():
+    """Test the provenance of the positions, and the trajectory of the steps"""
+    structure = generate_structure()
+    positions = ArrayData()
+    moved = np.array([site.position for site in structure.sites]) + 0.1
+    positions.set_array("positions", moved)
+    updated = update_positions(structure, positions)
+    assert np.allclose([site.position for site in updated.sites], moved)
+    assert updated.cell == structure.cell
+
+    steps = {}
+    for i, step in enumerate((structure, updated)):
+        arrays = ArrayData()
+        arrays.set_array("forces", np.full((len(step.sites), 3), 0.1 / (i + 1)))
+        steps[f"structure_{i}"] = step
+        steps[f"arrays_{i}"] = arrays
+        steps[f"parameters_{i}"] = Dict({"energy": -10.0 - i, "scf_iterations": 20 - 10 * i})
+    trajectory = collect_trajectory(**steps)
+    assert trajectory.numsteps == 2
+    assert np.allclose(trajectory.get_positions()[1], moved)
+    assert trajectory.get_array("energies").tolist() == [-10.0, -11.0]
+    assert trajectory.get_array("forces").shape == (2, len(structure.sites), 3)
+    assert trajectory.get_array("scf_iterations").tolist() == [20, 10]
+
+    # a step without forces, such as a single point log
+    steps["arrays_1"] = ArrayData()
+    steps["arrays_1"].set_array("energies", np.array([-11.0]))
+    forces = collect_trajectory(**steps).get_array("forces")
+    assert np.isnan(forces[1]).all() and not np.isnan(forces[0]).any()
+
+
+def test_relax_no_forces(aiida_local_code_factory):
+    """Test that a step without forces stops the relaxation with an exit code"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    inputs = {
+        "base": {"bigdft": {"code": code, "metadata": {"options": {"jobname": "TiO2", "local_dir": "/tmp/TiO2"}}}},
+        "structure": generate_structure(),
+    }
+    process = instantiate_process(get_manager().get_runner(), BigDFTRelaxWorkChain, **inputs)
+    process.setup()
+
+    step = WorkChainNode().store()
+    arrays = ArrayData()
+    arrays.set_array("energies", np.array([-10.0]))
+    for label, output in (("output_arrays", arrays), ("output_parameters", Dict({"energy": -10.0}))):
+        output.store().base.links.add_incoming(step, link_type=LinkType.RETURN, link_label=label)
+    step.set_process_state(ProcessState.FINISHED)
+    step.set_exit_status(0)
+    step.seal()
+
+    process.ctx.step = step
+    assert process.inspect_step() == process.exit_codes.ERROR_NO_FORCES
+    assert not process.ctx.steps
+
+
+def test_parameter_grid():
+    """Test that the grid holds every combination, over the shared parameters"""
+    grid = parameter_grid({"dft.hgrids": [0.4, 0.5], "dft.nspin": [1, 2]}, {"dft": {"itermax": 5}})
+    assert list(grid) == ["grid_0", "grid_1", "grid_2", "grid_3"]
+    assert grid["grid_1"]["dft"]["itermax"] == 5
+    assert grid["grid_1"]["dft"]["hgrids"] == [0.4, 0.4, 0.4]
+    assert grid["grid_1"]["dft"]["nspin"] == 2
+    assert grid["grid_2"]["dft"]["hgrids"] == [0.5, 0.5, 0.5]
+
+
+def test_sweep_table(aiida_local_code_factory):
+    """Test the results table of a sweep, with a failed calculation"""
+    code = aiida_local_code_factory(entry_point="bigdft", executable="true")
+    # only the pk and uuid of the calculations are read
+    failed, succeeded = (generate_failed_calculation(code, BigDFTCalculation.exit_codes.ERROR_OUT_OF_MEMORY) for _ in range(2))
+    structure = generate_structure().store()
+    rows = [
+        [failed.pk, structure.uuid, "grid_0", 401, None],
+        [succeeded.pk, structure.uuid, "grid_1", 0, "result_0"],
+    ]
+    table = ResultsTable.from_array(tabulate(List(rows), result_0=Dict({"energy": -10.0, "scf_iterations": 12})))
+    assert len(table) == 2
+    assert table["uuid"].tolist() == [failed.uuid, succeeded.uuid]
+    assert table["parameters"].tolist() == ["grid_0", "grid_1"]
+    assert table["exit_status"].tolist() == [401, 0]
+    assert np.isnan(table["energy"][0]) and table["energy"][1] == -10.0
+    assert table["scf_iterations"][1] == 12
+
+
+def test_convergence_agree():
+    """Test the comparison of successive settings, and the validation of the settings"""
+    forces = np.array([[0.01, 0.0, 0.0], [-0.01, 0.0, 0.0]])
+    coarse = {"energy": -10.0, "forces": forces}
+    assert agree(coarse, {"energy": -10.00015, "forces": forces + 5e-5}, 2, 1e-4, 1e-4)
+    # the energy tolerance is per atom
+    assert not agree(coarse, {"energy": -10.00015, "forces": forces}, 1, 1e-4, 1e-4)
+    assert not agree(coarse, {"energy": -10.0, "forces": forces + 2e-4}, 2, 1e-4, 1e-4)
+    assert agree(coarse, {"energy": -10.0, "forces": None}, 2, 1e-4, 1e-4)
+
+    assert validate_settings(List([{"hgrids": 0.45, "rmult": [5, 8]}]), None) is not None
+    assert validate_settings(List([{"hgrids": 0.45}, {"hgrids": 0.4}]), None) is not None
+    assert validate_settings(List([{"hgrids": 0.45, "rmult": [5, 8]}, {"hgrids": 0.4, "rmult": [6, 8]}]), None) is None